@@ -0,0 +1,183 @@
+import csv
+import json
+import logging
+import sqlite3
+import sys
+import zlib
+
+from database import get_db
+
+logger = logging.getLogger(__name__)
+
+ARCHIVE_DB_PATH = 'rides_archive.db'
+
+
+def get_archive_db():
+    return sqlite3.connect(ARCHIVE_DB_PATH)
+
+
+def init_archive_db():
+    """Инициализация архивной базы данных.
+
+    Архив хранит сжатые сегменты: каждый пакет перенесенных строк
+    записывается одной строкой таблицы segments (zlib-сжатый JSON).
+    Сегменты только добавляются и никогда не изменяются.
+    """
+    conn = get_archive_db()
+    cursor = conn.cursor()
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS segments (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            kind TEXT NOT NULL,
+            first_row_id INTEGER NOT NULL,
+            last_row_id INTEGER NOT NULL,
+            row_count INTEGER NOT NULL,
+            columns TEXT NOT NULL,
+            payload BLOB NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            UNIQUE (kind, first_row_id, last_row_id)
+        )
+    ''')
+    conn.commit()
+    conn.close()
+    logger.info("Архивная база данных инициализирована")
+
+
+def _write_segment(archive_conn, kind, columns, rows):
+    """Сжимает пакет строк и добавляет его в архив одним сегментом"""
+    payload = zlib.compress(
+        json.dumps(rows, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+    )
+    # Повторный перенос того же пакета (например, после сбоя между коммитами
+    # архива и основной базы) не создает дубликат сегмента
+    archive_conn.execute('''
+        INSERT OR IGNORE INTO segments (kind, first_row_id, last_row_id, row_count, columns, payload)
+        VALUES (?, ?, ?, ?, ?, ?)
+    ''', (kind, rows[0][0], rows[-1][0], len(rows), json.dumps(columns), payload))
+    archive_conn.commit()
+
+
+def _iter_archive_batches(kind, select_sql, params, batch_size):
+    """Перенос строк из основной базы в архив пакетами (генератор).
+
+    select_sql должен выбирать строки с id > ? в порядке id с LIMIT ?.
+    Каждый пакет сначала фиксируется в архиве и только затем удаляется
+    из основной таблицы, поэтому при сбое строки не теряются.
+    """
+    conn = get_db()
+    cursor = conn.cursor()
+    archive_conn = get_archive_db()
+    last_id = 0
+    try:
+        while True:
+            cursor.execute(select_sql, (last_id, *params, batch_size))
+            rows = cursor.fetchall()
+            if not rows:
+                return
+            columns = [column[0] for column in cursor.description]
+
+            _write_segment(archive_conn, kind, columns, rows)
+
+            row_ids = [row[0] for row in rows]
+            placeholders = ','.join('?' * len(row_ids))
+            cursor.execute(f'DELETE FROM {kind} WHERE id IN ({placeholders})', row_ids)
+            conn.commit()
+            last_id = row_ids[-1]
+
+            yield len(rows)
+            if len(rows) < batch_size:
+                return
+    except Exception as e:
+        logger.error(f"Ошибка при архивировании {kind}: {e}")
+    finally:
+        archive_conn.close()
+        conn.close()
+
+
+def iter_archive_rides_batches(batch_size=500, older_than_days=7):
+    """Пакетный перенос старых неактивных поездок в архив (генератор)"""
+    return _iter_archive_batches('rides', '''
+        SELECT * FROM rides
+        WHERE id > ?
+          AND is_active = 0
+          AND created_at < datetime('now', ?)
+        ORDER BY id
+        LIMIT ?
+    ''', (f'-{older_than_days} days',), batch_size)
+
+
+def iter_archive_searches_batches(retention_days=60, batch_size=500):
+    """Пакетный перенос давно не повторявшихся поисков в архив (генератор)"""
+    return _iter_archive_batches('passenger_searches', '''
+        SELECT * FROM passenger_searches
+        WHERE id > ?
+          AND last_searched_at < datetime('now', ?)
+        ORDER BY id
+        LIMIT ?
+    ''', (f'-{retention_days} days',), batch_size)
+
+
+def archive_old_inactive_rides(batch_size=500, older_than_days=7):
+    """Перенос старых неактивных поездок в архив"""
+    archived_count = sum(iter_archive_rides_batches(batch_size, older_than_days))
+    logger.info(f"Перенесено в архив {archived_count} старых неактивных поездок")
+    return archived_count
+
+
+def iter_archived_rows(kind, since_segment_id=0):
+    """Потоковое чтение архива для аналитики.
+
+    Сегменты читаются и распаковываются по одному, поэтому в памяти
+    одновременно находится не больше одного пакета строк.
+    Возвращает словари {столбец: значение}.
+    """
+    conn = get_archive_db()
+    try:
+        cursor = conn.execute('''
+            SELECT columns, payload FROM segments
+            WHERE kind = ? AND id > ?
+            ORDER BY id
+        ''', (kind, since_segment_id))
+        for columns_json, payload in cursor:
+            columns = json.loads(columns_json)
+            for row in json.loads(zlib.decompress(payload)):
+                yield dict(zip(columns, row))
+    finally:
+        conn.close()
+
+
+def iter_archived_rides(since_segment_id=0):
+    """Потоковое чтение архивных поездок"""
+    return iter_archived_rows('rides', since_segment_id)
+
+
+def get_archive_stats():
+    """Статистика архива: {вид: (сегментов, строк, байт в сжатом виде)}"""
+    conn = get_archive_db()
+    try:
+        cursor = conn.execute('''
+            SELECT kind, COUNT(*), COALESCE(SUM(row_count), 0), COALESCE(SUM(LENGTH(payload)), 0)
+            FROM segments
+            GROUP BY kind
+        ''')
+        return {kind: (segments, rows, size) for kind, segments, rows, size in cursor.fetchall()}
+    except Exception as e:
+        logger.error(f"Ошибка при получении статистики архива: {e}")
+        return {}
+    finally:
+        conn.close()
+
+
+if __name__ == '__main__':
+    # python archive.py stats | python archive.py export rides > rides.csv
+    init_archive_db()
+    if len(sys.argv) >= 3 and sys.argv[1] == 'export':
+        writer = None
+        for record in iter_archived_rows(sys.argv[2]):
+            if writer is None:
+                writer = csv.DictWriter(sys.stdout, fieldnames=list(record))
+                writer.writeheader()
+            writer.writerow(record)
+    else:
+        for kind, (segments, rows, size) in get_archive_stats().items():
+            print(f"{kind}: сегментов {segments}, строк {rows}, {size / 1024:.1f} КБ")
@@ -0,0 +1,168 @@
+import gzip
+import logging
+import os
+import shutil
+import sqlite3
+import sys
+import time
+from datetime import datetime
+
+from database import DB_PATH, get_db
+
+logger = logging.getLogger(__name__)
+
+BACKUP_DIR = 'backups'
+BACKUP_SUFFIX = '.db.gz'
+
+
+class BackupRestartLimit(Exception):
+    """Копирование слишком часто начиналось заново из-за записи в источник"""
+
+
+def list_backups(backup_dir=BACKUP_DIR):
+    """Список снимков от новых к старым"""
+    if not os.path.isdir(backup_dir):
+        return []
+    names = [name for name in os.listdir(backup_dir) if name.endswith(BACKUP_SUFFIX)]
+    return [os.path.join(backup_dir, name) for name in sorted(names, reverse=True)]
+
+
+def rotate_backups(keep=7, backup_dir=BACKUP_DIR):
+    """Удаляет старые снимки, оставляя keep последних"""
+    removed = 0
+    for path in list_backups(backup_dir)[keep:]:
+        try:
+            os.remove(path)
+            removed += 1
+        except OSError as e:
+            logger.error(f"Ошибка при удалении старой резервной копии {path}: {e}")
+    return removed
+
+
+def create_backup(pages_per_step=64, step_pause=0.005, keep=7, max_restarts=3, backup_dir=BACKUP_DIR):
+    """Горячая резервная копия через sqlite3 backup API.
+
+    Копирование идет по pages_per_step страниц за шаг; блокировка источника
+    снимается после каждого шага, а между шагами делается пауза step_pause,
+    чтобы запись в базу не ждала долго. Результат сжимается gzip.
+
+    Запись в источник другим соединением заставляет SQLite начать копирование
+    заново. После max_restarts перезапусков оставшаяся часть копируется
+    одним шагом: в режиме WAL это чтение снимка, которое не блокирует запись.
+
+    Возвращает отчет: объем, длительность, пропускную способность и
+    максимальную длительность шага (время, которое мог ждать писатель).
+    """
+    os.makedirs(backup_dir, exist_ok=True)
+    stamp = datetime.now().strftime('%Y%m%d-%H%M%S')
+    raw_path = os.path.join(backup_dir, f'rides-{stamp}.db')
+    gz_path = raw_path[:-len('.db')] + BACKUP_SUFFIX
+
+    step_times = []
+    last_step_end = None
+    last_remaining = None
+    restarts = 0
+
+    def on_progress(status, remaining, total):
+        nonlocal last_step_end, last_remaining, restarts
+        step_times.append(time.perf_counter() - last_step_end)
+        if last_remaining is not None and remaining > last_remaining:
+            restarts += 1
+            if restarts > max_restarts:
+                raise BackupRestartLimit()
+        last_remaining = remaining
+        # Пауза между шагами: источник в этот момент не заблокирован
+        time.sleep(step_pause)
+        last_step_end = time.perf_counter()
+
+    source = get_db()
+    target = sqlite3.connect(raw_path)
+    single_step = False
+    try:
+        started = time.perf_counter()
+        last_step_end = started
+        try:
+            source.backup(target, pages=pages_per_step, progress=on_progress)
+        except BackupRestartLimit:
+            single_step = True
+            step_started = time.perf_counter()
+            source.backup(target)
+            step_times.append(time.perf_counter() - step_started)
+        copy_duration = time.perf_counter() - started
+        page_size = target.execute("PRAGMA page_size").fetchone()[0]
+        page_count = target.execute("PRAGMA page_count").fetchone()[0]
+    finally:
+        target.close()
+        source.close()
+
+    try:
+        with open(raw_path, 'rb') as raw, gzip.open(gz_path, 'wb') as compressed:
+            shutil.copyfileobj(raw, compressed)
+    finally:
+        os.remove(raw_path)
+
+    db_bytes = page_size * page_count
+    report = {
+        'path': gz_path,
+        'pages': page_count,
+        'db_bytes': db_bytes,
+        'compressed_bytes': os.path.getsize(gz_path),
+        'steps': len(step_times),
+        'restarts': restarts,
+        'single_step': single_step,
+        'copy_duration': copy_duration,
+        'throughput': db_bytes / copy_duration if copy_duration > 0 else 0,
+        'max_step_ms': max(step_times, default=0) * 1000,
+        'avg_step_ms': (sum(step_times) / len(step_times) * 1000) if step_times else 0,
+        'rotated': rotate_backups(keep, backup_dir),
+        'finished_at': datetime.now().strftime('%d.%m.%Y %H:%M:%S'),
+    }
+    logger.info(
+        f"Резервная копия {gz_path}: {page_count} страниц за {copy_duration:.2f} с, "
+        f"макс. шаг {report['max_step_ms']:.1f} мс"
+    )
+    return report
+
+
+def restore_backup(gz_path, db_path=DB_PATH):
+    """Восстановление базы данных из сжатого снимка.
+
+    Снимок распаковывается во временный файл и проверяется
+    PRAGMA integrity_check, после чего переносится в рабочую базу
+    через backup API. Бот на время восстановления нужно остановить.
+    """
+    raw_path = gz_path[:-len(BACKUP_SUFFIX)] + '.restore.db'
+    with gzip.open(gz_path, 'rb') as compressed, open(raw_path, 'wb') as raw:
+        shutil.copyfileobj(compressed, raw)
+
+    source = sqlite3.connect(raw_path)
+    try:
+        result = source.execute("PRAGMA integrity_check").fetchone()[0]
+        if result != 'ok':
+            raise ValueError(f"Снимок {gz_path} поврежден: {result}")
+
+        target = sqlite3.connect(db_path)
+        try:
+            source.backup(target)
+        finally:
+            target.close()
+    finally:
+        source.close()
+        os.remove(raw_path)
+
+    logger.info(f"База данных {db_path} восстановлена из {gz_path}")
+
+
+if __name__ == '__main__':
+    # python backup.py | python backup.py list | python backup.py restore <файл>
+    logging.basicConfig(level=logging.INFO)
+    command = sys.argv[1] if len(sys.argv) > 1 else 'create'
+    if command == 'list':
+        for path in list_backups():
+            print(f"{path} ({os.path.getsize(path) / 1024:.1f} КБ)")
+    elif command == 'restore' and len(sys.argv) > 2:
+        restore_backup(sys.argv[2])
+        print("База данных восстановлена")
+    else:
+        report = create_backup()
+        print(f"Резервная копия создана: {report['path']}")
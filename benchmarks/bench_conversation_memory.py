@@ -0,0 +1,55 @@
+"""Память на состояния пользователей: dict против ConversationState.
+
+Население: 90% пользователей только с выбранной ролью, 10% — посреди
+создания поездки. Память меряется tracemalloc вместе с отображением
+user_id -> состояние, как в Application.user_data.
+
+Запуск из корня репозитория: python benchmarks/bench_conversation_memory.py [пользователей]
+"""
+import gc
+import os
+import sys
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from conversation_state import ConversationState  # noqa: E402
+
+USERS = 1_000_000
+MID_FLOW_EVERY = 10
+
+
+def fill(state, user_id):
+    state['role'] = 'passenger' if user_id % 2 else 'driver'
+    if user_id % MID_FLOW_EVERY == 0:
+        state['create_ride_step'] = 'seats'
+        state['from_location'] = 'Москва'
+        state['to_location'] = 'Казань'
+        state['date'] = '2099-12-31'
+        state['time'] = '10:00'
+    return state
+
+
+def measure(factory, users):
+    gc.collect()
+    tracemalloc.start()
+    states = {user_id: fill(factory(), user_id) for user_id in range(1, users + 1)}
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return states, current
+
+
+def main():
+    users = int(sys.argv[1]) if len(sys.argv) > 1 else USERS
+    print(f"{users} пользователей, каждый {MID_FLOW_EVERY}-й посреди сценария")
+    for name, factory in (('dict', dict), ('ConversationState', ConversationState)):
+        states, total = measure(factory, users)
+        idle = sys.getsizeof(states[1])
+        busy = sys.getsizeof(states[MID_FLOW_EVERY])
+        print(f"{name:>18}: {total / 2 ** 20:.0f} МБ, объект {idle} байт (только роль), "
+              f"{busy} байт (посреди сценария)")
+        del states
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+"""Поиск маршрутов с пересадками на синтетических сетях поездок.
+
+Популярность городов убывает как 1/ранг (несколько крупных узлов и много
+малых пунктов), поездки распределены по 30 дням. Для каждой сети
+меряется построение JourneyIndex и 300 случайных запросов; отдельно —
+плотная сеть из 10 городов, где перебор продолжений самый дорогой.
+
+Запуск из корня репозитория: python benchmarks/bench_journeys.py
+"""
+import os
+import random
+import sys
+import time
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# config.py требует токен, хотя боту здесь обращаться некуда
+os.environ.setdefault('BOT_TOKEN', '123456:BENCHMARK')
+
+from config import (  # noqa: E402
+    JOURNEY_BRANCHING, JOURNEY_MAX_LEGS, JOURNEY_MAX_WAIT, JOURNEY_MIN_TRANSFER, JOURNEY_RESULTS
+)
+from journeys import JourneyIndex  # noqa: E402
+
+DAYS = 30
+QUERIES = 300
+FIRST_DAY = date(2099, 11, 1)
+NETWORKS = ((50, 10000), (200, 30000), (1000, 50000))
+DENSE_NETWORK = (10, 30000)
+
+
+def make_network(cities, rides, seed=1):
+    """Названия городов и строки поездок (id, driver_id, username, откуда, куда, дата, время, мест, version)"""
+    rng = random.Random(seed)
+    names = [f"Город{index}" for index in range(cities)]
+    weights = [1 / (rank + 1) for rank in range(cities)]
+    network = []
+    for ride_id in range(rides):
+        from_location, to_location = rng.choices(names, weights, k=2)
+        if from_location == to_location:
+            continue
+        ride_date = (FIRST_DAY + timedelta(days=rng.randrange(DAYS))).isoformat()
+        ride_time = f"{rng.randrange(24):02d}:{rng.choice(('00', '30'))}"
+        network.append((ride_id, 1, 'driver', from_location, to_location, ride_date, ride_time, 3, 1))
+    return names, network
+
+
+def search(index, from_location, to_location, search_date):
+    return index.search(
+        from_location, to_location, search_date,
+        max_legs=JOURNEY_MAX_LEGS, min_gap=JOURNEY_MIN_TRANSFER, max_wait=JOURNEY_MAX_WAIT,
+        branching=JOURNEY_BRANCHING, limit=JOURNEY_RESULTS
+    )
+
+
+def run(cities, rides, seed=1):
+    names, network = make_network(cities, rides, seed)
+    started = time.perf_counter()
+    index = JourneyIndex(network)
+    build = time.perf_counter() - started
+
+    rng = random.Random(seed + 1)
+    queries = [
+        (rng.choice(names[:max(1, cities // 2)]), rng.choice(names),
+         (FIRST_DAY + timedelta(days=rng.randrange(DAYS))).isoformat())
+        for _ in range(QUERIES)
+    ]
+    found = 0
+    worst = 0
+    started = time.perf_counter()
+    for query in queries:
+        query_started = time.perf_counter()
+        found += bool(search(index, *query))
+        worst = max(worst, time.perf_counter() - query_started)
+    average = (time.perf_counter() - started) / len(queries)
+    print(f"{cities:>5} городов, {index.size:>6} поездок: построение {build * 1e3:.0f} мс, "
+          f"запрос в среднем {average * 1e3:.2f} мс, худший {worst * 1e3:.1f} мс, найдено {found}/{len(queries)}")
+
+
+def main():
+    print(f"Участков до {JOURNEY_MAX_LEGS}, пересадка {JOURNEY_MIN_TRANSFER}-{JOURNEY_MAX_WAIT} мин, "
+          f"ветвление {JOURNEY_BRANCHING}")
+    for cities, rides in NETWORKS + (DENSE_NETWORK,):
+        run(cities, rides)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,70 @@
+"""Запись истории поисков: коммит на каждый поиск против пакетного сброса буфера.
+
+Запуск из корня репозитория: python benchmarks/bench_search_history.py
+База создается во временном каталоге.
+"""
+import logging
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import database  # noqa: E402
+
+SEARCHES = 2000
+BATCH_SIZE = 50
+PASSENGERS = 200
+CITIES = ['Москва', 'Казань', 'Самара', 'Уфа', 'Пермь', 'Киров', 'Чебоксары', 'Йошкар-Ола']
+
+
+def make_searches(seed=1):
+    rng = random.Random(seed)
+    searches = []
+    for _ in range(SEARCHES):
+        from_location, to_location = rng.sample(CITIES, 2)
+        searches.append((rng.randrange(PASSENGERS), from_location, to_location, f"2099-12-{rng.randint(1, 28):02d}"))
+    return searches
+
+
+def run_sync(searches):
+    """Старый путь: INSERT и коммит на каждый поиск"""
+    for search in searches:
+        database.add_passenger_search(*search)
+    return len(searches)
+
+
+def run_buffered(searches):
+    """Буфер в памяти, один коммит на BATCH_SIZE поисков"""
+    commits = 0
+    for search in searches:
+        if database.queue_passenger_search(*search) >= BATCH_SIZE:
+            database.flush_passenger_searches()
+            commits += 1
+    if database.flush_passenger_searches():
+        commits += 1
+    return commits
+
+
+def main():
+    logging.disable(logging.INFO)
+    searches = make_searches()
+    with tempfile.TemporaryDirectory() as workdir:
+        os.chdir(workdir)
+        for name, run in (('по одному', run_sync), ('пакетами', run_buffered)):
+            for suffix in ('', '-wal', '-shm'):
+                if os.path.exists(database.DB_PATH + suffix):
+                    os.remove(database.DB_PATH + suffix)
+            database.init_db()
+            started = time.perf_counter()
+            commits = run(searches)
+            elapsed = time.perf_counter() - started
+            print(f"{name:>10}: {len(searches)} поисков, {commits} коммитов за {elapsed:.2f}с "
+                  f"({commits / elapsed:.0f} коммитов/с, {len(searches) / elapsed:.0f} поисков/с)")
+        os.chdir(os.path.dirname(workdir))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,132 @@
+"""Пропускная способность обработки обновлений в зависимости от числа процессов.
+
+Обновления раздаются так же, как в run_sharded: ShardRouter по user_id в
+очереди процессов. Каждый обработчик делает то же, что поиск по маршруту:
+разбор JSON в Update, страница поиска из общей базы SQLite (WAL) и сборка
+карточек. Считается время от первой раздачи до обработки последнего
+обновления; запуск процессов в замер не входит.
+
+Запуск из корня репозитория: python benchmarks/bench_sharding.py [обновлений]
+"""
+import logging
+import multiprocessing
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from telegram import Update  # noqa: E402
+
+import database  # noqa: E402
+from callbacks import CallbackRegistry  # noqa: E402
+from rendering import RideRenderer  # noqa: E402
+from sharding import ShardRouter  # noqa: E402
+
+UPDATES = 20000
+USERS = 2000
+RIDES = 5000
+DAYS = 28
+WORKER_COUNTS = (1, 2, 4)
+CITIES = ['Москва', 'Казань', 'Самара', 'Уфа', 'Пермь', 'Киров', 'Чебоксары', 'Саранск']
+
+
+def fill_database(seed=1):
+    rng = random.Random(seed)
+    database.init_db()
+    for driver_id in range(1, 201):
+        database.add_user_with_terms(driver_id, f'driver{driver_id}', f'+7900{driver_id:07d}', True)
+    for _ in range(RIDES):
+        from_location, to_location = rng.sample(CITIES, 2)
+        database.add_ride(
+            rng.randint(1, 200), from_location, to_location,
+            f"2099-12-{rng.randint(1, DAYS):02d}", f"{rng.randrange(24):02d}:{rng.choice(('00', '30'))}", 3
+        )
+
+
+def make_updates(seed=2):
+    rng = random.Random(seed)
+    updates = []
+    for update_id in range(1, UPDATES + 1):
+        user_id = 10000 + rng.randrange(USERS)
+        from_location, to_location = rng.sample(CITIES, 2)
+        updates.append({
+            'update_id': update_id,
+            'message': {
+                'message_id': update_id, 'date': 0,
+                'text': f"{from_location} {to_location} 2099-12-{rng.randint(1, DAYS):02d}",
+                'from': {'id': user_id, 'is_bot': False, 'first_name': 'U'},
+                'chat': {'id': user_id, 'type': 'private'},
+            },
+        })
+    return updates
+
+
+def worker(queue, results, workdir):
+    """Процесс-обработчик: поиск и карточки для каждого обновления из очереди"""
+    os.chdir(workdir)
+    callbacks = CallbackRegistry(b'benchmark')
+    callbacks.register('contact', 'c', None, (int,))
+    callbacks.register('register_for_contacts', 'rc', None)
+    renderer = RideRenderer(callbacks)
+    results.put('ready')
+    handled = 0
+    while True:
+        data = queue.get()
+        if data is None:
+            break
+        update = Update.de_json(data, None)
+        from_location, to_location, date = update.message.text.split()
+        rides, _ = database.search_rides_page(from_location, to_location, date)
+        renderer.search_results(rides, from_location, to_location, date, True)
+        handled += 1
+    results.put(handled)
+
+
+def run(workers, updates, workdir):
+    context = multiprocessing.get_context('spawn')
+    queues = [context.Queue() for _ in range(workers)]
+    results = context.Queue()
+    processes = [context.Process(target=worker, args=(queue, results, workdir)) for queue in queues]
+    for process in processes:
+        process.start()
+    for _ in processes:
+        results.get()
+
+    router = ShardRouter(queues)
+    started = time.perf_counter()
+    for data in updates:
+        router.route(data)
+    for queue in queues:
+        queue.put(None)
+    handled = sum(results.get() for _ in processes)
+    elapsed = time.perf_counter() - started
+    for process in processes:
+        process.join()
+    return handled, elapsed, router.routed
+
+
+def main():
+    global UPDATES
+    if len(sys.argv) > 1:
+        UPDATES = int(sys.argv[1])
+    logging.disable(logging.INFO)
+    with tempfile.TemporaryDirectory() as workdir:
+        os.chdir(workdir)
+        fill_database()
+        updates = make_updates()
+        baseline = None
+        print(f"{UPDATES} обновлений от {USERS} пользователей, {RIDES} поездок, CPU: {os.cpu_count()}")
+        for workers in WORKER_COUNTS:
+            handled, elapsed, routed = run(workers, updates, workdir)
+            rate = handled / elapsed
+            baseline = baseline or rate
+            print(f"{workers} процесс(а): {rate:.0f} обновлений/с (x{rate / baseline:.2f}), "
+                  f"по обработчикам: {routed}")
+        os.chdir(os.path.dirname(workdir))
+
+
+if __name__ == '__main__':
+    main()
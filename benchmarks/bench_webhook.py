@@ -0,0 +1,173 @@
+"""Задержка доставки обновлений: webhook против long polling.
+
+Webhook: записанные обновления отправляются на WebhookServer через
+replay_updates, задержка — от отправки запроса до ответа 200 (обновление
+к этому моменту уже передано в on_update).
+
+Polling: локальная замена Bot API отвечает на getUpdates так же, как
+Telegram: держит запрос до появления обновления или истечения timeout.
+Бот — обычный telegram.Bot с base_url на эту замену, цикл как в
+sharding._poll_updates. Задержка — от публикации обновления до получения
+его ботом.
+
+Обновления приходят с паузами PAUSE, как от живых пользователей.
+Запуск из корня репозитория: python benchmarks/bench_webhook.py [обновлений]
+"""
+import asyncio
+import json
+import logging
+import os
+import sys
+import time
+from urllib.parse import parse_qs
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from telegram import Bot  # noqa: E402
+
+from webhook import WebhookServer, replay_updates  # noqa: E402
+
+UPDATES = 500
+PAUSE = 0.002
+POLL_TIMEOUT = 25
+TOKEN = '123456:BENCHMARK'
+BOT_USER = {'id': 1000, 'is_bot': True, 'first_name': 'Bot', 'username': 'bench_bot'}
+
+
+def make_updates(count):
+    return [
+        {
+            'update_id': update_id,
+            'message': {
+                'message_id': update_id, 'date': 0, 'text': 'Москва Казань 31.12',
+                'from': {'id': 100 + update_id % 50, 'is_bot': False, 'first_name': 'U'},
+                'chat': {'id': 100 + update_id % 50, 'type': 'private'},
+            },
+        }
+        for update_id in range(1, count + 1)
+    ]
+
+
+class FakeBotApi:
+    """Замена Bot API: getMe и long polling getUpdates по HTTP/1.1 с keep-alive"""
+
+    def __init__(self):
+        self.pending = []
+        self.published = {}
+        self._arrived = asyncio.Event()
+        self._server = None
+        self.port = None
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle_connection, '127.0.0.1', 0)
+        self.port = self._server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        self._server.close()
+        await self._server.wait_closed()
+
+    def publish(self, update):
+        self.published[update['update_id']] = time.perf_counter()
+        self.pending.append(update)
+        self._arrived.set()
+
+    async def _get_updates(self, params):
+        offset = int(params.get('offset', 0))
+        self.pending = [update for update in self.pending if update['update_id'] >= offset]
+        if not self.pending:
+            self._arrived.clear()
+            try:
+                await asyncio.wait_for(self._arrived.wait(), float(params.get('timeout', 0)))
+            except asyncio.TimeoutError:
+                pass
+        return self.pending[:100]
+
+    async def _handle_connection(self, reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                length = 0
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b''):
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    if name.strip().lower() == 'content-length':
+                        length = int(value)
+                body = await reader.readexactly(length) if length else b''
+                params = {key: values[0] for key, values in parse_qs(body.decode('utf-8')).items()}
+                method = request_line.split()[1].decode('latin-1').rsplit('/', 1)[-1]
+                result = await self._get_updates(params) if method == 'getUpdates' else BOT_USER
+                payload = json.dumps({'ok': True, 'result': result}).encode('utf-8')
+                writer.write(
+                    b'HTTP/1.1 200 OK\r\nContent-Type: application/json\r\n'
+                    + f'Content-Length: {len(payload)}\r\n\r\n'.encode('latin-1') + payload
+                )
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+
+async def bench_webhook(updates):
+    delivered = []
+    server = WebhookServer(delivered.append, port=0, path='/telegram', secret_token='secret')
+    await server.start()
+    latencies = []
+    try:
+        url = f"http://127.0.0.1:{server.port}/telegram"
+        for update in updates:
+            latencies.extend(await replay_updates(url, [update], 'secret'))
+            await asyncio.sleep(PAUSE)
+    finally:
+        await server.stop()
+    assert len(delivered) == len(updates)
+    return latencies
+
+
+async def bench_polling(updates):
+    api = FakeBotApi()
+    await api.start()
+    latencies = []
+    try:
+        async with Bot(TOKEN, base_url=f"http://127.0.0.1:{api.port}/bot") as bot:
+            async def poll():
+                offset = None
+                while len(latencies) < len(updates):
+                    received = await bot.get_updates(
+                        offset=offset, timeout=POLL_TIMEOUT, read_timeout=POLL_TIMEOUT + 10
+                    )
+                    now = time.perf_counter()
+                    for update in received:
+                        latencies.append(now - api.published[update.update_id])
+                        offset = update.update_id + 1
+
+            poller = asyncio.create_task(poll())
+            for update in updates:
+                api.publish(update)
+                await asyncio.sleep(PAUSE)
+            await poller
+    finally:
+        await api.stop()
+    return latencies
+
+
+def report(name, latencies):
+    latencies.sort()
+    print(f"{name:>8}: {len(latencies)} обновлений, медиана {latencies[len(latencies) // 2] * 1e3:.2f} мс, "
+          f"p99 {latencies[int(len(latencies) * 0.99)] * 1e3:.2f} мс, максимум {latencies[-1] * 1e3:.2f} мс")
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else UPDATES
+    logging.disable(logging.INFO)
+    updates = make_updates(count)
+    report('webhook', asyncio.run(bench_webhook(updates)))
+    report('polling', asyncio.run(bench_polling(updates)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,156 @@
+import base64
+import hashlib
+import hmac
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Ограничение Telegram на callback_data
+MAX_CALLBACK_DATA = 64
+SEPARATOR = '.'
+TAG_BYTES = 6
+
+_DIGITS = '0123456789abcdefghijklmnopqrstuvwxyz'
+
+
+def _encode_int(value):
+    if value < 0:
+        raise ValueError(f"Отрицательный параметр кнопки: {value}")
+    if value == 0:
+        return '0'
+    chars = []
+    while value:
+        value, rest = divmod(value, 36)
+        chars.append(_DIGITS[rest])
+    return ''.join(reversed(chars))
+
+
+def _encode_str(value):
+    if not value or SEPARATOR in value:
+        raise ValueError(f"Недопустимый строковый параметр кнопки: {value!r}")
+    return value
+
+
+# Тип параметра -> (кодирование, декодирование)
+_CODECS = {
+    int: (_encode_int, lambda text: int(text, 36)),
+    str: (_encode_str, str),
+}
+
+
+class CallbackAction:
+    __slots__ = ('name', 'code', 'handler', 'params', 'signed', 'admin_only')
+
+    def __init__(self, name, code, handler, params, signed, admin_only):
+        self.name = name
+        self.code = code
+        self.handler = handler
+        self.params = params
+        self.signed = signed
+        self.admin_only = admin_only
+
+
+class CallbackRegistry:
+    """Реестр callback-кнопок: компактная кодировка и разбор за один поиск в словаре.
+
+    Формат: код[.параметр...][.подпись]. Целые параметры пишутся в base36,
+    подпись — первые TAG_BYTES байт HMAC-SHA256 (base64url). Подписываются
+    кнопки с параметрами, чтобы нельзя было подставить чужой id поездки.
+
+    Старые кнопки без параметров в уже отправленных сообщениях (admin_stats)
+    разбираются по имени действия, пока accept_legacy включен. Старые кнопки
+    с id (contact_15) не подписаны и не принимаются: id в них можно подставить.
+    """
+
+    def __init__(self, secret, accept_legacy=True):
+        self._secret = secret
+        self.accept_legacy = accept_legacy
+        self.by_name = {}
+        self.by_code = {}
+        self.rejected = 0
+
+    def register(self, name, code, handler, params=(), signed=None, admin_only=False):
+        if SEPARATOR in code or code in self.by_code or code in self.by_name or name in self.by_code:
+            raise ValueError(f"Код кнопки {code!r} уже занят или недопустим")
+        for param_type in params:
+            if param_type not in _CODECS:
+                raise ValueError(f"Неподдерживаемый тип параметра кнопки: {param_type}")
+        action = CallbackAction(
+            name, code, handler, tuple(params),
+            bool(params) if signed is None else signed,
+            admin_only
+        )
+        self.by_name[name] = action
+        self.by_code[code] = action
+        return action
+
+    def _tag(self, payload):
+        digest = hmac.new(self._secret, payload.encode('utf-8'), hashlib.sha256).digest()
+        return base64.urlsafe_b64encode(digest[:TAG_BYTES]).decode('ascii')
+
+    def encode(self, name, *args):
+        """callback_data для кнопки действия name"""
+        action = self.by_name[name]
+        if len(args) != len(action.params):
+            raise ValueError(f"Кнопка {name} ожидает {len(action.params)} параметров, получено {len(args)}")
+        parts = [action.code]
+        for param_type, value in zip(action.params, args):
+            parts.append(_CODECS[param_type][0](value))
+        payload = SEPARATOR.join(parts)
+        if action.signed:
+            payload += SEPARATOR + self._tag(payload)
+        if len(payload.encode('utf-8')) > MAX_CALLBACK_DATA:
+            raise ValueError(f"callback_data длиннее {MAX_CALLBACK_DATA} байт: {payload}")
+        return payload
+
+    def decode(self, data):
+        """Разбор callback_data: (действие, параметры) или None для битых и поддельных данных"""
+        if not data or len(data) > MAX_CALLBACK_DATA:
+            self.rejected += 1
+            return None
+
+        parts = data.split(SEPARATOR)
+        action = self.by_code.get(parts[0])
+        if action is None:
+            return self._decode_legacy(data)
+
+        expected = 1 + len(action.params) + (1 if action.signed else 0)
+        if len(parts) != expected:
+            self.rejected += 1
+            return None
+        # Дешевые проверки структуры идут до вычисления HMAC
+        try:
+            args = tuple(
+                _CODECS[param_type][1](text)
+                for param_type, text in zip(action.params, parts[1:1 + len(action.params)])
+            )
+        except ValueError:
+            self.rejected += 1
+            return None
+        if action.signed:
+            payload = data[:-(len(parts[-1]) + 1)]
+            if not hmac.compare_digest(parts[-1].encode('utf-8'), self._tag(payload).encode('ascii')):
+                self.rejected += 1
+                logger.debug(f"Отклонена кнопка с неверной подписью: {data}")
+                return None
+        return action, args
+
+    def peek_name(self, data):
+        """Имя действия без проверки параметров и подписи (для классификации нагрузки)"""
+        if not data:
+            return None
+        action = self.by_code.get(data.split(SEPARATOR, 1)[0])
+        if action is None and self.accept_legacy:
+            action = self.by_name.get(data)
+            if action is not None and action.params:
+                action = None
+        return action.name if action else None
+
+    def _decode_legacy(self, data):
+        """Кнопки старого формата без параметров: имя_действия"""
+        if self.accept_legacy:
+            action = self.by_name.get(data)
+            if action is not None and not action.params:
+                return action, ()
+        self.rejected += 1
+        return None
@@ -0,0 +1,74 @@
+import asyncio
+import logging
+
+from telegram.ext import BaseUpdateProcessor
+
+logger = logging.getLogger(__name__)
+
+
+def get_ordering_key(update):
+    """Ключ упорядочивания: обновления с одинаковым ключом обрабатываются строго по очереди"""
+    user = getattr(update, 'effective_user', None)
+    if user is not None:
+        return user.id
+    chat = getattr(update, 'effective_chat', None)
+    if chat is not None:
+        return chat.id
+    return None
+
+
+class PerUserUpdateProcessor(BaseUpdateProcessor):
+    """Параллельная обработка обновлений с сохранением порядка для каждого пользователя.
+
+    Обновления разных пользователей выполняются одновременно (не больше
+    max_concurrent_updates), а обновления одного пользователя выстраиваются
+    в цепочку: каждое ждет завершения предыдущего. Поэтому пошаговые сценарии
+    в context.user_data (создание поездки, поиск, регистрация) не ломаются.
+    """
+
+    def __init__(self, max_concurrent_updates):
+        super().__init__(max_concurrent_updates)
+        # Последнее поставленное в очередь обновление каждого пользователя
+        self._tails = {}
+
+    @property
+    def active_users(self):
+        return len(self._tails)
+
+    async def process_update(self, update, coroutine):
+        key = get_ordering_key(update)
+        if key is None:
+            await super().process_update(update, coroutine)
+            return
+
+        previous = self._tails.get(key)
+        done = asyncio.get_running_loop().create_future()
+        self._tails[key] = done
+        # Убираем пользователя из словаря, когда его цепочка полностью завершена
+        done.add_done_callback(lambda _: self._tails.pop(key, None) if self._tails.get(key) is done else None)
+
+        try:
+            if previous is not None:
+                try:
+                    # shield: отмена этого обновления не должна отменять предшественника
+                    await asyncio.shield(previous)
+                except asyncio.CancelledError:
+                    coroutine.close()
+                    raise
+            await super().process_update(update, coroutine)
+        finally:
+            if previous is not None and not previous.done():
+                # Нас отменили раньше, чем закончил предшественник:
+                # следующее обновление должно дождаться и его
+                previous.add_done_callback(lambda _: done.done() or done.set_result(None))
+            elif not done.done():
+                done.set_result(None)
+
+    async def do_process_update(self, update, coroutine):
+        await coroutine
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
@@ -4,7 +4,124 @@ TOKEN = os.getenv('BOT_TOKEN')
 REQUIRED_CHANNEL = '@yuldar02'  # или ID канала (например: -1001234567890)
 ADMIN_IDS = [5117701931]  # Замените на ваши user_id
 
+# Отложенная запись истории поисков: сброс каждые N мс или при накоплении N записей
+SEARCH_HISTORY_FLUSH_INTERVAL_MS = 500
+SEARCH_HISTORY_BATCH_SIZE = 50
+
+# Ограничение истории поисков: записей на пользователя и срок хранения в днях
+SEARCH_HISTORY_MAX_PER_USER = 30
+SEARCH_HISTORY_RETENTION_DAYS = 60
+
+# Пакетная очистка БД: строк в одной транзакции и пауза между пакетами (сек)
+CLEANUP_BATCH_SIZE = 500
+CLEANUP_BATCH_PAUSE = 0.05
+
+# Неактивные поездки старше N дней переносятся в архив (rides_archive.db)
+ARCHIVE_RIDES_AFTER_DAYS = 7
+
+# Обслуживание БД: период запуска (сек), сколько секунд без обновлений считать
+# тихим периодом, страниц за шаг инкрементального VACUUM и максимум шагов,
+# период полного ANALYZE (сек)
+MAINTENANCE_INTERVAL = 900
+MAINTENANCE_IDLE_SECONDS = 60
+MAINTENANCE_VACUUM_PAGES = 200
+MAINTENANCE_VACUUM_STEPS = 20
+MAINTENANCE_ANALYZE_INTERVAL = 86400
+
+# Резервное копирование: период (сек), сколько снимков хранить,
+# страниц за шаг backup API и пауза между шагами (сек)
+BACKUP_INTERVAL = 86400
+BACKUP_KEEP = 7
+BACKUP_PAGES_PER_STEP = 64
+BACKUP_STEP_PAUSE = 0.005
+
+# Сколько обновлений разных пользователей обрабатывать одновременно
+UPDATE_CONCURRENCY = int(os.getenv('UPDATE_CONCURRENCY', '32'))
+# Как часто записывать измененные пошаговые сценарии пользователей (секунды)
+CONVERSATION_FLUSH_INTERVAL = 2
+# Через сколько секунд бездействия состояние пользователя выгружается из памяти
+CONVERSATION_IDLE_TTL = 1800
+CONVERSATION_EVICT_INTERVAL = 300
+
+# Принимать кнопки старого формата без параметров (admin_stats) из ранее отправленных сообщений
+CALLBACK_ACCEPT_LEGACY = os.getenv('CALLBACK_ACCEPT_LEGACY', '1') == '1'
+
+# Ограничение частоты действий пользователя: класс -> (токенов в секунду, максимум)
+THROTTLE_LIMITS = {
+    'search': (0.2, 6),
+    'refresh': (0.1, 3),
+    'contact': (0.5, 5),
+    'page': (1, 10),
+    'inline': (5, 30),
+    'default': (2, 20),
+}
+# Пороги задержки (секунды), выше которых отбрасывается второстепенная работа
+SHED_DB_LATENCY = 0.2
+SHED_API_LATENCY = 1.5
+
+# Исходящие сообщения: общий лимит бота (в секунду), лимиты на чат и допустимый всплеск.
+# Общий лимит и лимит групп — на всего бота: при WORKER_PROCESSES > 1 они делятся между процессами
+OUTBOUND_RATE = 25
+OUTBOUND_BURST = 5
+OUTBOUND_PRIVATE_RATE = 1.0
+OUTBOUND_GROUP_RATE = 20 / 60
+OUTBOUND_CHAT_BURST = 3
+
+# Сколько готовых карточек поездок держать в памяти каждого процесса
+RIDE_CARD_CACHE_SIZE = 5000
+# Поездок на одной странице результатов поиска и актуальных поездок
+SEARCH_PAGE_SIZE = int(os.getenv('SEARCH_PAGE_SIZE', '10'))
+
+# Сколько секунд кэшируются поездки и поиски, открытые по ссылке t.me/<бот>?start=...
+DEEP_LINK_CACHE_TTL = 30
+
+# Inline-режим (@бот Москва Казань 31.12): сколько секунд Telegram хранит ответ,
+# сколько секунд бот хранит готовые результаты запроса, результатов в одном
+# ответе и всего на запрос
+INLINE_CACHE_TIME = 60
+INLINE_RESULTS_TTL = 30
+INLINE_PAGE_SIZE = 20
+INLINE_MAX_RESULTS = 100
+
+# Подсказки пунктов: как часто пополнять индекс новыми поездками и поисками (сек)
+# и сколько вариантов показывать кнопками
+LOCATION_INDEX_REFRESH = 60
+LOCATION_SUGGESTIONS = 6
+
+# Поиск с пересадками: максимум участков, минут между выездами соседних участков
+# (времени прибытия у поездок нет — это дорога плюс пересадка), максимум минут
+# ожидания следующего участка, продолжений в каждом пункте пересадки, вариантов
+# в ответе и период перестройки графа поездок (сек)
+JOURNEY_MAX_LEGS = 3
+JOURNEY_MIN_TRANSFER = 180
+JOURNEY_MAX_WAIT = 1440
+JOURNEY_BRANCHING = 20
+JOURNEY_RESULTS = 3
+JOURNEY_INDEX_REFRESH = 60
+
+# Аренда ведущего экземпляра: только он выполняет периодические задачи
+LEADER_LEASE_TTL = 60
+LEADER_RENEW_INTERVAL = 15
+
+# Количество процессов-обработчиков (обновления распределяются по user_id)
+WORKER_PROCESSES = int(os.getenv('WORKER_PROCESSES', '1'))
+
+# Режим получения обновлений: polling или webhook
+RUN_MODE = os.getenv('RUN_MODE', 'polling')
+# Публичный HTTPS-адрес webhook (например: https://example.com/telegram)
+WEBHOOK_URL = os.getenv('WEBHOOK_URL')
+# Локальный адрес встроенного HTTP-сервера (за обратным прокси)
+WEBHOOK_LISTEN = os.getenv('WEBHOOK_LISTEN', '127.0.0.1')
+WEBHOOK_PORT = int(os.getenv('WEBHOOK_PORT', '8443'))
+WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', '/telegram')
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET')
+
 if TOKEN is None:
     raise ValueError(
         "Токен бота не найден!"
     )
+
+if RUN_MODE == 'webhook' and (not WEBHOOK_URL or not WEBHOOK_SECRET):
+    raise ValueError(
+        "Для режима webhook нужны WEBHOOK_URL и WEBHOOK_SECRET!"
+    )
@@ -0,0 +1,68 @@
+import time
+from collections.abc import MutableMapping
+
+
+class ConversationState(MutableMapping):
+    """Состояние пошаговых сценариев пользователя (context.user_data).
+
+    Поля фиксированы через __slots__: у объекта нет собственного __dict__,
+    а незаданное поле не занимает места под ключ. Интерфейс словаря
+    сохранен (context.user_data['role'], 'role' in ..., del ...), поэтому
+    обработчики не меняются; неизвестный ключ — ошибка, а не новое поле.
+    """
+
+    FIELDS = (
+        # Выбранная роль: driver / passenger
+        'role',
+        # Создание поездки
+        'create_ride_step', 'from_location', 'to_location', 'date', 'time', 'seats',
+        # Поиск поездки
+        'search_ride_step', 'search_from', 'search_to',
+        # Незнакомый пункт, для которого показаны подсказки
+        'location_hint',
+        # Регистрация
+        'registration_step', 'register_after_search',
+        # Рассылка (админ)
+        'broadcast_step', 'broadcast_message',
+    )
+    __slots__ = FIELDS + ('touched_at',)
+
+    def __init__(self):
+        self.touched_at = time.monotonic()
+
+    def touch(self):
+        self.touched_at = time.monotonic()
+
+    def _check_key(self, key):
+        if key not in self.FIELDS:
+            raise KeyError(key)
+
+    def __getitem__(self, key):
+        self._check_key(key)
+        try:
+            return getattr(self, key)
+        except AttributeError:
+            raise KeyError(key) from None
+
+    def __setitem__(self, key, value):
+        self._check_key(key)
+        setattr(self, key, value)
+
+    def __delitem__(self, key):
+        self._check_key(key)
+        try:
+            delattr(self, key)
+        except AttributeError:
+            raise KeyError(key) from None
+
+    def __contains__(self, key):
+        return key in self.FIELDS and hasattr(self, key)
+
+    def __iter__(self):
+        return (key for key in self.FIELDS if hasattr(self, key))
+
+    def __len__(self):
+        return sum(1 for key in self.FIELDS if hasattr(self, key))
+
+    def __repr__(self):
+        return f'ConversationState({dict(self)!r})'
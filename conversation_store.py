@@ -0,0 +1,134 @@
+import json
+import logging
+import threading
+import time
+
+from database import get_db
+
+logger = logging.getLogger(__name__)
+
+# Последнее сохраненное (или загруженное) состояние каждого пользователя
+_snapshots = {}
+# Измененные состояния, ожидающие записи: user_id -> сериализованные данные
+_dirty = {}
+_lock = threading.Lock()
+
+
+def init_conversation_store():
+    """Таблица для пошаговых сценариев пользователей (context.user_data)"""
+    conn = get_db()
+    cursor = conn.cursor()
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS user_state (
+            user_id INTEGER PRIMARY KEY,
+            data TEXT NOT NULL,
+            updated_at REAL NOT NULL
+        )
+    ''')
+    conn.commit()
+    conn.close()
+
+
+def serialize_state(data):
+    """Компактный JSON без пробелов; порядок ключей фиксирован для сравнения"""
+    return json.dumps(dict(data), ensure_ascii=False, separators=(',', ':'), sort_keys=True)
+
+
+def is_state_loaded(user_id):
+    return user_id in _snapshots
+
+
+def load_user_state(user_id):
+    """Ленивая загрузка состояния пользователя при первом обновлении от него.
+
+    Возвращает словарь (пустой, если состояния нет) или None,
+    если состояние уже загружено в этом процессе.
+    """
+    if user_id in _snapshots:
+        return None
+
+    conn = get_db()
+    cursor = conn.cursor()
+    try:
+        cursor.execute('SELECT data FROM user_state WHERE user_id = ?', (user_id,))
+        row = cursor.fetchone()
+    except Exception as e:
+        logger.error(f"Ошибка при загрузке состояния пользователя {user_id}: {e}")
+        row = None
+    finally:
+        conn.close()
+
+    data = row[0] if row else serialize_state({})
+    with _lock:
+        _snapshots[user_id] = data
+    return json.loads(data)
+
+
+def track_user_state(user_id, data):
+    """Сравнивает состояние с последним снимком и ставит изменения в очередь записи.
+
+    Возвращает True, если состояние изменилось.
+    """
+    serialized = serialize_state(data)
+    with _lock:
+        if _snapshots.get(user_id) == serialized:
+            return False
+        _snapshots[user_id] = serialized
+        _dirty[user_id] = serialized
+        return True
+
+
+def forget_user_state(user_id):
+    """Убирает снимок из памяти; при следующем обновлении состояние загрузится заново.
+
+    Возвращает False, если изменения пользователя еще не записаны.
+    """
+    with _lock:
+        if user_id in _dirty:
+            return False
+        _snapshots.pop(user_id, None)
+        return True
+
+
+def pending_user_states():
+    return len(_dirty)
+
+
+def flush_user_states():
+    """Пакетная запись измененных состояний одним коммитом"""
+    with _lock:
+        if not _dirty:
+            return 0
+        batch = dict(_dirty)
+        _dirty.clear()
+
+    now = time.time()
+    empty = serialize_state({})
+    upserts = [(user_id, data, now) for user_id, data in batch.items() if data != empty]
+    deletes = [(user_id,) for user_id, data in batch.items() if data == empty]
+
+    conn = get_db()
+    cursor = conn.cursor()
+    try:
+        if upserts:
+            cursor.executemany('''
+                INSERT INTO user_state (user_id, data, updated_at)
+                VALUES (?, ?, ?)
+                ON CONFLICT(user_id) DO UPDATE SET
+                    data = excluded.data,
+                    updated_at = excluded.updated_at
+            ''', upserts)
+        if deletes:
+            # Завершенный сценарий не оставляет строку в таблице
+            cursor.executemany('DELETE FROM user_state WHERE user_id = ?', deletes)
+        conn.commit()
+        return len(batch)
+    except Exception as e:
+        logger.error(f"Ошибка при сохранении состояний пользователей: {e}")
+        # Возвращаем пакет в очередь, если за это время состояние не менялось еще раз
+        with _lock:
+            for user_id, data in batch.items():
+                _dirty.setdefault(user_id, data)
+        return 0
+    finally:
+        conn.close()
@@ -1,19 +1,33 @@
+import os
 import sqlite3
 import logging
+import threading
 from datetime import datetime, timedelta
 
 # Настройка логирования
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+DB_PATH = 'rides.db'
+
+
 def get_db():
-    return sqlite3.connect('rides.db')
+    return sqlite3.connect(DB_PATH)
+
+
+# Буфер отложенной записи истории поисков (write-behind)
+_search_buffer = []
+_search_buffer_lock = threading.Lock()
+
 
 def init_db():
     """Инициализация базы данных с поддержкой миграций"""
     conn = get_db()
     cursor = conn.cursor()
 
+    # Режим auto_vacuum нужно включить до создания таблиц
+    enable_incremental_vacuum(cursor)
+
     # Создаем таблицу пользователей
     cursor.execute('''
         CREATE TABLE IF NOT EXISTS users (
@@ -39,6 +53,7 @@ def init_db():
             is_active BOOLEAN DEFAULT 1,
             last_check TIMESTAMP,
             created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            version INTEGER DEFAULT 1,
             FOREIGN KEY (driver_id) REFERENCES users(user_id)
         )
     ''')
@@ -52,10 +67,15 @@ def init_db():
             to_location TEXT,
             search_date TEXT,
             created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            hit_count INTEGER DEFAULT 1,
+            last_searched_at TIMESTAMP,
             FOREIGN KEY (passenger_id) REFERENCES users(user_id)
         )
     ''')
 
+    # WAL: чтение не блокируется записью, пакетная очистка не останавливает поиск
+    cursor.execute('PRAGMA journal_mode=WAL')
+
     # Выполняем миграции для существующих таблиц
     migrate_database(cursor)
 
@@ -63,6 +83,20 @@ def init_db():
     conn.close()
     logger.info("База данных инициализирована")
 
+def enable_incremental_vacuum(cursor):
+    """Включает auto_vacuum=INCREMENTAL, чтобы освобождать страницы небольшими шагами"""
+    cursor.execute("PRAGMA auto_vacuum")
+    if cursor.fetchone()[0] == 2:
+        return
+
+    cursor.execute("PRAGMA auto_vacuum = INCREMENTAL")
+    cursor.execute("SELECT COUNT(*) FROM sqlite_master")
+    if cursor.fetchone()[0] > 0:
+        # Для существующей базы новый режим вступает в силу только после полного VACUUM
+        logger.info("Перестраиваем базу данных для auto_vacuum=INCREMENTAL (однократно)")
+        cursor.execute("VACUUM")
+
+
 def migrate_database(cursor):
     """Выполняет миграции для обновления структуры базы данных"""
 
@@ -111,6 +145,14 @@ def migrate_database(cursor):
         except Exception as e:
             logger.error(f"Ошибка при добавлении столбца created_at: {e}")
 
+    # Версия поездки увеличивается при каждом изменении (по ней кэшируются карточки)
+    if 'version' not in columns:
+        try:
+            cursor.execute('ALTER TABLE rides ADD COLUMN version INTEGER DEFAULT 1')
+            logger.info("Добавлен столбец version в таблицу rides")
+        except Exception as e:
+            logger.error(f"Ошибка при добавлении столбца version: {e}")
+
     # Для существующих записей устанавливаем is_active = 1 и last_check = текущее время
     cursor.execute('''
         UPDATE rides
@@ -127,6 +169,104 @@ def migrate_database(cursor):
         WHERE accepted_terms IS NULL AND user_id IN (SELECT DISTINCT driver_id FROM rides)
     ''')
 
+    # Индекс для пакетного поиска просроченных активных поездок
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_rides_active_date
+        ON rides (is_active, date)
+    ''')
+
+    # Индекс для поиска по маршруту и постраничного вывода по (time, id)
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_rides_route
+        ON rides (from_location, to_location, date, time)
+    ''')
+
+    migrate_passenger_searches(cursor)
+
+
+def migrate_passenger_searches(cursor):
+    """Перевод истории поисков на хранение без дубликатов (upsert со счетчиком)"""
+    cursor.execute("PRAGMA table_info(passenger_searches)")
+    columns = [column[1] for column in cursor.fetchall()]
+
+    if 'hit_count' not in columns:
+        try:
+            cursor.execute('ALTER TABLE passenger_searches ADD COLUMN hit_count INTEGER DEFAULT 1')
+            logger.info("Добавлен столбец hit_count в таблицу passenger_searches")
+        except Exception as e:
+            logger.error(f"Ошибка при добавлении столбца hit_count: {e}")
+
+    if 'last_searched_at' not in columns:
+        try:
+            cursor.execute('ALTER TABLE passenger_searches ADD COLUMN last_searched_at TIMESTAMP')
+            logger.info("Добавлен столбец last_searched_at в таблицу passenger_searches")
+        except Exception as e:
+            logger.error(f"Ошибка при добавлении столбца last_searched_at: {e}")
+
+    cursor.execute('''
+        UPDATE passenger_searches
+        SET last_searched_at = created_at
+        WHERE last_searched_at IS NULL
+    ''')
+
+    cursor.execute('''
+        SELECT 1 FROM sqlite_master
+        WHERE type = 'index' AND name = 'idx_passenger_searches_key'
+    ''')
+    if cursor.fetchone() is None:
+        # Схлопываем накопленные дубликаты в одну запись со счетчиком повторов.
+        # Индекса по ключу еще нет: один GROUP BY (сортировка) во временную
+        # таблицу вместо коррелированных подзапросов на каждую строку
+        cursor.execute('''
+            CREATE TEMP TABLE passenger_search_duplicates (
+                id INTEGER PRIMARY KEY,
+                hit_count INTEGER,
+                last_searched_at TIMESTAMP
+            )
+        ''')
+        cursor.execute('''
+            INSERT INTO passenger_search_duplicates
+            SELECT MAX(id), SUM(COALESCE(hit_count, 1)), MAX(last_searched_at)
+            FROM passenger_searches
+            GROUP BY passenger_id, from_location, to_location, search_date
+            HAVING COUNT(*) > 1
+        ''')
+        cursor.execute('''
+            UPDATE passenger_searches
+            SET hit_count = (
+                    SELECT dup.hit_count FROM passenger_search_duplicates AS dup
+                    WHERE dup.id = passenger_searches.id
+                ),
+                last_searched_at = (
+                    SELECT dup.last_searched_at FROM passenger_search_duplicates AS dup
+                    WHERE dup.id = passenger_searches.id
+                )
+            WHERE id IN (SELECT id FROM passenger_search_duplicates)
+        ''')
+        cursor.execute('DROP TABLE passenger_search_duplicates')
+        cursor.execute('''
+            DELETE FROM passenger_searches
+            WHERE id NOT IN (
+                SELECT MAX(id) FROM passenger_searches
+                GROUP BY passenger_id, from_location, to_location, search_date
+            )
+        ''')
+        if cursor.rowcount > 0:
+            logger.info(f"Удалено {cursor.rowcount} дубликатов в истории поисков")
+        cursor.execute('''
+            CREATE UNIQUE INDEX idx_passenger_searches_key
+            ON passenger_searches (passenger_id, from_location, to_location, search_date)
+        ''')
+
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_passenger_searches_recent
+        ON passenger_searches (passenger_id, last_searched_at)
+    ''')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_passenger_searches_last_searched
+        ON passenger_searches (last_searched_at)
+    ''')
+
 
 def add_user(user_id, username, phone):
     """Добавление пользователя (старая версия для обратной совместимости)"""
@@ -263,7 +403,7 @@ def update_ride_status(ride_id, is_active):
         current_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
         cursor.execute('''
             UPDATE rides
-            SET is_active = ?, last_check = ?
+            SET is_active = ?, last_check = ?, version = version + 1
             WHERE id = ?
         ''', (1 if is_active else 0, current_time, ride_id))
         conn.commit()
@@ -315,7 +455,8 @@ def search_rides(from_location, to_location, date):
                 to_location,
                 date,
                 time,
-                seats
+                seats,
+                version
             FROM rides
             WHERE from_location = ?
               AND to_location = ?
@@ -335,6 +476,205 @@ def search_rides(from_location, to_location, date):
         conn.close()
 
 
+def search_rides_page(from_location, to_location, date, cursor=None, backward=False, limit=10, conn=None):
+    """Страница результатов поиска без выборки всего списка.
+
+    Постраничный вывод по ключу (time, id): cursor — ключ крайней поездки
+    соседней страницы, backward — листать назад от него. Стоимость запроса
+    не зависит от номера страницы. Возвращает (поездки, есть ли еще
+    страница в этом направлении). conn — открытое соединение вызывающего кода.
+    """
+    own_conn = conn is None
+    if own_conn:
+        conn = get_db()
+    cursor_db = conn.cursor()
+    try:
+        params = [from_location, to_location, date]
+        keyset = ''
+        if cursor is not None:
+            keyset = 'AND (time, id) ' + ('< (?, ?)' if backward else '> (?, ?)')
+            params.extend(cursor)
+        order = 'DESC' if backward else 'ASC'
+        params.append(limit + 1)
+
+        cursor_db.execute(f'''
+            SELECT
+                id,
+                driver_id,
+                driver_username,
+                from_location,
+                to_location,
+                date,
+                time,
+                seats,
+                version
+            FROM rides
+            WHERE from_location = ?
+              AND to_location = ?
+              AND date = ?
+              AND is_active = 1
+              AND seats > 0
+              {keyset}
+            ORDER BY time {order}, id {order}
+            LIMIT ?
+        ''', params)
+
+        rows = cursor_db.fetchall()
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        if backward:
+            rows.reverse()
+        return rows, has_more
+    except Exception as e:
+        logger.error(f"Ошибка при поиске поездок: {e}")
+        return [], False
+    finally:
+        if own_conn:
+            conn.close()
+
+
+def get_upcoming_route_rides(from_location, to_location, from_date, limit=50):
+    """Ближайшие поездки по маршруту начиная с даты from_date (YYYY-MM-DD).
+
+    Для inline-поиска без даты; читает idx_rides_route по диапазону дат.
+    """
+    conn = get_db()
+    cursor = conn.cursor()
+    try:
+        cursor.execute('''
+            SELECT
+                id,
+                driver_id,
+                driver_username,
+                from_location,
+                to_location,
+                date,
+                time,
+                seats,
+                version
+            FROM rides
+            WHERE from_location = ?
+              AND to_location = ?
+              AND date >= ?
+              AND is_active = 1
+              AND seats > 0
+            ORDER BY date, time, id
+            LIMIT ?
+        ''', (from_location, to_location, from_date, limit))
+        return cursor.fetchall()
+    except Exception as e:
+        logger.error(f"Ошибка при поиске ближайших поездок: {e}")
+        return []
+    finally:
+        conn.close()
+
+
+def get_active_rides_snapshot(from_date):
+    """Все активные поездки со свободными местами начиная с from_date (для поиска с пересадками)"""
+    conn = get_db()
+    cursor = conn.cursor()
+    try:
+        cursor.execute('''
+            SELECT
+                id,
+                driver_id,
+                driver_username,
+                from_location,
+                to_location,
+                date,
+                time,
+                seats,
+                version
+            FROM rides
+            WHERE is_active = 1
+              AND date >= ?
+              AND seats > 0
+        ''', (from_date,))
+        return cursor.fetchall()
+    except Exception as e:
+        logger.error(f"Ошибка при выборке активных поездок: {e}")
+        return []
+    finally:
+        conn.close()
+
+
+def get_nearest_ride_dates(from_location, to_location, date, today):
+    """Ближайшие даты до и после date, на которые по маршруту есть свободные места.
+
+    Один запрос из двух коротких проходов по idx_rides_route в обе стороны
+    от даты; прошедшие даты (раньше today) не предлагаются. Возвращает
+    [(дата, id одной из поездок в этот день)] по возрастанию даты.
+    """
+    conn = get_db()
+    cursor = conn.cursor()
+    try:
+        cursor.execute('''
+            SELECT date, id FROM (
+                SELECT date, id
+                FROM rides
+                WHERE from_location = ? AND to_location = ?
+                  AND date < ? AND date >= ?
+                  -- «+» не дает планировщику взять idx_rides_active_date по диапазону дат всех маршрутов
+                  AND +is_active = 1 AND seats > 0
+                ORDER BY date DESC
+                LIMIT 1
+            )
+            UNION ALL
+            SELECT date, id FROM (
+                SELECT date, id
+                FROM rides
+                WHERE from_location = ? AND to_location = ?
+                  AND date > ?
+                  AND +is_active = 1 AND seats > 0
+                ORDER BY date
+                LIMIT 1
+            )
+        ''', (from_location, to_location, date, today, from_location, to_location, date))
+        return cursor.fetchall()
+    except Exception as e:
+        logger.error(f"Ошибка при поиске ближайших дат: {e}")
+        return []
+    finally:
+        conn.close()
+
+
+def get_location_counts(after_ride_id=0, after_search_id=0):
+    """Упоминания пунктов в поездках и поисках, добавленных после указанных id.
+
+    Возвращает ([(пункт, число)], последний id поездки, последний id поиска):
+    с этих id начнется следующее пополнение индекса подсказок.
+    """
+    conn = get_db()
+    cursor = conn.cursor()
+    try:
+        # Сначала границы, чтобы строки, добавленные во время подсчета, не потерялись
+        cursor.execute('SELECT COALESCE(MAX(id), 0) FROM rides')
+        ride_id = max(cursor.fetchone()[0], after_ride_id)
+        cursor.execute('SELECT COALESCE(MAX(id), 0) FROM passenger_searches')
+        search_id = max(cursor.fetchone()[0], after_search_id)
+
+        cursor.execute('''
+            SELECT name, COUNT(*)
+            FROM (
+                SELECT from_location AS name FROM rides WHERE id > ? AND id <= ?
+                UNION ALL
+                SELECT to_location FROM rides WHERE id > ? AND id <= ?
+                UNION ALL
+                SELECT from_location FROM passenger_searches WHERE id > ? AND id <= ?
+                UNION ALL
+                SELECT to_location FROM passenger_searches WHERE id > ? AND id <= ?
+            )
+            WHERE name IS NOT NULL
+            GROUP BY name
+        ''', (after_ride_id, ride_id) * 2 + (after_search_id, search_id) * 2)
+        return cursor.fetchall(), ride_id, search_id
+    except Exception as e:
+        logger.error(f"Ошибка при подсчете пунктов: {e}")
+        return [], after_ride_id, after_search_id
+    finally:
+        conn.close()
+
+
 def get_driver_contact(ride_id):
     """Получение контактов водителя по ID поездки"""
     conn = get_db()
@@ -355,15 +695,26 @@ def get_driver_contact(ride_id):
         conn.close()
 
 
+# Повторный поиск того же маршрута на ту же дату увеличивает счетчик, а не добавляет строку
+UPSERT_PASSENGER_SEARCH_SQL = '''
+    INSERT INTO passenger_searches (passenger_id, from_location, to_location, search_date,
+                                    created_at, last_searched_at, hit_count)
+    VALUES (?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT (passenger_id, from_location, to_location, search_date)
+    DO UPDATE SET hit_count = hit_count + excluded.hit_count,
+                  last_searched_at = MAX(COALESCE(last_searched_at, ''), excluded.last_searched_at)
+'''
+
+
 def add_passenger_search(passenger_id, from_location, to_location, search_date):
     """Добавление истории поиска пассажира"""
     conn = get_db()
     cursor = conn.cursor()
     try:
-        cursor.execute('''
-            INSERT INTO passenger_searches (passenger_id, from_location, to_location, search_date)
-            VALUES (?, ?, ?, ?)
-        ''', (passenger_id, from_location, to_location, search_date))
+        current_time = datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S")
+        cursor.execute(UPSERT_PASSENGER_SEARCH_SQL, (
+            passenger_id, from_location, to_location, search_date, current_time, current_time, 1
+        ))
         conn.commit()
         logger.info(f"Поиск пассажира добавлен: {passenger_id}, {from_location} -> {to_location} на {search_date}")
     except Exception as e:
@@ -373,15 +724,69 @@ def add_passenger_search(passenger_id, from_location, to_location, search_date):
         conn.close()
 
 
+def queue_passenger_search(passenger_id, from_location, to_location, search_date):
+    """Постановка поиска пассажира в очередь отложенной записи.
+
+    Возвращает текущий размер очереди, чтобы вызывающий код мог
+    инициировать сброс при достижении размера пакета.
+    """
+    # created_at фиксируем в момент поиска (UTC, как CURRENT_TIMESTAMP)
+    created_at = datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S")
+    with _search_buffer_lock:
+        _search_buffer.append((passenger_id, from_location, to_location, search_date, created_at))
+        return len(_search_buffer)
+
+
+def flush_passenger_searches():
+    """Пакетная запись накопленных поисков пассажиров одним коммитом"""
+    with _search_buffer_lock:
+        if not _search_buffer:
+            return 0
+        batch = list(_search_buffer)
+        _search_buffer.clear()
+
+    # Повторы внутри пакета схлопываем заранее: одна строка на ключ поиска
+    collapsed = {}
+    for passenger_id, from_location, to_location, search_date, searched_at in batch:
+        key = (passenger_id, from_location, to_location, search_date)
+        if key in collapsed:
+            first_at, _, hits = collapsed[key]
+            collapsed[key] = (first_at, searched_at, hits + 1)
+        else:
+            collapsed[key] = (searched_at, searched_at, 1)
+
+    conn = get_db()
+    try:
+        conn.executemany(UPSERT_PASSENGER_SEARCH_SQL, [
+            key + values for key, values in collapsed.items()
+        ])
+        conn.commit()
+        logger.info(f"Записано {len(batch)} поисков пассажиров из буфера")
+        return len(batch)
+    except Exception as e:
+        logger.error(f"Ошибка при записи буфера поисков пассажиров: {e}")
+        # Возвращаем записи в начало очереди, чтобы не потерять историю
+        with _search_buffer_lock:
+            _search_buffer[:0] = batch
+        return 0
+    finally:
+        conn.close()
+
+
 def get_passenger_searches(passenger_id):
     """Получение истории поисков пассажира"""
+    # Сбрасываем буфер, чтобы пользователь видел свой последний поиск
+    flush_passenger_searches()
+
     conn = get_db()
     cursor = conn.cursor()
     try:
         cursor.execute('''
-            SELECT * FROM passenger_searches
+            SELECT id, passenger_id, from_location, to_location, search_date,
+                   last_searched_at, hit_count
+            FROM passenger_searches
             WHERE passenger_id = ?
-            ORDER BY created_at DESC
+            ORDER BY last_searched_at DESC
             LIMIT 10
         ''', (passenger_id,))
         searches = cursor.fetchall()
@@ -393,130 +798,204 @@ def get_passenger_searches(passenger_id):
         conn.close()
 
 
-def get_relevant_rides_for_passenger(passenger_id, limit_searches=5):
-    """Получение актуальных поездок на основе истории поисков пассажира"""
+def get_relevant_rides_page(passenger_id, cursor=None, backward=False, limit=10, limit_searches=5):
+    """Страница актуальных поездок по последним поискам пассажира.
+
+    Постраничный вывод по ключу (date, time, id): cursor — ключ крайней поездки
+    соседней страницы, backward — листать назад от него. Для каждого поиска
+    берется не больше limit + 1 поездок по индексу маршрута, затем списки
+    сливаются. Возвращает (список {'search': ..., 'ride': ...}, есть ли еще
+    страница в этом направлении).
+    """
+    flush_passenger_searches()
+
     conn = get_db()
-    cursor = conn.cursor()
+    cursor_db = conn.cursor()
     try:
-        # Получаем последние поиски пассажира
-        cursor.execute('''
-            SELECT DISTINCT from_location, to_location, search_date
+        # Получаем последние поиски пассажира (только будущие даты)
+        current_date = datetime.now().strftime("%Y-%m-%d")
+        cursor_db.execute('''
+            SELECT from_location, to_location, search_date
             FROM passenger_searches
             WHERE passenger_id = ?
-            ORDER BY created_at DESC
+            ORDER BY last_searched_at DESC
             LIMIT ?
         ''', (passenger_id, limit_searches))
+        searches = [search for search in cursor_db.fetchall() if search[2] >= current_date]
 
-        searches = cursor.fetchall()
-
-        if not searches:
-            return []
+        items = []
+        has_more = False
+        for search in searches:
+            search_date = search[2]
+            if cursor is not None:
+                # Все поездки поиска имеют дату поиска: сравниваем ее с курсором
+                if (search_date < cursor[0]) if not backward else (search_date > cursor[0]):
+                    continue
+            rides, search_has_more = search_rides_page(
+                *search,
+                cursor=cursor[1:] if cursor is not None and search_date == cursor[0] else None,
+                backward=backward, limit=limit, conn=conn
+            )
+            # Поиски пассажира уникальны по (откуда, куда, дата), поэтому дубликатов нет
+            items.extend({'search': search, 'ride': ride} for ride in rides)
+            has_more = has_more or search_has_more
+
+        items.sort(key=lambda item: (item['ride'][5], item['ride'][6], item['ride'][0]), reverse=backward)
+        has_more = has_more or len(items) > limit
+        items = items[:limit]
+        if backward:
+            items.reverse()
+        return items, has_more
 
-        # Собираем все релевантные поездки
-        all_rides = []
-        current_date = datetime.now().strftime("%Y-%m-%d")
+    except Exception as e:
+        logger.error(f"Ошибка при получении актуальных поездок для пассажира {passenger_id}: {e}")
+        return [], False
+    finally:
+        conn.close()
 
-        for search in searches:
-            from_location, to_location, search_date = search
 
-            # Ищем активные поездки для этого поиска (только будущие даты)
+def iter_expire_rides_batches(batch_size=500):
+    """Пакетная пометка просроченных поездок как неактивных (генератор)"""
+    conn = get_db()
+    cursor = conn.cursor()
+    try:
+        current_date = datetime.now().strftime("%Y-%m-%d")
+        while True:
+            # Помечаем как неактивные поездки, дата которых уже прошла
             cursor.execute('''
-                SELECT
-                    id,
-                    driver_id,
-                    driver_username,
-                    from_location,
-                    to_location,
-                    date,
-                    time,
-                    seats
-                FROM rides
-                WHERE from_location = ?
-                  AND to_location = ?
-                  AND date >= ?
-                  AND date = ?
-                  AND is_active = 1
-                  AND seats > 0
-                ORDER BY date, time
-            ''', (from_location, to_location, current_date, search_date))
-
-            rides = cursor.fetchall()
-            for ride in rides:
-                all_rides.append({
-                    'search': (from_location, to_location, search_date),
-                    'ride': ride
-                })
-
-        # Убираем дубликаты (если одна поездка подходит под несколько поисков)
-        unique_rides = {}
-        for item in all_rides:
-            ride_id = item['ride'][0]
-            if ride_id not in unique_rides:
-                unique_rides[ride_id] = item
-
-        # Преобразуем обратно в список и сортируем по дате
-        result = sorted(unique_rides.values(),
-                       key=lambda x: (x['ride'][5], x['ride'][6]))  # Сортировка по date, time
-
-        return result
-
+                UPDATE rides
+                SET is_active = 0, last_check = datetime('now'), version = version + 1
+                WHERE id IN (
+                    SELECT id FROM rides
+                    WHERE is_active = 1 AND date < ?
+                    LIMIT ?
+                )
+            ''', (current_date, batch_size))
+            expired_count = cursor.rowcount
+            conn.commit()
+
+            if expired_count > 0:
+                yield expired_count
+            if expired_count < batch_size:
+                return
     except Exception as e:
-        logger.error(f"Ошибка при получении актуальных поездок для пассажира {passenger_id}: {e}")
-        return []
+        logger.error(f"Ошибка при очистке просроченных поездок: {e}")
     finally:
         conn.close()
 
 
-def delete_old_inactive_rides():
-    """Удаление старых неактивных поездок"""
+def iter_prune_searches_over_cap_batches(max_per_user=30, batch_size=500):
+    """Пакетное удаление поисков сверх лимита на пользователя (генератор)"""
     conn = get_db()
     cursor = conn.cursor()
     try:
-        # Удаляем поездки, которые неактивны и были созданы более 7 дней назад
+        # Находим только тех пользователей, у которых записей больше лимита
         cursor.execute('''
-            DELETE FROM rides
-            WHERE is_active = 0
-            AND created_at < datetime('now', '-7 days')
-        ''')
-        deleted_count = cursor.rowcount
+            SELECT passenger_id FROM passenger_searches
+            GROUP BY passenger_id
+            HAVING COUNT(*) > ?
+        ''', (max_per_user,))
+        passenger_ids = [row[0] for row in cursor.fetchall()]
+
+        pending = 0
+        for passenger_id in passenger_ids:
+            cursor.execute('''
+                DELETE FROM passenger_searches
+                WHERE id IN (
+                    SELECT id FROM passenger_searches
+                    WHERE passenger_id = ?
+                    ORDER BY last_searched_at DESC, id DESC
+                    LIMIT -1 OFFSET ?
+                )
+            ''', (passenger_id, max_per_user))
+            pending += cursor.rowcount
+            if pending >= batch_size:
+                conn.commit()
+                yield pending
+                pending = 0
         conn.commit()
-        logger.info(f"Удалено {deleted_count} старых неактивных поездок")
-        return deleted_count
+        if pending > 0:
+            yield pending
     except Exception as e:
-        logger.error(f"Ошибка при удалении старых поездок: {e}")
-        return 0
+        logger.error(f"Ошибка при ограничении истории поисков: {e}")
     finally:
         conn.close()
 
 
-def cleanup_expired_rides():
-    """Очистка просроченных поездок"""
+# Добавьте эти функции в конец файла database.py:
+
+def get_db_stats():
+    """Физические параметры файла базы данных"""
     conn = get_db()
     cursor = conn.cursor()
     try:
-        current_date = datetime.now().strftime("%Y-%m-%d")
-
-        # Помечаем как неактивные поездки, дата которых уже прошла
-        cursor.execute('''
-            UPDATE rides
-            SET is_active = 0, last_check = datetime('now')
-            WHERE date < ? AND is_active = 1
-        ''', (current_date,))
+        cursor.execute("PRAGMA page_size")
+        page_size = cursor.fetchone()[0]
+        cursor.execute("PRAGMA page_count")
+        page_count = cursor.fetchone()[0]
+        cursor.execute("PRAGMA freelist_count")
+        freelist_count = cursor.fetchone()[0]
+        cursor.execute("PRAGMA auto_vacuum")
+        auto_vacuum = cursor.fetchone()[0]
+
+        wal_path = DB_PATH + '-wal'
+        return {
+            'file_size': os.path.getsize(DB_PATH),
+            'wal_size': os.path.getsize(wal_path) if os.path.exists(wal_path) else 0,
+            'page_size': page_size,
+            'page_count': page_count,
+            'freelist_count': freelist_count,
+            'auto_vacuum': auto_vacuum,
+        }
+    except Exception as e:
+        logger.error(f"Ошибка при получении параметров базы данных: {e}")
+        return None
+    finally:
+        conn.close()
 
-        expired_count = cursor.rowcount
-        conn.commit()
 
-        if expired_count > 0:
-            logger.info(f"Помечено как неактивных {expired_count} просроченных поездок")
+def incremental_vacuum(max_pages=100):
+    """Возвращает в файловую систему не более max_pages свободных страниц.
 
-        return expired_count
+    Возвращает число освобожденных страниц.
+    """
+    conn = get_db()
+    cursor = conn.cursor()
+    try:
+        cursor.execute("PRAGMA freelist_count")
+        before = cursor.fetchone()[0]
+        # Прагма освобождает по одной странице за шаг, а execute() делает
+        # только первый шаг, поэтому выполняем ее через executescript
+        conn.executescript(f"PRAGMA incremental_vacuum({int(max_pages)});")
+        cursor.execute("PRAGMA freelist_count")
+        return before - cursor.fetchone()[0]
     except Exception as e:
-        logger.error(f"Ошибка при очистке просроченных поездок: {e}")
+        logger.error(f"Ошибка при инкрементальной очистке базы данных: {e}")
         return 0
     finally:
         conn.close()
 
-# Добавьте эти функции в конец файла database.py:
+
+def refresh_planner_stats(full=False):
+    """Обновление статистики планировщика запросов.
+
+    По умолчанию выполняется PRAGMA optimize (анализирует только таблицы,
+    где это нужно), при full=True — полный ANALYZE.
+    """
+    conn = get_db()
+    try:
+        if full:
+            conn.execute("ANALYZE")
+        else:
+            conn.execute("PRAGMA optimize")
+        conn.commit()
+        return True
+    except Exception as e:
+        logger.error(f"Ошибка при обновлении статистики планировщика: {e}")
+        return False
+    finally:
+        conn.close()
+
 
 def get_all_users():
     """Получение всех пользователей из базы данных"""
@@ -556,6 +1035,43 @@ def get_ride_by_id(ride_id):
         conn.close()
 
 
+def get_ride_card(ride_id):
+    """Поездка в виде строки карточки (как в результатах поиска) и признак активности"""
+    conn = get_db()
+    cursor = conn.cursor()
+    try:
+        cursor.execute('''
+            SELECT id, driver_id, driver_username, from_location, to_location,
+                   date, time, seats, version, is_active
+            FROM rides
+            WHERE id = ?
+        ''', (ride_id,))
+        return cursor.fetchone()
+    except Exception as e:
+        logger.error(f"Ошибка при получении поездки {ride_id}: {e}")
+        return None
+    finally:
+        conn.close()
+
+
+def get_passenger_search(search_id):
+    """Маршрут и дата сохраненного поиска по его ID"""
+    conn = get_db()
+    cursor = conn.cursor()
+    try:
+        cursor.execute('''
+            SELECT from_location, to_location, search_date
+            FROM passenger_searches
+            WHERE id = ?
+        ''', (search_id,))
+        return cursor.fetchone()
+    except Exception as e:
+        logger.error(f"Ошибка при получении поиска {search_id}: {e}")
+        return None
+    finally:
+        conn.close()
+
+
 def delete_ride(ride_id):
     """Удаление поездки по ID"""
     conn = get_db()
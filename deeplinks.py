@@ -0,0 +1,78 @@
+import base64
+import hashlib
+import hmac
+import logging
+import re
+import time
+
+logger = logging.getLogger(__name__)
+
+# Параметр /start: латиница, цифры, _ и -, не длиннее 64 символов
+_RIDE_PAYLOAD = re.compile(r'^ride_(\d{1,18})$')
+_SEARCH_PAYLOAD = re.compile(r'^search_([0-9a-f]{1,15})_([A-Za-z0-9_-]{8})$')
+TAG_BYTES = 6
+
+
+class TTLCache:
+    """Небольшой кэш с временем жизни записей и ограничением размера"""
+
+    def __init__(self, ttl, max_size=1000):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._items = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, loader):
+        now = time.monotonic()
+        item = self._items.get(key)
+        if item is not None and item[0] > now:
+            self.hits += 1
+            return item[1]
+        self.misses += 1
+        value = loader()
+        if item is None and len(self._items) >= self.max_size:
+            # Вытесняем самую старую запись
+            del self._items[next(iter(self._items))]
+        self._items[key] = (now + self.ttl, value)
+        return value
+
+    def pop(self, key):
+        self._items.pop(key, None)
+
+
+class DeepLinks:
+    """Ссылки t.me/<бот>?start=... на поездку и на сохраненный поиск.
+
+    ride_<id> — карточка поездки (id и так виден в карточках).
+    search_<id hex>_<подпись> — результаты поиска; подпись не дает
+    перебором узнать чужие поиски.
+    """
+
+    def __init__(self, secret):
+        self._secret = secret
+
+    def _tag(self, payload):
+        digest = hmac.new(self._secret, payload.encode('ascii'), hashlib.sha256).digest()
+        return base64.urlsafe_b64encode(digest[:TAG_BYTES]).decode('ascii')
+
+    def ride_payload(self, ride_id):
+        return f"ride_{ride_id}"
+
+    def search_payload(self, search_id):
+        payload = f"search_{search_id:x}"
+        return f"{payload}_{self._tag(payload)}"
+
+    def parse(self, payload):
+        """('ride' | 'search', id) или None для чужих и поддельных параметров"""
+        match = _RIDE_PAYLOAD.match(payload or '')
+        if match:
+            return 'ride', int(match.group(1))
+        match = _SEARCH_PAYLOAD.match(payload or '')
+        if match:
+            signed = f"search_{match.group(1)}"
+            if hmac.compare_digest(match.group(2).encode('ascii'), self._tag(signed).encode('ascii')):
+                return 'search', int(match.group(1), 16)
+            logger.debug(f"Отклонена ссылка на поиск с неверной подписью: {payload}")
+        return None
+
@@ -0,0 +1,162 @@
+import bisect
+from datetime import date as date_type
+from operator import itemgetter
+
+from locations import location_key
+
+MINUTES_PER_DAY = 1440
+
+# Дата YYYY-MM-DD -> минута начала дня (дат в индексе немного)
+_DAY_STARTS = {}
+
+
+def _departure(date, time):
+    """Минуты от начала эпохи для даты YYYY-MM-DD и времени ЧЧ:ММ"""
+    day = _DAY_STARTS.get(date)
+    if day is None:
+        day = _DAY_STARTS[date] = date_type.fromisoformat(date).toordinal() * MINUTES_PER_DAY
+    hours, minutes = time.split(':')
+    return day + int(hours) * 60 + int(minutes)
+
+
+class _Edges:
+    """Поездки из одного пункта (или по одному маршруту) по времени выезда"""
+
+    __slots__ = ('departures', 'stops', 'rides')
+
+    def __init__(self):
+        self.departures = []
+        # Ключи пунктов назначения (location_key)
+        self.stops = []
+        self.rides = []
+
+    def add(self, departure, stop, ride):
+        self.departures.append(departure)
+        self.stops.append(stop)
+        self.rides.append(ride)
+
+    def window(self, earliest, latest):
+        """Поездки с выездом в [earliest, latest]"""
+        lo = bisect.bisect_left(self.departures, earliest)
+        hi = bisect.bisect_right(self.departures, latest, lo)
+        return lo, hi
+
+
+class JourneyIndex:
+    """Поиск поездок с пересадками по активным поездкам.
+
+    Граф: пункты — вершины, поездки — ребра с временем выезда. Ребра
+    сгруппированы по пункту отправления и по паре (откуда, куда) и
+    отсортированы по времени, поэтому продолжения после пересадки — это
+    отрезок, найденный bisect. Последний участок ищется сразу по паре
+    (пересадка, цель), без перебора всех поездок из пункта.
+
+    Времени прибытия у поездок нет: следующий участок должен выезжать не
+    раньше чем через min_gap минут после выезда предыдущего (дорога и
+    пересадка) и не позже чем через max_wait.
+
+    Строка поездки: (id, driver_id, driver_username, from_location,
+    to_location, date, time, seats, version).
+    """
+
+    __slots__ = ('_graph', 'size')
+
+    def __init__(self, rides=()):
+        # (пункт -> _Edges, (откуда, куда) -> _Edges)
+        self._graph = ({}, {})
+        self.size = 0
+        self.build(rides)
+
+    def build(self, rides):
+        """Полная перестройка по снимку активных поездок"""
+        by_origin = {}
+        by_route = {}
+        # Пунктов намного меньше, чем поездок: ключ каждого считается один раз
+        keys = {}
+        edges = []
+        for ride in rides:
+            origin = keys.get(ride[3])
+            if origin is None:
+                origin = keys[ride[3]] = location_key(ride[3])
+            destination = keys.get(ride[4])
+            if destination is None:
+                destination = keys[ride[4]] = location_key(ride[4])
+            edges.append((_departure(ride[5], ride[6]), origin, destination, ride))
+        edges.sort(key=itemgetter(0))
+        for departure, origin, destination, ride in edges:
+            group = by_origin.get(origin)
+            if group is None:
+                group = by_origin[origin] = _Edges()
+            group.add(departure, destination, ride)
+            group = by_route.get((origin, destination))
+            if group is None:
+                group = by_route[origin, destination] = _Edges()
+            group.add(departure, destination, ride)
+        # Одно присваивание: поиск не увидит половину старого и половину нового графа
+        self._graph = (by_origin, by_route)
+        self.size = len(edges)
+
+    def search(self, from_location, to_location, date, max_legs=3, min_gap=120, max_wait=MINUTES_PER_DAY,
+               branching=20, limit=3):
+        """Маршруты с пересадками (от 2 до max_legs участков), первый участок — в день date.
+
+        branching — сколько ближайших продолжений рассматривать в каждом
+        пункте пересадки. Результат — списки поездок, сначала с меньшим
+        числом пересадок и более ранним последним выездом.
+        """
+        by_origin, by_route = self._graph
+        origin = location_key(from_location)
+        target = location_key(to_location)
+        first = by_origin.get(origin)
+        if first is None or origin == target:
+            return []
+
+        day = _departure(date, '00:00')
+        first_lo, first_hi = first.window(day, day + MINUTES_PER_DAY - 1)
+        path = []
+        visited = {origin}
+
+        def extend(city, departure, legs_left, found):
+            # legs_left — сколько промежуточных участков осталось до последнего
+            earliest, latest = departure + min_gap, departure + max_wait
+            if legs_left == 0:
+                # Последний участок: сразу по паре (пересадка, цель)
+                final = by_route.get((city, target))
+                if final is not None:
+                    lo, hi = final.window(earliest, latest)
+                    if lo < hi:
+                        found.append(path + [final.rides[lo]])
+                return
+            onward = by_origin.get(city)
+            if onward is None:
+                return
+            lo, hi = onward.window(earliest, latest)
+            for index in range(lo, min(hi, lo + branching)):
+                stop = onward.stops[index]
+                if stop in visited or stop == target:
+                    continue
+                visited.add(stop)
+                path.append(onward.rides[index])
+                extend(stop, onward.departures[index], legs_left - 1, found)
+                path.pop()
+                visited.discard(stop)
+
+        # Поиск с постепенным увеличением числа участков: если хватило
+        # маршрутов с одной пересадкой, более длинные не перебираются
+        journeys = []
+        for legs in range(2, max_legs + 1):
+            found = []
+            for index in range(first_lo, first_hi):
+                stop = first.stops[index]
+                if stop == target or stop in visited:
+                    continue
+                visited.add(stop)
+                path.append(first.rides[index])
+                extend(stop, first.departures[index], legs - 2, found)
+                path.pop()
+                visited.discard(stop)
+            found.sort(key=lambda journey: _departure(journey[-1][5], journey[-1][6]))
+            journeys.extend(found)
+            if len(journeys) >= limit:
+                break
+        return journeys[:limit]
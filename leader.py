@@ -0,0 +1,91 @@
+import logging
+import os
+import socket
+import time
+import uuid
+
+from database import get_db
+
+logger = logging.getLogger(__name__)
+
+SCHEDULER_LEASE = 'scheduler'
+
+# Уникальный идентификатор процесса (pid может повториться после перезапуска)
+INSTANCE_ID = f'{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}'
+
+
+def init_leader_table():
+    """Таблица аренды (lease) для выбора ведущего экземпляра бота"""
+    conn = get_db()
+    cursor = conn.cursor()
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS leader_lease (
+            name TEXT PRIMARY KEY,
+            holder TEXT NOT NULL,
+            expires_at REAL NOT NULL
+        )
+    ''')
+    conn.commit()
+    conn.close()
+
+
+def try_acquire_lease(ttl, name=SCHEDULER_LEASE, holder=INSTANCE_ID):
+    """Захват или продление аренды на ttl секунд.
+
+    Одна атомарная запись: аренда переходит к holder, только если она
+    уже принадлежит ему или срок предыдущего владельца истек.
+    Возвращает True, если holder — ведущий.
+    """
+    now = time.time()
+    conn = get_db()
+    cursor = conn.cursor()
+    try:
+        cursor.execute('''
+            INSERT INTO leader_lease (name, holder, expires_at)
+            VALUES (?, ?, ?)
+            ON CONFLICT(name) DO UPDATE SET
+                holder = excluded.holder,
+                expires_at = excluded.expires_at
+            WHERE leader_lease.holder = excluded.holder
+               OR leader_lease.expires_at < ?
+        ''', (name, holder, now + ttl, now))
+        acquired = cursor.rowcount > 0
+        conn.commit()
+        return acquired
+    except Exception as e:
+        logger.error(f"Ошибка при захвате аренды {name}: {e}")
+        return False
+    finally:
+        conn.close()
+
+
+def release_lease(name=SCHEDULER_LEASE, holder=INSTANCE_ID):
+    """Освобождение аренды при остановке, чтобы другой экземпляр не ждал истечения срока"""
+    conn = get_db()
+    cursor = conn.cursor()
+    try:
+        cursor.execute('DELETE FROM leader_lease WHERE name = ? AND holder = ?', (name, holder))
+        conn.commit()
+        return cursor.rowcount > 0
+    except Exception as e:
+        logger.error(f"Ошибка при освобождении аренды {name}: {e}")
+        return False
+    finally:
+        conn.close()
+
+
+def get_lease_holder(name=SCHEDULER_LEASE):
+    """Текущий владелец аренды и оставшийся срок в секундах (или None)"""
+    conn = get_db()
+    cursor = conn.cursor()
+    try:
+        cursor.execute('SELECT holder, expires_at FROM leader_lease WHERE name = ?', (name,))
+        row = cursor.fetchone()
+        if row is None or row[1] < time.time():
+            return None
+        return row[0], row[1] - time.time()
+    except Exception as e:
+        logger.error(f"Ошибка при получении владельца аренды {name}: {e}")
+        return None
+    finally:
+        conn.close()
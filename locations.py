@@ -0,0 +1,94 @@
+import bisect
+import heapq
+
+# Сколько лучших вариантов запоминается для каждого префикса
+TOP_PER_PREFIX = 10
+# Сколько префиксов держать в памяти
+PREFIX_CACHE_SIZE = 20000
+
+
+def location_key(name):
+    """Ключ пункта: без учета регистра и лишних пробелов"""
+    return ' '.join(name.split()).casefold()
+
+
+class LocationIndex:
+    """Известные пункты для подсказок, по популярности в поездках и поисках.
+
+    Ключи хранятся отсортированным списком: все пункты с префиксом — это
+    один отрезок, который находится двумя bisect. Лучшие варианты для
+    префикса запоминаются; при изменении счетчика пункта забываются только
+    его собственные префиксы. Индекс пополняется новыми строками БД
+    (ride_id и search_id — последние учтенные id), без полной перестройки.
+    """
+
+    __slots__ = ('_keys', '_names', '_counts', '_top', 'ride_id', 'search_id', 'hits', 'misses')
+
+    def __init__(self):
+        self._keys = []
+        # ключ -> написание для показа и суммарное число упоминаний
+        self._names = {}
+        self._counts = {}
+        # префикс -> лучшие ключи
+        self._top = {}
+        self.ride_id = 0
+        self.search_id = 0
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._keys)
+
+    def add(self, name, count=1):
+        key = location_key(name)
+        if not key:
+            return
+        current = self._counts.get(key)
+        if current is None:
+            bisect.insort(self._keys, key)
+            current = 0
+        if count > current:
+            # Показываем самое частое написание
+            self._names[key] = ' '.join(name.split())
+        self._counts[key] = current + count
+        for end in range(len(key) + 1):
+            self._top.pop(key[:end], None)
+
+    def update(self, counts, ride_id, search_id):
+        """Добавить пачку (написание, число упоминаний) из БД до указанных id"""
+        for name, count in counts:
+            self.add(name, count)
+        self.ride_id = ride_id
+        self.search_id = search_id
+
+    def _best(self, prefix):
+        top = self._top.get(prefix)
+        if top is not None:
+            self.hits += 1
+            return top
+        self.misses += 1
+        lo = bisect.bisect_left(self._keys, prefix)
+        hi = bisect.bisect_left(self._keys, prefix + '\U0010ffff', lo)
+        top = heapq.nlargest(TOP_PER_PREFIX, self._keys[lo:hi], key=self._counts.__getitem__)
+        if len(self._top) >= PREFIX_CACHE_SIZE:
+            del self._top[next(iter(self._top))]
+        self._top[prefix] = top
+        return top
+
+    def suggest(self, prefix='', limit=6, exclude=None):
+        """Популярные пункты, начинающиеся с prefix (пустой — самые популярные вообще)"""
+        excluded = location_key(exclude) if exclude else None
+        names = [self._names[key] for key in self._best(location_key(prefix)) if key != excluded]
+        return names[:limit]
+
+    def canonical(self, name):
+        """Привычное написание известного пункта или None"""
+        return self._names.get(location_key(name))
+
+    def resolve(self, name):
+        """Известный пункт или самое популярное продолжение префикса (для inline-поиска)"""
+        canonical = self.canonical(name)
+        if canonical is not None:
+            return canonical
+        best = self._best(location_key(name))
+        return self._names[best[0]] if best else name
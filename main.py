@@ -1,17 +1,73 @@
 import logging
-from telegram.ext import Application, CommandHandler, ContextTypes, MessageHandler, filters, CallbackQueryHandler
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, ReplyKeyboardMarkup, KeyboardButton
-from config import TOKEN, REQUIRED_CHANNEL, ADMIN_IDS
+from telegram.ext import (
+    Application, CommandHandler, ContextTypes, MessageHandler, filters,
+    CallbackQueryHandler, InlineQueryHandler, TypeHandler, ApplicationHandlerStop
+)
+from telegram import (
+    Update, InlineKeyboardButton, InlineKeyboardMarkup, ReplyKeyboardMarkup, KeyboardButton,
+    InlineQueryResultsButton
+)
+from config import (
+    TOKEN, REQUIRED_CHANNEL, ADMIN_IDS,
+    SEARCH_HISTORY_FLUSH_INTERVAL_MS, SEARCH_HISTORY_BATCH_SIZE,
+    SEARCH_HISTORY_MAX_PER_USER, SEARCH_HISTORY_RETENTION_DAYS,
+    CLEANUP_BATCH_SIZE, CLEANUP_BATCH_PAUSE, ARCHIVE_RIDES_AFTER_DAYS,
+    MAINTENANCE_INTERVAL, MAINTENANCE_IDLE_SECONDS, MAINTENANCE_VACUUM_PAGES,
+    MAINTENANCE_VACUUM_STEPS, MAINTENANCE_ANALYZE_INTERVAL,
+    BACKUP_INTERVAL, BACKUP_KEEP, BACKUP_PAGES_PER_STEP, BACKUP_STEP_PAUSE,
+    RUN_MODE, WEBHOOK_URL, WEBHOOK_LISTEN, WEBHOOK_PORT, WEBHOOK_PATH, WEBHOOK_SECRET,
+    UPDATE_CONCURRENCY, WORKER_PROCESSES, LEADER_LEASE_TTL, LEADER_RENEW_INTERVAL,
+    CONVERSATION_FLUSH_INTERVAL, CONVERSATION_IDLE_TTL, CONVERSATION_EVICT_INTERVAL,
+    CALLBACK_ACCEPT_LEGACY, THROTTLE_LIMITS, SHED_DB_LATENCY, SHED_API_LATENCY,
+    OUTBOUND_RATE, OUTBOUND_BURST, OUTBOUND_PRIVATE_RATE, OUTBOUND_GROUP_RATE, OUTBOUND_CHAT_BURST,
+    RIDE_CARD_CACHE_SIZE, SEARCH_PAGE_SIZE, DEEP_LINK_CACHE_TTL,
+    INLINE_CACHE_TIME, INLINE_RESULTS_TTL, INLINE_PAGE_SIZE, INLINE_MAX_RESULTS,
+    LOCATION_INDEX_REFRESH, LOCATION_SUGGESTIONS,
+    JOURNEY_MAX_LEGS, JOURNEY_MIN_TRANSFER, JOURNEY_MAX_WAIT, JOURNEY_BRANCHING, JOURNEY_RESULTS,
+    JOURNEY_INDEX_REFRESH
+)
 from database import (
     init_db, add_user, add_ride, get_user, get_user_rides,
-    search_rides, get_driver_contact, add_passenger_search,
-    get_passenger_searches, update_ride_status,
-    cleanup_expired_rides, delete_old_inactive_rides, get_db,
-    get_relevant_rides_for_passenger, add_user_with_terms, update_user_terms,
-    get_all_active_rides, get_all_users, get_ride_by_id, delete_ride
+    get_driver_contact, queue_passenger_search,
+    flush_passenger_searches, get_passenger_searches, update_ride_status,
+    get_db,
+    get_relevant_rides_page, search_rides_page, add_user_with_terms, update_user_terms,
+    get_all_active_rides, get_all_users, get_ride_by_id, delete_ride,
+    get_ride_card, get_passenger_search, get_upcoming_route_rides, get_location_counts,
+    get_nearest_ride_dates, get_active_rides_snapshot,
+    iter_expire_rides_batches, iter_prune_searches_over_cap_batches,
+    get_db_stats, incremental_vacuum, refresh_planner_stats
+)
+from archive import (
+    init_archive_db, iter_archive_rides_batches,
+    iter_archive_searches_batches, get_archive_stats
 )
+from backup import create_backup, list_backups
+from webhook import WebhookServer
+from concurrency import PerUserUpdateProcessor
+from sharding import run_sharded
+from leader import init_leader_table, try_acquire_lease, release_lease
+from conversation_store import (
+    init_conversation_store, load_user_state, track_user_state, flush_user_states,
+    forget_user_state
+)
+from conversation_state import ConversationState
+from routing import Guard, MessageRouter
+from callbacks import CallbackRegistry
+from throttle import FloodControl, LatencyMonitor
+from outbound import OutboundScheduler, BULK
+from rendering import RideRenderer, SEARCH_CARD, format_date_for_display
+from parsing import parse_ride_text, parse_route_query
+from deeplinks import DeepLinks, TTLCache
+from locations import LocationIndex
+from journeys import JourneyIndex
 from datetime import datetime
+import asyncio
+import functools
+import os
 import re
+import signal
+import time
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -22,6 +78,24 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Реестр inline-кнопок; действия регистрируются в register_callbacks()
+CALLBACKS = CallbackRegistry(TOKEN.encode('utf-8'), accept_legacy=CALLBACK_ACCEPT_LEGACY)
+# Кэш карточек поездок для списков результатов
+RIDES_VIEW = RideRenderer(CALLBACKS, RIDE_CARD_CACHE_SIZE)
+# Ссылки t.me/<бот>?start=... и кэш того, что по ним открывают
+DEEP_LINKS = DeepLinks(TOKEN.encode('utf-8'))
+LINK_LOOKUPS = TTLCache(DEEP_LINK_CACHE_TTL, max_size=5000)
+# Готовые ответы inline-режима по маршруту и дате
+INLINE_RESULTS = TTLCache(INLINE_RESULTS_TTL, max_size=2000)
+# Подсказки пунктов по началу названия; пополняется задачей refresh_location_index
+LOCATIONS = LocationIndex()
+# Граф активных поездок для поиска с пересадками; перестраивается задачей refresh_journey_index
+JOURNEYS = JourneyIndex()
+
+# Ограничение частоты действий и сброс второстепенной работы при перегрузке
+FLOOD_CONTROL = FloodControl(THROTTLE_LIMITS)
+LATENCY = LatencyMonitor({'db': SHED_DB_LATENCY, 'api': SHED_API_LATENCY})
+
 
 def get_role_selection_keyboard(chat_type: str = "private"):
     """Клавиатура для выбора роли - только в личных чатах"""
@@ -79,6 +153,45 @@ def get_cancel_keyboard(chat_type: str = "private"):
     return ReplyKeyboardMarkup(keyboard, resize_keyboard=True, one_time_keyboard=True)
 
 
+def get_location_keyboard(chat_type: str = "private", suggestions=()):
+    """Клавиатура шага «откуда»/«куда»: подсказки пунктов по два в ряд и кнопка отмены"""
+    if chat_type != "private":
+        return None
+    keyboard = [
+        [KeyboardButton(name) for name in suggestions[i:i + 2]]
+        for i in range(0, len(suggestions), 2)
+    ]
+    keyboard.append([KeyboardButton("❌ Отмена")])
+    return ReplyKeyboardMarkup(keyboard, resize_keyboard=True, one_time_keyboard=True)
+
+
+async def read_location(update: Update, context: ContextTypes.DEFAULT_TYPE, exclude=None):
+    """Пункт из ответа на шаге «откуда»/«куда».
+
+    Известный пункт приводится к привычному написанию. Для незнакомого
+    показываются известные пункты с таким началом; повторная отправка
+    того же текста принимает его как есть. None — ответ еще не принят.
+    """
+    text = ' '.join(update.message.text.split())
+    canonical = LOCATIONS.canonical(text)
+    if canonical is not None:
+        context.user_data.pop('location_hint', None)
+        return canonical
+
+    suggestions = LOCATIONS.suggest(text, LOCATION_SUGGESTIONS, exclude=exclude)
+    if not suggestions or context.user_data.get('location_hint') == text:
+        context.user_data.pop('location_hint', None)
+        return text
+
+    context.user_data['location_hint'] = text
+    await update.message.reply_text(
+        "🤔 Такого пункта еще нет в поездках. Возможно, вы имели в виду один из вариантов ниже?\n"
+        f"Чтобы оставить «{text}», отправьте его еще раз.",
+        reply_markup=get_location_keyboard(get_chat_type(update), suggestions + [text])
+    )
+    return None
+
+
 def get_chat_type(update: Update) -> str:
     """Определяет тип чата"""
     if update.message:
@@ -88,13 +201,36 @@ def get_chat_type(update: Update) -> str:
     return "private"
 
 
+# id нажатий, на которые бот уже ответил (последние ANSWERED_CALLBACKS_LIMIT)
+_answered_callbacks = {}
+ANSWERED_CALLBACKS_LIMIT = 1000
+
+
+async def answer_callback(query, text=None, show_alert=False) -> None:
+    """Ответ на нажатие кнопки ровно один раз: повторные вызовы ничего не отправляют.
+
+    Если обработчик не ответил сам, dispatch_callback отвечает после него.
+    """
+    if query.id in _answered_callbacks:
+        return
+    _answered_callbacks[query.id] = True
+    if len(_answered_callbacks) > ANSWERED_CALLBACKS_LIMIT:
+        del _answered_callbacks[next(iter(_answered_callbacks))]
+    try:
+        await query.answer(text, show_alert=show_alert)
+    except Exception as e:
+        logger.warning(f"Не удалось ответить на нажатие кнопки: {e}")
+
+
 async def check_subscription(user_id: int, context: ContextTypes.DEFAULT_TYPE) -> bool:
     """Проверяет, подписан ли пользователь на обязательный канал."""
     try:
+        started = time.monotonic()
         chat_member = await context.bot.get_chat_member(
             chat_id=REQUIRED_CHANNEL,
             user_id=user_id
         )
+        LATENCY.observe('api', time.monotonic() - started)
         subscribed_statuses = ['member', 'administrator', 'creator']
         return chat_member.status in subscribed_statuses
     except Exception as e:
@@ -102,31 +238,6 @@ async def check_subscription(user_id: int, context: ContextTypes.DEFAULT_TYPE) -
         return True
 
 
-def format_date_for_display(date_str: str) -> str:
-    """Преобразует дату из формата YYYY-MM-DD в DD.MM.YYYY для отображения"""
-    try:
-        # Пытаемся распарсить разные форматы
-        if '.' in date_str:
-            # Уже в формате DD.MM.YYYY
-            parts = date_str.split('.')
-            if len(parts) == 3:
-                day, month, year = parts
-                return f"{int(day):02d}.{int(month):02d}.{year}"
-
-        # Пробуем формат YYYY-MM-DD
-        try:
-            date_obj = datetime.strptime(date_str, '%Y-%m-%d')
-            return date_obj.strftime('%d.%m.%Y')
-        except ValueError:
-            pass
-
-        # Возвращаем как есть, если не удалось распарсить
-        return date_str
-    except Exception as e:
-        logger.error(f"Ошибка при форматировании даты {date_str}: {e}")
-        return date_str
-
-
 def parse_date_input(date_str: str) -> tuple:
     """Парсит дату из формата DD.MM.YYYY в YYYY-MM-DD"""
     try:
@@ -163,13 +274,13 @@ async def show_terms_acceptance(update: Update, context: ContextTypes.DEFAULT_TY
     chat_type = get_chat_type(update)
 
     if query:
-        await query.answer()
+        await answer_callback(query)
 
     terms_text = "📜 Пожалуйста, ознакомьтесь с пользовательским соглашением:"
 
     keyboard = [
         [InlineKeyboardButton("📄 Открыть полный текст", url="https://docs.google.com/document/d/1FTKKfsDyG66IGQMgWDJQKgBI5nWf8TgXy5Z2aPti5U0/edit?usp=sharing")],
-        [InlineKeyboardButton("✅ Принимаю условия соглашения", callback_data="accept_terms")]
+        [InlineKeyboardButton("✅ Принимаю условия соглашения", callback_data=CALLBACKS.encode('accept_terms'))]
     ]
     reply_markup = InlineKeyboardMarkup(keyboard)
 
@@ -194,12 +305,14 @@ def is_admin(user_id: int) -> bool:
 def get_admin_keyboard():
     """Создает клавиатуру для админ-панели"""
     keyboard = [
-        [InlineKeyboardButton("📊 Статистика", callback_data="admin_stats")],
-        [InlineKeyboardButton("👥 Все пользователи", callback_data="admin_users")],
-        [InlineKeyboardButton("🚗 Все активные поездки", callback_data="admin_active_rides")],
-        [InlineKeyboardButton("📢 Рассылка", callback_data="admin_broadcast")],
-        [InlineKeyboardButton("🗑️ Очистка БД", callback_data="admin_cleanup")],
-        [InlineKeyboardButton("🔙 Выход", callback_data="admin_exit")]
+        [InlineKeyboardButton("📊 Статистика", callback_data=CALLBACKS.encode('admin_stats'))],
+        [InlineKeyboardButton("👥 Все пользователи", callback_data=CALLBACKS.encode('admin_users'))],
+        [InlineKeyboardButton("🚗 Все активные поездки", callback_data=CALLBACKS.encode('admin_active_rides'))],
+        [InlineKeyboardButton("📢 Рассылка", callback_data=CALLBACKS.encode('admin_broadcast'))],
+        [InlineKeyboardButton("🗑️ Очистка БД", callback_data=CALLBACKS.encode('admin_cleanup'))],
+        [InlineKeyboardButton("🛠 Обслуживание БД", callback_data=CALLBACKS.encode('admin_maintenance'))],
+        [InlineKeyboardButton("💾 Резервные копии", callback_data=CALLBACKS.encode('admin_backup'))],
+        [InlineKeyboardButton("🔙 Выход", callback_data=CALLBACKS.encode('admin_exit'))]
     ]
     return InlineKeyboardMarkup(keyboard)
 
@@ -219,10 +332,37 @@ async def admin_panel(update: Update, context: ContextTypes.DEFAULT_TYPE) -> Non
     )
 
 
+def format_throttle_report(report, latency) -> str:
+    """Счетчики ограничения частоты и средние задержки для админ-панели"""
+    text = "🚦 НАГРУЗКА:\n"
+    for kind, average in sorted(latency.averages.items()):
+        text += f"• Задержка {kind}: {average * 1000:.0f} мс\n"
+    if latency.overloaded():
+        text += "• ⚠️ Перегрузка: второстепенные действия отклоняются\n"
+    if not report:
+        text += "• Ограничений пока не было\n"
+    for action_class, (allowed, throttled, shed) in report.items():
+        text += f"• {action_class}: разрешено {allowed}, ограничено {throttled}, сброшено {shed}\n"
+    return text
+
+
+def format_outbound_report(scheduler) -> str:
+    """Очереди исходящих сообщений для админ-панели"""
+    if not isinstance(scheduler, OutboundScheduler):
+        return ""
+    text = "📤 ИСХОДЯЩИЕ:\n"
+    for lane, (waiting, sent, avg_wait, max_wait) in scheduler.report().items():
+        text += (
+            f"• {lane}: в очереди {waiting}, отправлено {sent}, "
+            f"ожидание средн. {avg_wait * 1000:.0f} мс, макс. {max_wait * 1000:.0f} мс\n"
+        )
+    text += f"• Запросов подождать от Telegram: {scheduler.retry_after_count}\n"
+    return text
+
+
 async def show_admin_stats(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Показывает статистику бота"""
     query = update.callback_query
-    await query.answer()
 
     conn = get_db()
     cursor = conn.cursor()
@@ -244,8 +384,8 @@ async def show_admin_stats(update: Update, context: ContextTypes.DEFAULT_TYPE) -
         cursor.execute("SELECT COUNT(*) FROM rides")
         total_rides = cursor.fetchone()[0]
 
-        cursor.execute("SELECT COUNT(*) FROM passenger_searches")
-        total_searches = cursor.fetchone()[0]
+        cursor.execute("SELECT COALESCE(SUM(hit_count), 0), COUNT(*) FROM passenger_searches")
+        total_searches, saved_searches = cursor.fetchone()
 
         cursor.execute("SELECT COUNT(DISTINCT passenger_id) FROM passenger_searches")
         unique_searchers = cursor.fetchone()[0]
@@ -259,6 +399,19 @@ async def show_admin_stats(update: Update, context: ContextTypes.DEFAULT_TYPE) -
         ''')
         recent_users = cursor.fetchall()
 
+        archive_stats = get_archive_stats()
+        archived_rides = archive_stats.get('rides', (0, 0, 0))
+        archived_searches = archive_stats.get('passenger_searches', (0, 0, 0))
+        archive_size_kb = (archived_rides[2] + archived_searches[2]) / 1024
+
+        load_text = format_throttle_report(FLOOD_CONTROL.report(), LATENCY)
+        load_text += format_outbound_report(context.bot.rate_limiter)
+        cards, card_hits, card_misses = RIDES_VIEW.report()
+        load_text += f"🗂 Карточек поездок в кэше: {cards} (попаданий {card_hits}, промахов {card_misses})\n"
+        load_text += f"🔎 Inline-запросы: из кэша {INLINE_RESULTS.hits}, из БД {INLINE_RESULTS.misses}\n"
+        load_text += f"🏙 Пунктов в подсказках: {len(LOCATIONS)} (готовых префиксов {LOCATIONS.hits}, расчетов {LOCATIONS.misses})\n"
+        load_text += f"🔀 Поездок в графе пересадок: {JOURNEYS.size}\n"
+
         stats_text = f"""
 📊 СТАТИСТИКА БОТА:
 
@@ -273,8 +426,15 @@ async def show_admin_stats(update: Update, context: ContextTypes.DEFAULT_TYPE) -
 
 🔍 ПОИСКИ:
 • Всего поисков: {total_searches}
+• Сохранено в истории: {saved_searches}
 • Уникальных искателей: {unique_searchers}
 
+🗄 АРХИВ:
+• Поездок в архиве: {archived_rides[1]}
+• Поисков в архиве: {archived_searches[1]}
+• Размер (сжато): {archive_size_kb:.1f} КБ
+
+{load_text}
 📈 ПОСЛЕДНИЕ РЕГИСТРАЦИИ:
 """
 
@@ -288,8 +448,8 @@ async def show_admin_stats(update: Update, context: ContextTypes.DEFAULT_TYPE) -
         await query.edit_message_text(
             stats_text,
             reply_markup=InlineKeyboardMarkup([
-                [InlineKeyboardButton("🔄 Обновить", callback_data="admin_stats")],
-                [InlineKeyboardButton("🔙 Назад", callback_data="admin_back")]
+                [InlineKeyboardButton("🔄 Обновить", callback_data=CALLBACKS.encode('admin_stats'))],
+                [InlineKeyboardButton("🔙 Назад", callback_data=CALLBACKS.encode('admin_back'))]
             ])
         )
 
@@ -298,7 +458,7 @@ async def show_admin_stats(update: Update, context: ContextTypes.DEFAULT_TYPE) -
         await query.edit_message_text(
             "❌ Ошибка при получении статистики.",
             reply_markup=InlineKeyboardMarkup([
-                [InlineKeyboardButton("🔙 Назад", callback_data="admin_back")]
+                [InlineKeyboardButton("🔙 Назад", callback_data=CALLBACKS.encode('admin_back'))]
             ])
         )
     finally:
@@ -308,7 +468,6 @@ async def show_admin_stats(update: Update, context: ContextTypes.DEFAULT_TYPE) -
 async def show_all_users(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Показывает всех пользователей"""
     query = update.callback_query
-    await query.answer()
 
     try:
         users = get_all_users()
@@ -317,7 +476,7 @@ async def show_all_users(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
             await query.edit_message_text(
                 "❌ В базе данных нет пользователей.",
                 reply_markup=InlineKeyboardMarkup([
-                    [InlineKeyboardButton("🔙 Назад", callback_data="admin_back")]
+                    [InlineKeyboardButton("🔙 Назад", callback_data=CALLBACKS.encode('admin_back'))]
                 ])
             )
             return
@@ -339,8 +498,8 @@ async def show_all_users(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
             users_text += f"\n... и ещё {len(users) - 50} пользователей"
 
         keyboard = [
-            [InlineKeyboardButton("🔄 Обновить", callback_data="admin_users")],
-            [InlineKeyboardButton("🔙 Назад", callback_data="admin_back")]
+            [InlineKeyboardButton("🔄 Обновить", callback_data=CALLBACKS.encode('admin_users'))],
+            [InlineKeyboardButton("🔙 Назад", callback_data=CALLBACKS.encode('admin_back'))]
         ]
 
         await query.edit_message_text(
@@ -353,7 +512,7 @@ async def show_all_users(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         await query.edit_message_text(
             "❌ Ошибка при получении списка пользователей.",
             reply_markup=InlineKeyboardMarkup([
-                [InlineKeyboardButton("🔙 Назад", callback_data="admin_back")]
+                [InlineKeyboardButton("🔙 Назад", callback_data=CALLBACKS.encode('admin_back'))]
             ])
         )
 
@@ -361,7 +520,6 @@ async def show_all_users(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
 async def show_active_rides(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Показывает все активные поездки"""
     query = update.callback_query
-    await query.answer()
 
     try:
         rides = get_all_active_rides()
@@ -370,7 +528,7 @@ async def show_active_rides(update: Update, context: ContextTypes.DEFAULT_TYPE)
             await query.edit_message_text(
                 "🚗 Активных поездок нет.",
                 reply_markup=InlineKeyboardMarkup([
-                    [InlineKeyboardButton("🔙 Назад", callback_data="admin_back")]
+                    [InlineKeyboardButton("🔙 Назад", callback_data=CALLBACKS.encode('admin_back'))]
                 ])
             )
             return
@@ -378,7 +536,7 @@ async def show_active_rides(update: Update, context: ContextTypes.DEFAULT_TYPE)
         rides_text = "🚗 ВСЕ АКТИВНЫЕ ПОЕЗДКИ:\n\n"
 
         for ride in rides[:30]:  # Ограничиваем 30 поездками
-            ride_id, driver_id, driver_username, from_loc, to_loc, date, time, seats, is_active, last_check, created_at = ride
+            ride_id, driver_id, driver_username, from_loc, to_loc, date, time, seats, is_active, last_check, created_at = ride[:11]
 
             # Форматируем дату
             date_display = format_date_for_display(date)
@@ -405,13 +563,13 @@ async def show_active_rides(update: Update, context: ContextTypes.DEFAULT_TYPE)
             keyboard.append([
                 InlineKeyboardButton(
                     f"🗑️ Удалить #{ride_id}",
-                    callback_data=f"admin_delete_ride_{ride_id}"
+                    callback_data=CALLBACKS.encode('admin_delete_ride', ride_id)
                 )
             ])
 
         keyboard.extend([
-            [InlineKeyboardButton("🔄 Обновить", callback_data="admin_active_rides")],
-            [InlineKeyboardButton("🔙 Назад", callback_data="admin_back")]
+            [InlineKeyboardButton("🔄 Обновить", callback_data=CALLBACKS.encode('admin_active_rides'))],
+            [InlineKeyboardButton("🔙 Назад", callback_data=CALLBACKS.encode('admin_back'))]
         ])
 
         await query.edit_message_text(
@@ -424,7 +582,7 @@ async def show_active_rides(update: Update, context: ContextTypes.DEFAULT_TYPE)
         await query.edit_message_text(
             "❌ Ошибка при получении списка поездок.",
             reply_markup=InlineKeyboardMarkup([
-                [InlineKeyboardButton("🔙 Назад", callback_data="admin_back")]
+                [InlineKeyboardButton("🔙 Назад", callback_data=CALLBACKS.encode('admin_back'))]
             ])
         )
 
@@ -432,7 +590,6 @@ async def show_active_rides(update: Update, context: ContextTypes.DEFAULT_TYPE)
 async def start_broadcast(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Начинает процесс рассылки"""
     query = update.callback_query
-    await query.answer()
 
     context.user_data['broadcast_step'] = 'waiting_message'
 
@@ -442,7 +599,7 @@ async def start_broadcast(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         "Вы можете использовать HTML-разметку.\n\n"
         "Для отмены введите /cancel",
         reply_markup=InlineKeyboardMarkup([
-            [InlineKeyboardButton("❌ Отмена", callback_data="admin_back")]
+            [InlineKeyboardButton("❌ Отмена", callback_data=CALLBACKS.encode('admin_back'))]
         ])
     )
 
@@ -471,8 +628,8 @@ async def handle_broadcast_message(update: Update, context: ContextTypes.DEFAULT
         f"---\n{message_text[:500]}\n---\n\n"
         f"Подтвердите отправку:",
         reply_markup=InlineKeyboardMarkup([
-            [InlineKeyboardButton("✅ Отправить", callback_data="admin_confirm_broadcast")],
-            [InlineKeyboardButton("❌ Отмена", callback_data="admin_back")]
+            [InlineKeyboardButton("✅ Отправить", callback_data=CALLBACKS.encode('admin_confirm_broadcast'))],
+            [InlineKeyboardButton("❌ Отмена", callback_data=CALLBACKS.encode('admin_back'))]
         ])
     )
 
@@ -480,13 +637,14 @@ async def handle_broadcast_message(update: Update, context: ContextTypes.DEFAULT
 async def confirm_broadcast(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Подтверждает и отправляет рассылку"""
     query = update.callback_query
-    await query.answer()
+    # Долгая операция: снимаем «часики» с кнопки сразу
+    await answer_callback(query)
 
     if 'broadcast_message' not in context.user_data:
         await query.edit_message_text(
             "❌ Сообщение для рассылки не найдено.",
             reply_markup=InlineKeyboardMarkup([
-                [InlineKeyboardButton("🔙 Назад", callback_data="admin_back")]
+                [InlineKeyboardButton("🔙 Назад", callback_data=CALLBACKS.encode('admin_back'))]
             ])
         )
         return
@@ -511,10 +669,12 @@ async def confirm_broadcast(update: Update, context: ContextTypes.DEFAULT_TYPE)
     # Отправляем сообщение каждому пользователю
     for i, (user_id,) in enumerate(users, 1):
         try:
+            # Рассылка идет в фоновой полосе и не задерживает ответы пользователям
             await context.bot.send_message(
                 chat_id=user_id,
                 text=f"📢 СООБЩЕНИЕ ОТ АДМИНИСТРАЦИИ:\n\n{message_text}",
-                parse_mode='HTML'
+                parse_mode='HTML',
+                rate_limit_args={'lane': BULK}
             )
             successful += 1
 
@@ -541,7 +701,7 @@ async def confirm_broadcast(update: Update, context: ContextTypes.DEFAULT_TYPE)
         f"• Не удалось отправить: {failed}\n\n"
         f"Сообщение было отправлено всем пользователям бота.",
         reply_markup=InlineKeyboardMarkup([
-            [InlineKeyboardButton("🔙 В админ-панель", callback_data="admin_back")]
+            [InlineKeyboardButton("🔙 В админ-панель", callback_data=CALLBACKS.encode('admin_back'))]
         ])
     )
 
@@ -549,26 +709,44 @@ async def confirm_broadcast(update: Update, context: ContextTypes.DEFAULT_TYPE)
 async def perform_cleanup(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Выполняет очистку базы данных"""
     query = update.callback_query
-    await query.answer()
+    # Долгая операция: снимаем «часики» с кнопки сразу
+    await answer_callback(query)
+
+    if context.bot_data.get('cleanup_running'):
+        await query.edit_message_text(
+            "⏳ Очистка уже выполняется, попробуйте позже.\n\n"
+            + format_cleanup_report(context.bot_data.get('cleanup_progress')),
+            reply_markup=InlineKeyboardMarkup([
+                [InlineKeyboardButton("🔄 Обновить", callback_data=CALLBACKS.encode('admin_cleanup'))],
+                [InlineKeyboardButton("🔙 Назад", callback_data=CALLBACKS.encode('admin_back'))]
+            ])
+        )
+        return
 
     try:
         await query.edit_message_text("⏳ Выполняю очистку базы данных...")
 
-        # Очищаем просроченные поездки
-        expired_count = cleanup_expired_rides()
+        last_edit = time.monotonic()
+
+        async def show_progress(stats):
+            nonlocal last_edit
+            # Обновляем экран не чаще раза в секунду, чтобы не упереться в лимиты Telegram
+            if time.monotonic() - last_edit < 1:
+                return
+            last_edit = time.monotonic()
+            await query.edit_message_text(
+                "⏳ Выполняю очистку базы данных...\n\n" + format_cleanup_report(stats)
+            )
 
-        # Удаляем старые неактивные поездки
-        deleted_count = delete_old_inactive_rides()
+        stats = await run_cleanup(context, on_progress=show_progress)
 
-        result_text = f"✅ ОЧИСТКА ЗАВЕРШЕНА\n\n"
-        result_text += f"• Просроченных поездок удалено: {expired_count}\n"
-        result_text += f"• Старых неактивных поездок удалено: {deleted_count}\n"
+        result_text = "✅ ОЧИСТКА ЗАВЕРШЕНА\n\n" + format_cleanup_report(stats)
 
         await query.edit_message_text(
             result_text,
             reply_markup=InlineKeyboardMarkup([
-                [InlineKeyboardButton("🔄 Ещё раз", callback_data="admin_cleanup")],
-                [InlineKeyboardButton("🔙 Назад", callback_data="admin_back")]
+                [InlineKeyboardButton("🔄 Ещё раз", callback_data=CALLBACKS.encode('admin_cleanup'))],
+                [InlineKeyboardButton("🔙 Назад", callback_data=CALLBACKS.encode('admin_back'))]
             ])
         )
 
@@ -577,79 +755,192 @@ async def perform_cleanup(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         await query.edit_message_text(
             "❌ Ошибка при выполнении очистки базы данных.",
             reply_markup=InlineKeyboardMarkup([
-                [InlineKeyboardButton("🔙 Назад", callback_data="admin_back")]
+                [InlineKeyboardButton("🔙 Назад", callback_data=CALLBACKS.encode('admin_back'))]
             ])
         )
 
 
-async def delete_ride_admin(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+async def show_db_maintenance(update: Update, context: ContextTypes.DEFAULT_TYPE, run: bool = False) -> None:
+    """Показывает состояние файла БД и результат последнего обслуживания"""
+    query = update.callback_query
+    # Долгая операция: снимаем «часики» с кнопки сразу
+    await answer_callback(query)
+
+    if run:
+        await query.edit_message_text("⏳ Выполняю обслуживание базы данных...")
+        await run_maintenance(context, force=True)
+
+    await query.edit_message_text(
+        format_maintenance_report(get_db_stats(), context.bot_data.get('last_maintenance')),
+        reply_markup=InlineKeyboardMarkup([
+            [InlineKeyboardButton("▶️ Запустить сейчас", callback_data=CALLBACKS.encode('admin_maintenance_run'))],
+            [InlineKeyboardButton("🔄 Обновить", callback_data=CALLBACKS.encode('admin_maintenance'))],
+            [InlineKeyboardButton("🔙 Назад", callback_data=CALLBACKS.encode('admin_back'))]
+        ])
+    )
+
+
+async def show_backups(update: Update, context: ContextTypes.DEFAULT_TYPE, run: bool = False) -> None:
+    """Показывает резервные копии и результат последнего копирования"""
+    query = update.callback_query
+    # Долгая операция: снимаем «часики» с кнопки сразу
+    await answer_callback(query)
+
+    if run:
+        await query.edit_message_text("⏳ Создаю резервную копию базы данных...")
+        await run_backup(context)
+
+    await query.edit_message_text(
+        format_backup_report(list_backups(), context.bot_data.get('last_backup')),
+        reply_markup=InlineKeyboardMarkup([
+            [InlineKeyboardButton("▶️ Создать копию", callback_data=CALLBACKS.encode('admin_backup_run'))],
+            [InlineKeyboardButton("🔄 Обновить", callback_data=CALLBACKS.encode('admin_backup'))],
+            [InlineKeyboardButton("🔙 Назад", callback_data=CALLBACKS.encode('admin_back'))]
+        ])
+    )
+
+
+async def delete_ride_admin(update: Update, context: ContextTypes.DEFAULT_TYPE, ride_id: int) -> None:
     """Удаляет поездку из админ-панели"""
     query = update.callback_query
-    await query.answer()
 
     try:
-        ride_id = int(query.data.split("_")[3])
-
         # Получаем информацию о поездке перед удалением
         ride_info = get_ride_by_id(ride_id)
 
         if not ride_info:
-            await query.answer("❌ Поездка не найдена", show_alert=True)
+            await answer_callback(query, "❌ Поездка не найдена", show_alert=True)
             return
 
         # Удаляем поездку
         delete_ride(ride_id)
+        RIDES_VIEW.invalidate(ride_id)
+        LINK_LOOKUPS.pop(('ride', ride_id))
 
-        await query.answer(f"✅ Поездка #{ride_id} удалена", show_alert=True)
+        await answer_callback(query, f"✅ Поездка #{ride_id} удалена", show_alert=True)
 
         # Обновляем список поездок
         await show_active_rides(update, context)
 
     except Exception as e:
         logger.error(f"Ошибка при удалении поездки: {e}")
-        await query.answer("❌ Ошибка при удалении поездки", show_alert=True)
+        await answer_callback(query, "❌ Ошибка при удалении поездки", show_alert=True)
 
 
-async def handle_admin_callbacks(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    """Обработчик callback-запросов для админ-панели"""
+async def admin_back(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Возврат в главное меню админ-панели."""
     query = update.callback_query
-    await query.answer()
 
-    data = query.data
+    await query.edit_message_text(
+        "👑 АДМИН-ПАНЕЛЬ\n\nВыберите действие:",
+        reply_markup=get_admin_keyboard()
+    )
 
-    if data == "admin_stats":
-        await show_admin_stats(update, context)
 
-    elif data == "admin_users":
-        await show_all_users(update, context)
+async def admin_exit(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Закрытие админ-панели."""
+    query = update.callback_query
 
-    elif data == "admin_active_rides":
-        await show_active_rides(update, context)
+    await query.edit_message_text("Админ-панель закрыта.")
 
-    elif data == "admin_broadcast":
-        await start_broadcast(update, context)
 
-    elif data == "admin_cleanup":
-        await perform_cleanup(update, context)
+def deep_link(context: ContextTypes.DEFAULT_TYPE, payload: str) -> str:
+    return f"https://t.me/{context.bot.username}?start={payload}"
 
-    elif data == "admin_confirm_broadcast":
-        await confirm_broadcast(update, context)
 
-    elif data == "admin_back":
-        await query.edit_message_text(
-            "👑 АДМИН-ПАНЕЛЬ\n\nВыберите действие:",
-            reply_markup=get_admin_keyboard()
-        )
+async def open_deep_link(update: Update, context: ContextTypes.DEFAULT_TYPE, payload: str) -> bool:
+    """Ссылка t.me/<бот>?start=...: сразу карточка поездки или результаты поиска.
 
-    elif data == "admin_exit":
-        await query.delete_message()
-        await context.bot.send_message(
-            chat_id=query.message.chat_id,
-            text="Админ-панель закрыта."
+    Поездка, поиск и первая страница результатов берутся из кэша на
+    DEEP_LINK_CACHE_TTL секунд: популярная ссылка не нагружает БД.
+    Возвращает True, если пользователю больше ничего не нужно показывать
+    (соглашение уже принято).
+    """
+    link = DEEP_LINKS.parse(payload)
+    if link is None:
+        return False
+    kind, item_id = link
+
+    user_data = get_user(update.effective_user.id)
+    registered = bool(user_data and user_data[2])
+
+    if kind == 'ride':
+        ride = LINK_LOOKUPS.get(('ride', item_id), lambda: get_ride_card(item_id))
+        if ride is None or not ride[9]:
+            await update.message.reply_text("❌ Поездка по ссылке уже неактуальна.")
+        else:
+            text, reply_markup = ride_card_view(ride, registered)
+            await update.message.reply_text(text, reply_markup=reply_markup)
+    else:
+        search = LINK_LOOKUPS.get(('search', item_id), lambda: get_passenger_search(item_id))
+        if search is None:
+            await update.message.reply_text("❌ Ссылка на поиск устарела.")
+        else:
+            rides, has_next = LINK_LOOKUPS.get(
+                ('page',) + tuple(search),
+                lambda: search_rides_page(*search, limit=SEARCH_PAGE_SIZE)
+            )
+            if not rides:
+                text, reply_markup = empty_search_view(*search, registered, "🔍 По ссылке пока нет поездок.")
+                await update.message.reply_text(text, reply_markup=reply_markup)
+            else:
+                response, reply_markup = search_page_view(
+                    rides, *search, update.effective_user.id, has_next=has_next, user_data=user_data
+                )
+                await update.message.reply_text(response, reply_markup=reply_markup)
+
+    return bool(user_data and len(user_data) > 3 and user_data[3])
+
+
+def load_inline_results(context: ContextTypes.DEFAULT_TYPE, route) -> list:
+    """Готовые inline-результаты по маршруту: на дату или ближайшие, если дата не указана"""
+    if route.date is not None:
+        rides, _ = search_rides_page(route.from_location, route.to_location, route.date, limit=INLINE_MAX_RESULTS)
+    else:
+        today = datetime.now().strftime('%Y-%m-%d')
+        rides = get_upcoming_route_rides(route.from_location, route.to_location, today, INLINE_MAX_RESULTS)
+    return [
+        RIDES_VIEW.inline_result(ride, deep_link(context, DEEP_LINKS.ride_payload(ride[0])))
+        for ride in rides
+    ]
+
+
+async def inline_search(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Поиск поездок из любого чата: @бот Москва Казань 31.12.
+
+    Результаты запроса собираются один раз и живут INLINE_RESULTS_TTL секунд,
+    страницы отдаются срезом по offset; одинаковые запросы разных
+    пользователей Telegram дополнительно кэширует на INLINE_CACHE_TIME.
+    """
+    query = update.inline_query
+    route = parse_route_query(' '.join(query.query.split()))
+    if route is None:
+        await query.answer(
+            [], cache_time=INLINE_CACHE_TIME,
+            button=InlineQueryResultsButton("Формат: Москва Казань 31.12", start_parameter="inline")
         )
+        return
 
-    elif data.startswith("admin_delete_ride_"):
-        await delete_ride_admin(update, context)
+    # Недописанные пункты дополняются самыми популярными: «Москва Каз» — Москва → Казань
+    route.from_location = LOCATIONS.resolve(route.from_location)
+    route.to_location = LOCATIONS.resolve(route.to_location)
+    results = INLINE_RESULTS.get(
+        (route.from_location, route.to_location, route.date),
+        lambda: load_inline_results(context, route)
+    )
+    try:
+        offset = max(int(query.offset or 0), 0)
+    except ValueError:
+        offset = 0
+    end = offset + INLINE_PAGE_SIZE
+
+    await query.answer(
+        results[offset:end],
+        cache_time=INLINE_CACHE_TIME,
+        is_personal=False,
+        next_offset=str(end) if end < len(results) else '',
+        button=None if results else InlineQueryResultsButton("Поездок нет — открыть бота", start_parameter="inline")
+    )
 
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -662,6 +953,11 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         )
         return
 
+    # Переход по ссылке на поездку или поиск: показываем ее сразу,
+    # новым пользователям после этого — обычное знакомство с ботом
+    if context.args and await open_deep_link(update, context, context.args[0]):
+        return
+
     user = update.effective_user
     chat_type = get_chat_type(update)
     is_subscribed = await check_subscription(user.id, context)
@@ -677,7 +973,7 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
             [InlineKeyboardButton("📢 Подписаться на канал",
                                 url=f"https://t.me/{REQUIRED_CHANNEL[1:]}")],
             [InlineKeyboardButton("✅ Я подписался",
-                                callback_data="check_subscription")]
+                                callback_data=CALLBACKS.encode('check_subscription'))]
         ]
         reply_markup = InlineKeyboardMarkup(keyboard)
 
@@ -718,336 +1014,339 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         )
 
 
-async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    """Обработчик нажатий на inline-кнопки для проверки подписки."""
+async def check_subscription_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Повторная проверка подписки по кнопке «Я подписался»."""
     query = update.callback_query
-    await query.answer()
-
-    if query.data == "check_subscription":
-        user_id = query.from_user.id
-        chat_type = query.message.chat.type
-        is_subscribed = await check_subscription(user_id, context)
-
-        if is_subscribed:
-            # Проверяем, принимал ли пользователь соглашение
-            user_data = get_user(user_id)
-            if user_data:
-                # Пользователь зарегистрирован, проверяем accepted_terms
-                if len(user_data) > 3:  # Проверяем, есть ли поле accepted_terms
-                    accepted_terms = user_data[3]
-                    if not accepted_terms:
-                        # Показываем соглашение для принятия
-                        await show_terms_acceptance(update, context)
-                        return
-            else:
-                # Пользователь не зарегистрирован, показываем соглашение
-                await show_terms_acceptance(update, context)
-                return
-
-            # Удаляем старое сообщение с inline-кнопками
-            await query.delete_message()
-            # Отправляем новое сообщение с обычной клавиатурой
-            await context.bot.send_message(
-                chat_id=query.message.chat_id,
-                text="Отлично! Вы подписаны на канал!\n\nТеперь вы можете пользоваться всеми функциями бота.\nВыберите вашу роль:",
-                reply_markup=get_role_selection_keyboard(chat_type)
-            )
-        else:
-            keyboard = [
-                [InlineKeyboardButton("📢 Подписаться на канал",
-                                    url=f"https://t.me/{REQUIRED_CHANNEL[1:]}")],
-                [InlineKeyboardButton("🔄 Проверить подписку",
-                                    callback_data="check_subscription")]
-            ]
-            reply_markup = InlineKeyboardMarkup(keyboard)
 
-            await query.edit_message_text(
-                "Вы еще не подписались на канал!\n\n"
-                "Пожалуйста, подпишитесь на канал и нажмите 'Проверить подписку'",
-                reply_markup=reply_markup
-            )
-
-    elif query.data == "accept_terms":
-        # Обновляем базу данных - пользователь принял соглашение
-        user_id = query.from_user.id
-        chat_type = query.message.chat.type
+    user_id = query.from_user.id
+    chat_type = query.message.chat.type
+    is_subscribed = await check_subscription(user_id, context)
 
-        # Проверяем, есть ли пользователь в базе
+    if is_subscribed:
+        # Проверяем, принимал ли пользователь соглашение
         user_data = get_user(user_id)
-        if not user_data:
-            # Если пользователя нет, регистрируем его с accepted_terms = 1
-            username = query.from_user.username or query.from_user.first_name
-            # Используем новую функцию add_user_with_terms
-            add_user_with_terms(user_id, username, None, True)
+        if user_data:
+            # Пользователь зарегистрирован, проверяем accepted_terms
+            if len(user_data) > 3:  # Проверяем, есть ли поле accepted_terms
+                accepted_terms = user_data[3]
+                if not accepted_terms:
+                    # Показываем соглашение для принятия
+                    await show_terms_acceptance(update, context)
+                    return
         else:
-            # Обновляем существующего пользователя
-            update_user_terms(user_id, True)
+            # Пользователь не зарегистрирован, показываем соглашение
+            await show_terms_acceptance(update, context)
+            return
 
         # Удаляем старое сообщение с inline-кнопками
         await query.delete_message()
         # Отправляем новое сообщение с обычной клавиатурой
         await context.bot.send_message(
             chat_id=query.message.chat_id,
-            text="✅ Вы автоматически соглашаетесь с пользовательским соглашением и политикой конфиденциальности.\n\nТеперь вы можете пользоваться всеми функциями бота.\nВыберите вашу роль:",
+            text="Отлично! Вы подписаны на канал!\n\nТеперь вы можете пользоваться всеми функциями бота.\nВыберите вашу роль:",
             reply_markup=get_role_selection_keyboard(chat_type)
         )
+    else:
+        keyboard = [
+            [InlineKeyboardButton("📢 Подписаться на канал",
+                                url=f"https://t.me/{REQUIRED_CHANNEL[1:]}")],
+            [InlineKeyboardButton("🔄 Проверить подписку",
+                                callback_data=CALLBACKS.encode('check_subscription'))]
+        ]
+        reply_markup = InlineKeyboardMarkup(keyboard)
 
+        await query.edit_message_text(
+            "Вы еще не подписались на канал!\n\n"
+            "Пожалуйста, подпишитесь на канал и нажмите 'Проверить подписку'",
+            reply_markup=reply_markup
+        )
 
-async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    """Обработчик текстовых сообщений (кнопок меню)."""
-    # Проверяем, что сообщение в личном чате
-    if update.message.chat.type != "private":
-        # В группах игнорируем сообщения
-        return
 
-    # Проверяем, не является ли это сообщением для рассылки
-    if 'broadcast_step' in context.user_data:
-        await handle_broadcast_message(update, context)
-        return
+async def accept_terms_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Принятие пользовательского соглашения."""
+    query = update.callback_query
 
-    user_id = update.effective_user.id
-    message_text = update.message.text
-    chat_type = get_chat_type(update)
+    # Обновляем базу данных - пользователь принял соглашение
+    user_id = query.from_user.id
+    chat_type = query.message.chat.type
 
-    # Проверяем, принимал ли пользователь соглашение
+    # Проверяем, есть ли пользователь в базе
     user_data = get_user(user_id)
-    if user_data and len(user_data) > 3:
-        accepted_terms = user_data[3]
-        if not accepted_terms and message_text not in ["/start", "/help", "/terms", "/admin"]:
-            # Пользователь не принял соглашение
-            await update.message.reply_text(
-                "Для использования бота необходимо принять пользовательское соглашение!\n\n"
-                "Пожалуйста, сначала запустите /start и примите условия соглашения."
-            )
-            return
-    elif user_data and message_text not in ["/start", "/help", "/terms", "/admin"]:
-        # Старая запись пользователя без поле accepted_terms
-        # Показываем соглашение
-        await show_terms_acceptance(update, context)
-        return
-    elif not user_data and message_text not in ["/start", "/help", "/terms", "/admin"]:
-        # Пользователь не зарегистрирован и не принимал соглашение
-        await update.message.reply_text(
-            "Для использования бота необходимо принять пользовательское соглашение!\n\n"
-            "Пожалуйста, сначала запустите /start и примите условия соглашения."
-        )
-        return
+    if not user_data:
+        # Если пользователя нет, регистрируем его с accepted_terms = 1
+        username = query.from_user.username or query.from_user.first_name
+        # Используем новую функцию add_user_with_terms
+        add_user_with_terms(user_id, username, None, True)
+    else:
+        # Обновляем существующего пользователя
+        update_user_terms(user_id, True)
+
+    # Удаляем старое сообщение с inline-кнопками
+    await query.delete_message()
+    # Отправляем новое сообщение с обычной клавиатурой
+    await context.bot.send_message(
+        chat_id=query.message.chat_id,
+        text="✅ Вы автоматически соглашаетесь с пользовательским соглашением и политикой конфиденциальности.\n\nТеперь вы можете пользоваться всеми функциями бота.\nВыберите вашу роль:",
+        reply_markup=get_role_selection_keyboard(chat_type)
+    )
 
-    # Проверяем подписку для большинства команд
-    if message_text in ["🚗 Я водитель", "👤 Я пассажир", "🚗 Создать поездку",
-                       "🔍 Найти поездку", "📋 Мои поездки", "📋 Мои поиски",
-                       "🚗 Актуальные поездки", "📞 Регистрация", "🔄 Сменить роль"]:
-        is_subscribed = await check_subscription(user_id, context)
-        if not is_subscribed:
-            keyboard = [
-                [InlineKeyboardButton("📢 Подписаться на канал",
-                                    url=f"https://t.me/{REQUIRED_CHANNEL[1:]}")],
-                [InlineKeyboardButton("✅ Я подписался",
-                                    callback_data="check_subscription")]
-            ]
-            reply_markup = InlineKeyboardMarkup(keyboard)
 
-            await update.message.reply_text(
-                "Для использования этой функции необходимо подписаться на канал!\n\n"
-                "Пожалуйста, подпишитесь на канал ниже, затем нажмите 'Я подписался'",
-                reply_markup=reply_markup
-            )
-            return
+async def choose_driver_role(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Выбор роли водителя"""
+    context.user_data['role'] = 'driver'
+    await update.message.reply_text(
+        "✅ Вы выбрали роль Водителя\n\n"
+        "Теперь вы можете:\n"
+        "• 🚗 Создать поездку - предложить другим поехать с вами\n"
+        "• 📋 Мои поездки - просмотреть ваши созданные поездки\n"
+        "• 📞 Регистрация - зарегистрироваться в системе\n"
+        "• 🔄 Сменить роль - переключиться на роль пассажира\n\n"
+        "Выберите действие:",
+        reply_markup=get_driver_keyboard(get_chat_type(update))
+    )
+
+
+async def choose_passenger_role(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Выбор роли пассажира"""
+    context.user_data['role'] = 'passenger'
+    await update.message.reply_text(
+        "✅ Вы выбрали роль Пассажира\n\n"
+        "Теперь вы можете:\n"
+        "• 🔍 Найти поездку - найти попутчиков\n"
+        "• 📋 Мои поиски - история ваших поисков\n"
+        "• 🚗 Актуальные поездки - поездки по вашим поискам\n"
+        "• 📞 Регистрация - зарегистрироваться в системе\n"
+        "• 🔄 Сменить роль - переключиться на роль водителя\n\n"
+        "Выберите действие:",
+        reply_markup=get_passenger_keyboard(get_chat_type(update))
+    )
+
+
+async def change_role(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Сброс роли и повторный выбор"""
+    if 'role' in context.user_data:
+        del context.user_data['role']
+    await update.message.reply_text(
+        "Смена роли\n\n"
+        "Пожалуйста, выберите новую роль:",
+        reply_markup=get_role_selection_keyboard(get_chat_type(update))
+    )
 
-    # Обработка выбора роли
-    if message_text == "🚗 Я водитель":
-        # Проверяем регистрацию для водителя
-        user_data = get_user(user_id)
-        if not user_data or not user_data[2]:  # user_data[2] - телефон
-            await update.message.reply_text(
-                "❌ Для использования роли водителя необходимо зарегистрироваться!\n\n"
-                "Пожалуйста, сначала зарегистрируйтесь через кнопку '📞 Регистрация', "
-                "а затем выберите роль водителя снова.",
-                reply_markup=get_registration_keyboard(chat_type)
-            )
-            return
 
-        context.user_data['role'] = 'driver'
+async def show_role_menu(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Ответ на произвольный текст вне сценариев: меню текущей роли"""
+    chat_type = get_chat_type(update)
+    role = context.user_data.get('role')
+    if role == 'driver':
         await update.message.reply_text(
-            "✅ Вы выбрали роль Водителя\n\n"
-            "Теперь вы можете:\n"
-            "• 🚗 Создать поездку - предложить другим поехать с вами\n"
-            "• 📋 Мои поездки - просмотреть ваши созданные поездки\n"
-            "• 📞 Регистрация - зарегистрироваться в системе\n"
-            "• 🔄 Сменить роль - переключиться на роль пассажира\n\n"
-            "Выберите действие:",
+            "Используйте меню водителя:",
             reply_markup=get_driver_keyboard(chat_type)
         )
-
-    elif message_text == "👤 Я пассажир":
-        context.user_data['role'] = 'passenger'
+    elif role == 'passenger':
         await update.message.reply_text(
-            "✅ Вы выбрали роль Пассажира\n\n"
-            "Теперь вы можете:\n"
-            "• 🔍 Найти поездку - найти попутчиков\n"
-            "• 📋 Мои поиски - история ваших поисков\n"
-            "• 🚗 Актуальные поездки - поездки по вашим поискам\n"
-            "• 📞 Регистрация - зарегистрироваться в системе\n"
-            "• 🔄 Сменить роль - переключиться на роль водителя\n\n"
-            "Выберите действие:",
+            "Используйте меню пассажира:",
             reply_markup=get_passenger_keyboard(chat_type)
         )
-
-    elif message_text == "🔄 Сменить роль":
-        # Очищаем текущую роль
-        if 'role' in context.user_data:
-            del context.user_data['role']
+    else:
         await update.message.reply_text(
-            "Смена роли\n\n"
-            "Пожалуйста, выберите новую роль:",
+            "Пожалуйста, сначала выберите вашу роль:",
             reply_markup=get_role_selection_keyboard(chat_type)
         )
 
-    # Обработка команд водителя
-    elif message_text == "🚗 Создать поездку":
-        if context.user_data.get('role') == 'driver':
-            # Дополнительная проверка регистрации
-            user_data = get_user(user_id)
-            if not user_data or not user_data[2]:  # user_data[2] - телефон
-                await update.message.reply_text(
-                    "❌ Для создания поездки необходимо зарегистрироваться!\n\n"
-                    "Пожалуйста, сначала зарегистрируйтесь через кнопку '📞 Регистрация'.",
-                    reply_markup=get_driver_keyboard(chat_type)
-                )
-                return
-            await start_create_ride(update, context)
-        else:
-            await update.message.reply_text(
-                "Эта функция доступна только для водителей.",
-                reply_markup=get_role_selection_keyboard(chat_type)
-            )
 
-    elif message_text == "📋 Мои поездки":
-        if context.user_data.get('role') == 'driver':
-            # Дополнительная проверка регистрации
-            user_data = get_user(user_id)
-            if not user_data or not user_data[2]:  # user_data[2] - телефон
-                await update.message.reply_text(
-                    "❌ Для просмотра ваших поездок необходимо зарегистрироваться!\n\n"
-                    "Пожалуйста, сначала зарегистрируйтесь через кнопку '📞 Регистрация'.",
-                    reply_markup=get_driver_keyboard(chat_type)
-                )
-                return
-            await my_rides(update, context)
-        else:
-            await update.message.reply_text(
-                "Эта функция доступна только для водителей.",
-                reply_markup=get_role_selection_keyboard(chat_type)
-            )
+# Факты об обновлении, общие для проверок маршрутов
+async def _fetch_user(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    started = time.monotonic()
+    user_data = get_user(update.effective_user.id)
+    LATENCY.observe('db', time.monotonic() - started)
+    return user_data
 
-    # Обработка команд пассажира
-    elif message_text == "🔍 Найти поездку":
-        if context.user_data.get('role') == 'passenger':
-            # Дополнительная проверка регистрации для сохранения поисков
-            user_data = get_user(user_id)
-            if not user_data or not user_data[2]:  # user_data[2] - телефон
-                await update.message.reply_text(
-                    "ℹ️ Поиск работает без регистрации, но для сохранения истории поисков и получения контактов водителей необходима регистрация.\n\n"
-                    "Хотите зарегистрироваться сейчас?",
-                    reply_markup=get_registration_keyboard(chat_type)
-                )
-                # Устанавливаем флаг, что пользователь хочет зарегистрироваться после поиска
-                context.user_data['register_after_search'] = True
-                return
-            await start_search_ride(update, context)
-        else:
-            await update.message.reply_text(
-                "Эта функция доступна только для пассажиров.",
-                reply_markup=get_role_selection_keyboard(chat_type)
-            )
 
-    elif message_text == "📋 Мои поиски":
-        if context.user_data.get('role') == 'passenger':
-            # Дополнительная проверка регистрации
-            user_data = get_user(user_id)
-            if not user_data or not user_data[2]:  # user_data[2] - телефон
-                await update.message.reply_text(
-                    "❌ Для просмотра истории поисков необходимо зарегистрироваться!\n\n"
-                    "Пожалуйста, сначала зарегистрируйтесь через кнопку '📞 Регистрация'.",
-                    reply_markup=get_passenger_keyboard(chat_type)
-                )
-                return
-            await my_searches(update, context)
-        else:
-            await update.message.reply_text(
-                "Эта функция доступна только для пассажиров.",
-                reply_markup=get_role_selection_keyboard(chat_type)
-            )
+async def _fetch_subscription(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    return await check_subscription(update.effective_user.id, context)
 
-    elif message_text == "🚗 Актуальные поездки":
-        if context.user_data.get('role') == 'passenger':
-            # Дополнительная проверка регистрации
-            user_data = get_user(user_id)
-            if not user_data or not user_data[2]:  # user_data[2] - телефон
-                await update.message.reply_text(
-                    "❌ Для просмотра актуальных поездок необходимо зарегистрироваться!\n\n"
-                    "Пожалуйста, сначала зарегистрируйтесь через кнопку '📞 Регистрация'.",
-                    reply_markup=get_passenger_keyboard(chat_type)
-                )
-                return
-            await relevant_rides(update, context)
-        else:
-            await update.message.reply_text(
-                "Эта функция доступна только для пассажиров.",
-                reply_markup=get_role_selection_keyboard(chat_type)
-            )
 
-    # Общие команды
-    elif message_text == "📞 Регистрация":
-        await start_registration(update, context)
+TERMS_EXEMPT_TEXTS = frozenset(["/start", "/help", "/terms", "/admin"])
+TERMS_REQUIRED_TEXT = (
+    "Для использования бота необходимо принять пользовательское соглашение!\n\n"
+    "Пожалуйста, сначала запустите /start и примите условия соглашения."
+)
 
-    elif message_text == "❓ Помощь":
-        await help_command(update, context)
 
-    elif message_text == "❌ Отмена":
-        await cancel_command(update, context)
+async def _accepted_terms(update: Update, context: ContextTypes.DEFAULT_TYPE, facts) -> bool:
+    if update.message.text in TERMS_EXEMPT_TEXTS:
+        return True
+    user_data = await facts.get('user')
+    return bool(user_data and len(user_data) > 3 and user_data[3])
 
-    elif message_text == "🔙 Назад":
-        await back_to_main(update, context)
 
+async def _reject_terms(update: Update, context: ContextTypes.DEFAULT_TYPE, facts) -> None:
+    user_data = await facts.get('user')
+    if user_data and len(user_data) <= 3:
+        # Старая запись пользователя без поля accepted_terms: показываем соглашение
+        await show_terms_acceptance(update, context)
     else:
-        # Обработка ввода данных
-        if 'create_ride_step' in context.user_data:
-            # Проверяем регистрацию при создании поездки
-            user_data = get_user(user_id)
-            if not user_data or not user_data[2]:
-                await update.message.reply_text(
-                    "❌ Для создания поездки необходимо зарегистрироваться!\n\n"
-                    "Пожалуйста, сначала зарегистрируйтесь через кнопку '📞 Регистрация'.",
-                    reply_markup=get_driver_keyboard(chat_type)
-                )
-                # Очищаем шаг создания поездки
-                if 'create_ride_step' in context.user_data:
-                    del context.user_data['create_ride_step']
-                return
-            await handle_create_ride_step(update, context)
-        elif 'search_ride_step' in context.user_data:
-            await handle_search_ride_step(update, context)
-        elif 'registration_step' in context.user_data:
-            await handle_registration_step(update, context)
-        else:
-            # Проверяем, выбрана ли роль
-            role = context.user_data.get('role')
-            if role == 'driver':
-                await update.message.reply_text(
-                    "Используйте меню водителя:",
-                    reply_markup=get_driver_keyboard(chat_type)
-                )
-            elif role == 'passenger':
-                await update.message.reply_text(
-                    "Используйте меню пассажира:",
-                    reply_markup=get_passenger_keyboard(chat_type)
-                )
-            else:
-                await update.message.reply_text(
-                    "Пожалуйста, сначала выберите вашу роль:",
-                    reply_markup=get_role_selection_keyboard(chat_type)
-                )
+        await update.message.reply_text(TERMS_REQUIRED_TEXT)
+
+
+async def _is_subscribed(update: Update, context: ContextTypes.DEFAULT_TYPE, facts) -> bool:
+    return await facts.get('subscribed')
+
+
+async def _reject_subscription(update: Update, context: ContextTypes.DEFAULT_TYPE, facts) -> None:
+    keyboard = [
+        [InlineKeyboardButton("📢 Подписаться на канал",
+                            url=f"https://t.me/{REQUIRED_CHANNEL[1:]}")],
+        [InlineKeyboardButton("✅ Я подписался",
+                            callback_data=CALLBACKS.encode('check_subscription'))]
+    ]
+    await update.message.reply_text(
+        "Для использования этой функции необходимо подписаться на канал!\n\n"
+        "Пожалуйста, подпишитесь на канал ниже, затем нажмите 'Я подписался'",
+        reply_markup=InlineKeyboardMarkup(keyboard)
+    )
+
+
+async def _is_registered(update: Update, context: ContextTypes.DEFAULT_TYPE, facts) -> bool:
+    user_data = await facts.get('user')
+    return bool(user_data and user_data[2])  # user_data[2] - телефон
+
+
+def role_required(role: str, text: str) -> Guard:
+    """Проверка выбранной роли"""
+    async def has_role(update, context, facts):
+        return context.user_data.get('role') == role
+
+    async def reject(update, context, facts):
+        await update.message.reply_text(
+            text,
+            reply_markup=get_role_selection_keyboard(get_chat_type(update))
+        )
+    return Guard(f'role:{role}', has_role, reject)
+
+
+def registration_required(text: str, get_keyboard, on_reject=None) -> Guard:
+    """Проверка регистрации (телефона) с ответом, своим для каждого маршрута"""
+    async def reject(update, context, facts):
+        if on_reject:
+            on_reject(context)
+        await update.message.reply_text(text, reply_markup=get_keyboard(get_chat_type(update)))
+    return REGISTERED.with_fail(reject)
+
+
+TERMS_ACCEPTED = Guard('terms', _accepted_terms, _reject_terms)
+SUBSCRIBED = Guard('subscribed', _is_subscribed, _reject_subscription)
+REGISTERED = Guard('registered', _is_registered)
+DRIVER_ONLY = role_required('driver', "Эта функция доступна только для водителей.")
+PASSENGER_ONLY = role_required('passenger', "Эта функция доступна только для пассажиров.")
+
+
+def _remember_register_after_search(context):
+    # Пользователь хочет зарегистрироваться после поиска
+    context.user_data['register_after_search'] = True
+
+
+def _is_quick_ride(text, user_data):
+    return user_data.get('role') == 'driver' and parse_ride_text(text) is not None
+
+
+def _is_quick_search(text, user_data):
+    return user_data.get('role') == 'passenger' and parse_ride_text(text) is not None
+
+
+def _drop_create_ride_step(context):
+    if 'create_ride_step' in context.user_data:
+        del context.user_data['create_ride_step']
+
+
+def build_message_router() -> MessageRouter:
+    """Таблица маршрутов текстовых сообщений (кнопок меню и шагов сценариев)"""
+    router = MessageRouter(
+        providers={'user': _fetch_user, 'subscribed': _fetch_subscription},
+        pre_guards=(TERMS_ACCEPTED,)
+    )
+
+    # Выбор роли
+    router.label("🚗 Я водитель", choose_driver_role, SUBSCRIBED, registration_required(
+        "❌ Для использования роли водителя необходимо зарегистрироваться!\n\n"
+        "Пожалуйста, сначала зарегистрируйтесь через кнопку '📞 Регистрация', "
+        "а затем выберите роль водителя снова.",
+        get_registration_keyboard
+    ))
+    router.label("👤 Я пассажир", choose_passenger_role, SUBSCRIBED)
+    router.label("🔄 Сменить роль", change_role, SUBSCRIBED)
+
+    # Команды водителя
+    router.label("🚗 Создать поездку", start_create_ride, SUBSCRIBED, DRIVER_ONLY, registration_required(
+        "❌ Для создания поездки необходимо зарегистрироваться!\n\n"
+        "Пожалуйста, сначала зарегистрируйтесь через кнопку '📞 Регистрация'.",
+        get_driver_keyboard
+    ))
+    router.label("📋 Мои поездки", my_rides, SUBSCRIBED, DRIVER_ONLY, registration_required(
+        "❌ Для просмотра ваших поездок необходимо зарегистрироваться!\n\n"
+        "Пожалуйста, сначала зарегистрируйтесь через кнопку '📞 Регистрация'.",
+        get_driver_keyboard
+    ))
+
+    # Команды пассажира
+    router.label("🔍 Найти поездку", start_search_ride, SUBSCRIBED, PASSENGER_ONLY, registration_required(
+        "ℹ️ Поиск работает без регистрации, но для сохранения истории поисков и получения контактов водителей необходима регистрация.\n\n"
+        "Хотите зарегистрироваться сейчас?",
+        get_registration_keyboard,
+        on_reject=_remember_register_after_search
+    ))
+    router.label("📋 Мои поиски", my_searches, SUBSCRIBED, PASSENGER_ONLY, registration_required(
+        "❌ Для просмотра истории поисков необходимо зарегистрироваться!\n\n"
+        "Пожалуйста, сначала зарегистрируйтесь через кнопку '📞 Регистрация'.",
+        get_passenger_keyboard
+    ))
+    router.label("🚗 Актуальные поездки", relevant_rides, SUBSCRIBED, PASSENGER_ONLY, registration_required(
+        "❌ Для просмотра актуальных поездок необходимо зарегистрироваться!\n\n"
+        "Пожалуйста, сначала зарегистрируйтесь через кнопку '📞 Регистрация'.",
+        get_passenger_keyboard
+    ))
+
+    # Общие команды
+    router.label("📞 Регистрация", start_registration, SUBSCRIBED)
+    router.label("❓ Помощь", help_command)
+    router.label("❌ Отмена", cancel_command)
+    router.label("🔙 Назад", back_to_main)
+
+    # Ввод данных в пошаговых сценариях (порядок важен)
+    router.state('create_ride_step', handle_create_ride_step, registration_required(
+        "❌ Для создания поездки необходимо зарегистрироваться!\n\n"
+        "Пожалуйста, сначала зарегистрируйтесь через кнопку '📞 Регистрация'.",
+        get_driver_keyboard,
+        on_reject=_drop_create_ride_step
+    ))
+    router.state('search_ride_step', handle_search_ride_step)
+    router.state('registration_step', handle_registration_step)
+
+    # Поездка или поиск одной строкой вне сценариев
+    router.pattern(_is_quick_ride, quick_create_ride, SUBSCRIBED, registration_required(
+        "❌ Для создания поездки необходимо зарегистрироваться!\n\n"
+        "Пожалуйста, сначала зарегистрируйтесь через кнопку '📞 Регистрация'.",
+        get_driver_keyboard
+    ))
+    router.pattern(_is_quick_search, quick_search_ride, SUBSCRIBED)
+
+    router.fallback(show_role_menu)
+    return router
+
+
+async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Обработчик текстовых сообщений (кнопок меню)."""
+    # Проверяем, что сообщение в личном чате
+    if update.message.chat.type != "private":
+        # В группах игнорируем сообщения
+        return
+
+    # Проверяем, не является ли это сообщением для рассылки
+    if 'broadcast_step' in context.user_data:
+        await handle_broadcast_message(update, context)
+        return
+
+    await MESSAGE_ROUTER.dispatch(update, context)
 
 
 async def handle_contact(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -1245,10 +1544,131 @@ async def start_create_ride(update: Update, context: ContextTypes.DEFAULT_TYPE)
 
     context.user_data['create_ride_step'] = 'from'
     await update.message.reply_text(
+        "🚗 Создание поездки\n\n"
+        "Шаг 1/5: Откуда выезжаете?\n"
+        "Например: Москва\n\n"
+        "💡 Можно сразу одной строкой: Москва - Казань 31.12 14:30 3",
+        reply_markup=get_location_keyboard(chat_type, LOCATIONS.suggest(limit=LOCATION_SUGGESTIONS))
+    )
+
+
+async def continue_ride_draft(update: Update, context: ContextTypes.DEFAULT_TYPE, parsed) -> None:
+    """Поездка из одного сообщения: сохраняем разобранное и спрашиваем только недостающее"""
+    chat_type = get_chat_type(update)
+    context.user_data['from_location'] = parsed.from_location
+    context.user_data['to_location'] = parsed.to_location
+    context.user_data['date'] = parsed.date
+
+    if parsed.time is None:
+        context.user_data['create_ride_step'] = 'time'
+        await update.message.reply_text(
+            f"📍 {parsed.from_location} → {parsed.to_location}, {format_date_for_display(parsed.date)}\n\n"
+            "Время выезда?\n"
+            "Формат: ЧЧ:ММ\n"
+            "Например: 14:30",
+            reply_markup=get_cancel_keyboard(chat_type)
+        )
+        return
+
+    context.user_data['time'] = parsed.time
+    if parsed.seats is None:
+        context.user_data['create_ride_step'] = 'seats'
+        await update.message.reply_text(
+            f"📍 {parsed.from_location} → {parsed.to_location}, "
+            f"{format_date_for_display(parsed.date)} в {parsed.time}\n\n"
+            "Сколько свободных мест?\n"
+            "Введите число от 1 до 10:",
+            reply_markup=get_cancel_keyboard(chat_type)
+        )
+        return
+
+    # Все данные есть: сразу карточка для подтверждения
+    context.user_data['seats'] = parsed.seats
+    context.user_data['create_ride_step'] = 'confirm'
+    keyboard = InlineKeyboardMarkup([
+        [InlineKeyboardButton("✅ Создать поездку", callback_data=CALLBACKS.encode('confirm_ride'))],
+        [InlineKeyboardButton("✏️ Заполнить по шагам", callback_data=CALLBACKS.encode('edit_ride_draft'))]
+    ])
+    await update.message.reply_text(
+        f"📝 Проверьте поездку:\n\n"
+        f"📍 Откуда: {parsed.from_location}\n"
+        f"📍 Куда: {parsed.to_location}\n"
+        f"📅 Дата: {format_date_for_display(parsed.date)}\n"
+        f"🕒 Время: {parsed.time}\n"
+        f"👥 Свободных мест: {parsed.seats}",
+        reply_markup=keyboard
+    )
+
+
+async def create_ride_from_draft(update: Update, context: ContextTypes.DEFAULT_TYPE, seats: int) -> None:
+    """Создание поездки из данных сценария и сообщение водителю"""
+    chat_type = get_chat_type(update)
+    user_id = update.effective_user.id
+    username = update.effective_user.username or update.effective_user.first_name
+
+    ride_id = add_ride(
+        user_id,
+        context.user_data['from_location'],
+        context.user_data['to_location'],
+        context.user_data['date'],  # В формате YYYY-MM-DD
+        context.user_data['time'],
+        seats
+    )
+
+    # Форматируем дату для отображения пользователю
+    display_date = format_date_for_display(context.user_data['date'])
+
+    await update.effective_message.reply_text(
+        f"✅ Поездка создана!\n\n"
+        f"📍 Откуда: {context.user_data['from_location']}\n"
+        f"📍 Куда: {context.user_data['to_location']}\n"
+        f"📅 Дата: {display_date}\n"
+        f"🕒 Время: {context.user_data['time']}\n"
+        f"👥 Свободных мест: {seats}\n\n"
+        f"👤 Водитель: {username}\n\n"
+        f"🔗 Ссылка для попутчиков: {deep_link(context, DEEP_LINKS.ride_payload(ride_id))}",
+        reply_markup=get_driver_keyboard(chat_type)
+    )
+
+    # Очищаем данные
+    for key in ['create_ride_step', 'from_location', 'to_location', 'date', 'time', 'seats', 'location_hint']:
+        if key in context.user_data:
+            del context.user_data[key]
+
+
+async def quick_create_ride(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Водитель прислал поездку одной строкой вне сценария"""
+    await continue_ride_draft(update, context, parse_ride_text(update.message.text))
+
+
+async def confirm_ride(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Кнопка «Создать поездку» под карточкой из одного сообщения"""
+    query = update.callback_query
+
+    if context.user_data.get('create_ride_step') != 'confirm' or context.user_data.get('role') != 'driver':
+        await answer_callback(query, "❌ Черновик устарел, отправьте поездку заново", show_alert=True)
+        return
+
+    # Убираем кнопки, чтобы повторное нажатие не создало вторую поездку
+    await query.edit_message_reply_markup(None)
+    await create_ride_from_draft(update, context, context.user_data['seats'])
+
+
+async def edit_ride_draft(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Переход от карточки к обычному пошаговому созданию поездки"""
+    query = update.callback_query
+
+    for key in ['from_location', 'to_location', 'date', 'time', 'seats']:
+        if key in context.user_data:
+            del context.user_data[key]
+    context.user_data['create_ride_step'] = 'from'
+
+    await query.edit_message_reply_markup(None)
+    await query.message.reply_text(
         "🚗 Создание поездки\n\n"
         "Шаг 1/5: Откуда выезжаете?\n"
         "Например: Москва",
-        reply_markup=get_cancel_keyboard(chat_type)
+        reply_markup=get_location_keyboard(get_chat_type(update), LOCATIONS.suggest(limit=LOCATION_SUGGESTIONS))
     )
 
 
@@ -1258,17 +1678,39 @@ async def handle_create_ride_step(update: Update, context: ContextTypes.DEFAULT_
     message_text = update.message.text
     chat_type = get_chat_type(update)
 
-    if step == 'from':
-        context.user_data['from_location'] = message_text
+    if step in ('from', 'confirm'):
+        # Вся поездка одной строкой — пропускаем оставшиеся шаги
+        parsed = parse_ride_text(message_text)
+        if parsed is not None:
+            await continue_ride_draft(update, context, parsed)
+            return
+
+    if step == 'confirm':
+        await update.message.reply_text(
+            "Нажмите «✅ Создать поездку» под карточкой выше "
+            "или отправьте поездку заново одной строкой.",
+            reply_markup=get_cancel_keyboard(chat_type)
+        )
+
+    elif step == 'from':
+        location = await read_location(update, context)
+        if location is None:
+            return
+        context.user_data['from_location'] = location
         context.user_data['create_ride_step'] = 'to'
         await update.message.reply_text(
             "Шаг 2/5: Куда едете?\n"
             "Например: Санкт-Петербург",
-            reply_markup=get_cancel_keyboard(chat_type)
+            reply_markup=get_location_keyboard(
+                chat_type, LOCATIONS.suggest(limit=LOCATION_SUGGESTIONS, exclude=location)
+            )
         )
 
     elif step == 'to':
-        context.user_data['to_location'] = message_text
+        location = await read_location(update, context, exclude=context.user_data.get('from_location'))
+        if location is None:
+            return
+        context.user_data['to_location'] = location
         context.user_data['create_ride_step'] = 'date'
         await update.message.reply_text(
             "Шаг 3/5: Дата поездки?\n"
@@ -1321,37 +1763,7 @@ async def handle_create_ride_step(update: Update, context: ContextTypes.DEFAULT_
             if seats < 1 or seats > 10:
                 raise ValueError
 
-            # Создаем поездку
-            user_id = update.effective_user.id
-            username = update.effective_user.username or update.effective_user.first_name
-
-            add_ride(
-                user_id,
-                context.user_data['from_location'],
-                context.user_data['to_location'],
-                context.user_data['date'],  # В формате YYYY-MM-DD
-                context.user_data['time'],
-                seats
-            )
-
-            # Форматируем дату для отображения пользователю
-            display_date = format_date_for_display(context.user_data['date'])
-
-            await update.message.reply_text(
-                f"✅ Поездка создана!\n\n"
-                f"📍 Откуда: {context.user_data['from_location']}\n"
-                f"📍 Куда: {context.user_data['to_location']}\n"
-                f"📅 Дата: {display_date}\n"
-                f"🕒 Время: {context.user_data['time']}\n"
-                f"👥 Свободных мест: {seats}\n\n"
-                f"👤 Водитель: {username}",
-                reply_markup=get_driver_keyboard(chat_type)
-            )
-
-            # Очищаем данные
-            for key in ['create_ride_step', 'from_location', 'to_location', 'date', 'time']:
-                if key in context.user_data:
-                    del context.user_data[key]
+            await create_ride_from_draft(update, context, seats)
 
         except ValueError:
             await update.message.reply_text(
@@ -1372,9 +1784,99 @@ async def start_search_ride(update: Update, context: ContextTypes.DEFAULT_TYPE)
     await update.message.reply_text(
         "🔍 Поиск поездки\n\n"
         "Шаг 1/3: Откуда ищете поездку?\n"
-        "Например: Москва",
-        reply_markup=get_cancel_keyboard(chat_type)
+        "Например: Москва\n\n"
+        "💡 Можно сразу одной строкой: Москва Казань завтра",
+        reply_markup=get_location_keyboard(chat_type, LOCATIONS.suggest(limit=LOCATION_SUGGESTIONS))
+    )
+
+
+def empty_search_view(from_location: str, to_location: str, date: str, registered: bool, header: str):
+    """Ответ на поиск без прямых поездок: варианты с пересадками и ближайшие даты.
+
+    Кнопка даты открывает поездки маршрута на эту дату через одну из них
+    (как «Все поездки по маршруту»): без повторного ввода и записи в историю.
+    Возвращает (текст, клавиатура или None, если предложить нечего).
+    """
+    parts = [
+        f"{header}\n"
+        f"📍 Маршрут: {from_location} → {to_location}\n"
+        f"📅 Дата: {format_date_for_display(date)}\n\n"
+    ]
+    keyboard = []
+
+    journeys = JOURNEYS.search(
+        from_location, to_location, date,
+        max_legs=JOURNEY_MAX_LEGS, min_gap=JOURNEY_MIN_TRANSFER, max_wait=JOURNEY_MAX_WAIT,
+        branching=JOURNEY_BRANCHING, limit=JOURNEY_RESULTS
+    )
+    if journeys:
+        text, rows = RIDES_VIEW.journeys(journeys, registered)
+        parts.append("🔀 Можно доехать с пересадками:\n\n" + text)
+        keyboard.extend(rows)
+
+    nearest = get_nearest_ride_dates(from_location, to_location, date, datetime.now().strftime('%Y-%m-%d'))
+    if nearest:
+        parts.append("📆 Есть прямые поездки в ближайшие даты:")
+        keyboard.append([
+            InlineKeyboardButton(
+                f"⬅️ {format_date_for_display(ride_date)}" if ride_date < date else f"{format_date_for_display(ride_date)} ➡️",
+                callback_data=CALLBACKS.encode('ride_route', ride_id)
+            )
+            for ride_date, ride_id in nearest
+        ])
+
+    return ''.join(parts).rstrip(), InlineKeyboardMarkup(keyboard) if keyboard else None
+
+
+async def run_search(update: Update, context: ContextTypes.DEFAULT_TYPE, from_location: str, to_location: str,
+                     date: str) -> None:
+    """Поиск поездок и первая страница результатов"""
+    chat_type = get_chat_type(update)
+
+    # Ищем поездки (первая страница)
+    rides, has_next = search_rides_page(from_location, to_location, date, limit=SEARCH_PAGE_SIZE)
+
+    # Сохраняем поиск в историю (только если пользователь зарегистрирован).
+    # Запись отложенная: ответ пассажиру не ждет коммита в БД
+    # При перегрузке история поисков не пишется: это второстепенная работа
+    user_data = get_user(update.effective_user.id)
+    if user_data and user_data[2] and LATENCY.overloaded():
+        FLOOD_CONTROL.record_shed('history')
+    elif user_data and user_data[2]:  # Проверяем наличие телефона
+        pending = queue_passenger_search(update.effective_user.id, from_location, to_location, date)
+        if pending >= SEARCH_HISTORY_BATCH_SIZE and context.job_queue:
+            context.job_queue.run_once(flush_search_history, 0)
+
+    # Очищаем данные
+    for key in ['search_ride_step', 'search_from', 'search_to', 'location_hint']:
+        if key in context.user_data:
+            del context.user_data[key]
+
+    if not rides:
+        # Сразу предлагаем пересадки и ближайшие даты вместо перебора вручную
+        text, reply_markup = empty_search_view(
+            from_location, to_location, date, bool(user_data and user_data[2]),
+            "🔍 По вашему запросу ничего не найдено."
+        )
+        if reply_markup:
+            await update.message.reply_text(text, reply_markup=reply_markup)
+        else:
+            await update.message.reply_text(
+                text + "\n\nПопробуйте изменить параметры поиска.",
+                reply_markup=get_passenger_keyboard(chat_type)
+            )
+        return
+
+    response, reply_markup = search_page_view(
+        rides, from_location, to_location, date, update.effective_user.id, has_next=has_next
     )
+    await update.message.reply_text(response, reply_markup=reply_markup)
+
+
+async def quick_search_ride(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Пассажир прислал маршрут и дату одной строкой вне сценария"""
+    parsed = parse_ride_text(update.message.text)
+    await run_search(update, context, parsed.from_location, parsed.to_location, parsed.date)
 
 
 async def handle_search_ride_step(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -1384,16 +1886,30 @@ async def handle_search_ride_step(update: Update, context: ContextTypes.DEFAULT_
     chat_type = get_chat_type(update)
 
     if step == 'from':
-        context.user_data['search_from'] = message_text
+        # Маршрут и дата одной строкой — сразу к результатам
+        parsed = parse_ride_text(message_text)
+        if parsed is not None:
+            await run_search(update, context, parsed.from_location, parsed.to_location, parsed.date)
+            return
+
+        location = await read_location(update, context)
+        if location is None:
+            return
+        context.user_data['search_from'] = location
         context.user_data['search_ride_step'] = 'to'
         await update.message.reply_text(
             "Шаг 2/3: Куда нужно доехать?\n"
             "Например: Санкт-Петербург",
-            reply_markup=get_cancel_keyboard(chat_type)
+            reply_markup=get_location_keyboard(
+                chat_type, LOCATIONS.suggest(limit=LOCATION_SUGGESTIONS, exclude=location)
+            )
         )
 
     elif step == 'to':
-        context.user_data['search_to'] = message_text
+        location = await read_location(update, context, exclude=context.user_data.get('search_from'))
+        if location is None:
+            return
+        context.user_data['search_to'] = location
         context.user_data['search_ride_step'] = 'date'
         await update.message.reply_text(
             "Шаг 3/3: На какую дату?\n"
@@ -1407,80 +1923,8 @@ async def handle_search_ride_step(update: Update, context: ContextTypes.DEFAULT_
         parsed_date, is_valid, error_message = parse_date_input(message_text)
 
         if is_valid:
-            from_location = context.user_data['search_from']
-            to_location = context.user_data['search_to']
-            date = parsed_date  # В формате YYYY-MM-ДД для поиска в БД
-
-            # Ищем поездки
-            rides = search_rides(from_location, to_location, date)
-
-            # Сохраняем поиск в историю (только если пользователь зарегистрирован)
-            user_data = get_user(update.effective_user.id)
-            if user_data and user_data[2]:  # Проверяем наличие телефона
-                try:
-                    add_passenger_search(update.effective_user.id, from_location, to_location, date)
-                except Exception as e:
-                    logger.error(f"Ошибка при сохранении поиска: {e}")
-
-            # Очищаем данные
-            for key in ['search_ride_step', 'search_from', 'search_to']:
-                if key in context.user_data:
-                    del context.user_data[key]
-
-            if not rides:
-                # Форматируем дату для отображения
-                display_date = format_date_for_display(date)
-
-                await update.message.reply_text(
-                    f"🔍 По вашему запросу ничего не найдено.\n"
-                    f"📍 Маршрут: {from_location} → {to_location}\n"
-                    f"📅 Дата: {display_date}\n\n"
-                    "Попробуйте изменить параметры поиска.",
-                    reply_markup=get_passenger_keyboard(chat_type)
-                )
-                return
-
-            # Форматируем дату для отображения
-            display_date = format_date_for_display(date)
-
-            # Формируем ответ с inline-кнопками
-            response = f"🎯 Найдено поездок: {len(rides)}\n\n"
-            response += f"📍 Маршрут: {from_location} → {to_location}\n"
-            response += f"📅 Дата: {display_date}\n\n"
-
-            keyboard = []
-
-            for ride in rides:
-                ride_id, driver_id, driver_username, from_loc, to_loc, ride_date, ride_time, seats = ride
-
-                # Форматируем дату поездки для отображения
-                ride_date_display = format_date_for_display(ride_date)
-
-                response += (
-                    f"🚗 Поездка #{ride_id}\n"
-                    f"  📍 {from_loc} → {to_loc}\n"
-                    f"  📅 {ride_date_display} в {ride_time}\n"
-                    f"  👥 Свободных мест: {seats}\n"
-                    f"  👤 Водитель: {driver_username}\n\n"
-                )
-
-                # Проверяем, зарегистрирован ли пользователь для получения контактов
-                user_data = get_user(update.effective_user.id)
-                if user_data and user_data[2]:  # Если есть телефон
-                    keyboard.append([
-                        InlineKeyboardButton(f"📞 Контакты водителя #{ride_id}", callback_data=f"contact_{ride_id}")
-                    ])
-                else:
-                    keyboard.append([
-                        InlineKeyboardButton(f"📞 Зарегистрируйтесь для контактов #{ride_id}", callback_data="register_for_contacts")
-                    ])
-
-            reply_markup = InlineKeyboardMarkup(keyboard)
-
-            await update.message.reply_text(
-                response,
-                reply_markup=reply_markup
-            )
+            # В формате YYYY-MM-DD для поиска в БД
+            await run_search(update, context, context.user_data['search_from'], context.user_data['search_to'], parsed_date)
         else:
             await update.message.reply_text(
                 f"{error_message}\n"
@@ -1538,6 +1982,7 @@ async def my_rides(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
             f"🕒 Время: {time}\n"
             f"👥 Свободных мест: {seats}\n"
             f"🆔 ID поездки: {ride_id}\n"
+            f"🔗 Ссылка для попутчиков: {deep_link(context, DEEP_LINKS.ride_payload(ride_id))}\n"
             "────────────────────\n"
         )
 
@@ -1550,11 +1995,11 @@ async def my_rides(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         keyboard.append([
             InlineKeyboardButton(
                 f"❌ Завершить #{ride_id}: {from_loc}→{to_loc}",
-                callback_data=f"end_ride_{ride_id}"
+                callback_data=CALLBACKS.encode('end_ride', ride_id)
             )
         ])
 
-    keyboard.append([InlineKeyboardButton("🔙 Назад", callback_data="back_to_driver")])
+    keyboard.append([InlineKeyboardButton("🔙 Назад", callback_data=CALLBACKS.encode('back_to_driver'))])
 
     await update.message.reply_text(
         response,
@@ -1585,24 +2030,30 @@ async def my_searches(update: Update, context: ContextTypes.DEFAULT_TYPE) -> Non
     response = "🔍 История ваших поисков:\n\n"
 
     for search in searches:
-        # search: (id, passenger_id, from_location, to_location, search_date, created_at)
+        # search: (id, passenger_id, from_location, to_location, search_date, last_searched_at, hit_count)
         search_id = search[0]
         from_loc = search[2]
         to_loc = search[3]
         date = search[4]  # В формате YYYY-MM-DD из БД
-        created_at = search[5]
+        last_searched_at = search[5] or ""
+        hit_count = search[6] or 1
 
         # Форматируем дату поиска для отображения
         date_display = format_date_for_display(date)
 
-        # Форматируем дату создания
-        created_time = created_at.split(' ')[1][:5] if ' ' in created_at else created_at[:5]
+        # Форматируем время последнего поиска
+        searched_time = last_searched_at.split(' ')[1][:5] if ' ' in last_searched_at else last_searched_at[:5]
 
         response += (
             f"📍 Маршрут: {from_loc} → {to_loc}\n"
             f"📅 Дата поездки: {date_display}\n"
-            f"🕒 Время поиска: {created_time}\n"
+            f"🕒 Время поиска: {searched_time}\n"
+        )
+        if hit_count > 1:
+            response += f"🔁 Искали раз: {hit_count}\n"
+        response += (
             f"🆔 ID поиска: {search_id}\n"
+            f"🔗 Поделиться: {deep_link(context, DEEP_LINKS.search_payload(search_id))}\n"
             "────────────────────\n"
         )
 
@@ -1616,11 +2067,11 @@ async def my_searches(update: Update, context: ContextTypes.DEFAULT_TYPE) -> Non
         keyboard.append([
             InlineKeyboardButton(
                 f"🔍 Повторить: {from_loc}→{to_loc} ({date_display})",
-                callback_data=f"repeat_search_{search[0]}"
+                callback_data=CALLBACKS.encode('repeat_search', search[0])
             )
         ])
 
-    keyboard.append([InlineKeyboardButton("🔙 Назад", callback_data="back_to_passenger")])
+    keyboard.append([InlineKeyboardButton("🔙 Назад", callback_data=CALLBACKS.encode('back_to_passenger'))])
 
     await update.message.reply_text(
         response,
@@ -1637,8 +2088,8 @@ async def relevant_rides(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     user_id = update.effective_user.id
     chat_type = get_chat_type(update)
 
-    # Получаем актуальные поездки
-    relevant_rides = get_relevant_rides_for_passenger(user_id)
+    # Получаем первую страницу актуальных поездок
+    relevant_rides, has_next = get_relevant_rides_page(user_id, limit=SEARCH_PAGE_SIZE)
 
     if not relevant_rides:
         await update.message.reply_text(
@@ -1650,97 +2101,8 @@ async def relevant_rides(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         )
         return
 
-    response = "🚗 Актуальные поездки по вашим поискам:\n\n"
-
-    # Счетчик для нумерации
-    count = 1
-
-    # Словарь для группировки поездок по маршруту
-    rides_by_route = {}
-
-    for item in relevant_rides:
-        search_from, search_to, search_date = item['search']
-        ride = item['ride']
-
-        ride_id = ride[0]
-        driver_username = ride[2]
-        from_loc = ride[3]
-        to_loc = ride[4]
-        date = ride[5]  # YYYY-MM-DD
-        time = ride[6]
-        seats = ride[7]
-
-        # Форматируем даты
-        search_date_display = format_date_for_display(search_date)
-        ride_date_display = format_date_for_display(date)
-
-        route_key = f"{search_from}→{search_to}"
-        if route_key not in rides_by_route:
-            rides_by_route[route_key] = []
-
-        rides_by_route[route_key].append({
-            'ride_id': ride_id,
-            'driver_username': driver_username,
-            'from_loc': from_loc,
-            'to_loc': to_loc,
-            'date': ride_date_display,
-            'time': time,
-            'seats': seats,
-            'search_date': search_date_display
-        })
-
-    # Формируем ответ с группировкой по маршрутам
-    for route, rides in rides_by_route.items():
-        search_from, search_to = route.split('→')
-
-        # Используем дату из первого поиска для этого маршрута
-        first_search_date = rides[0]['search_date']
-
-        response += f"📍 Маршрут: {search_from} → {search_to}\n"
-        response += f"📅 Искали на дату: {first_search_date}\n\n"
-
-        for ride_info in rides:
-            response += (
-                f"  🚗 Поездка #{ride_info['ride_id']}\n"
-                f"    📅 {ride_info['date']} в {ride_info['time']}\n"
-                f"    👥 Свободных мест: {ride_info['seats']}\n"
-                f"    👤 Водитель: {ride_info['driver_username']}\n"
-                "    ──────────────────\n"
-            )
-
-        response += "\n"
-
-    # Добавляем inline-кнопки для каждой поездки
-    keyboard = []
-    for item in relevant_rides:
-        ride = item['ride']
-        ride_id = ride[0]
-        from_loc = ride[3]
-        to_loc = ride[4]
-        date_display = format_date_for_display(ride[5])
-
-        # Проверяем, зарегистрирован ли пользователь для получения контактов
-        user_data = get_user(user_id)
-        if user_data and user_data[2]:  # Если есть телефон
-            # Ограничиваем текст кнопки
-            button_text = f"📞 Контакты #{ride_id}: {from_loc[:5]}→{to_loc[:5]}"
-            if len(button_text) > 40:
-                button_text = f"📞 #{ride_id}: {from_loc[:3]}→{to_loc[:3]}"
-
-            keyboard.append([InlineKeyboardButton(button_text, callback_data=f"contact_{ride_id}")])
-        else:
-            keyboard.append([InlineKeyboardButton(f"📞 Зарегистрируйтесь для контактов #{ride_id}", callback_data="register_for_contacts")])
-
-    # Добавляем кнопки управления
-    keyboard.append([
-        InlineKeyboardButton("🔄 Обновить", callback_data="refresh_relevant_rides"),
-        InlineKeyboardButton("🔙 Назад", callback_data="back_to_passenger")
-    ])
-
-    await update.message.reply_text(
-        response,
-        reply_markup=InlineKeyboardMarkup(keyboard)
-    )
+    response, reply_markup = relevant_page_view(relevant_rides, user_id, has_next=has_next)
+    await update.message.reply_text(response, reply_markup=reply_markup)
 
 
 async def terms_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -1798,6 +2160,13 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
 📅 Формат даты:
 Используйте формат: ДД.ММ.ГГГГ (например: 31.12.2024)
 
+⚡ Одной строкой:
+• Водитель: Москва - Казань 31.12 14:30 3 (маршрут, дата, время, места)
+• Пассажир: Москва Казань завтра
+
+🔎 В любом чате:
+@{context.bot.username} Москва Казань 31.12 (дату можно не указывать)
+
 📢 Обязательный канал: {REQUIRED_CHANNEL[1:]}
 Для использования бота необходимо быть подписанным на канал!
 
@@ -1832,8 +2201,8 @@ async def cancel_command(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
 
     # Очищаем данные пользователя
     for key in ['create_ride_step', 'search_ride_step', 'registration_step',
-                'from_location', 'to_location', 'date', 'time',
-                'search_from', 'search_to', 'register_after_search',
+                'from_location', 'to_location', 'date', 'time', 'seats',
+                'search_from', 'search_to', 'location_hint', 'register_after_search',
                 'broadcast_step', 'broadcast_message']:
         if key in context.user_data:
             del context.user_data[key]
@@ -1892,318 +2261,331 @@ async def back_to_main(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
         )
 
 
-async def handle_contact_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    """Обработчик callback для получения контактов."""
+async def show_driver_contact(update: Update, context: ContextTypes.DEFAULT_TYPE, ride_id: int) -> None:
+    """Контакты водителя по кнопке под поездкой."""
     query = update.callback_query
-    await query.answer()
 
-    if query.data.startswith("contact_"):
-        try:
-            ride_id = int(query.data.split("_")[1])
-            contact_info = get_driver_contact(ride_id)
+    try:
+        contact_info = get_driver_contact(ride_id)
 
-            if not contact_info:
-                await query.edit_message_text(f"❌ Поездка #{ride_id} не найдена.")
-                return
+        if not contact_info:
+            await query.edit_message_text(f"❌ Поездка #{ride_id} не найдена.")
+            return
 
-            username, phone = contact_info
-
-            # Определяем тип чата для правильного возврата
-            chat_type = query.message.chat.type
-            if chat_type == "private":
-                # Определяем роль пользователя для возврата в нужное меню
-                role = context.user_data.get('role')
-                if role == 'passenger':
-                    # Отправляем сообщение с контактами и кнопкой возврата
-                    await query.message.reply_text(
-                        f"📞 Контакты водителя для поездки #{ride_id}:\n\n"
-                        f"👤 Username: @{username if username else 'не указан'}\n"
-                        f"📱 Телефон: {phone}\n\n"
-                        "Пожалуйста, будьте вежливы и осторожны при общении."
-                    )
-                    # Отправляем отдельное сообщение с кнопкой возврата
-                    keyboard = InlineKeyboardMarkup([
-                        [InlineKeyboardButton("🔙 Вернуться к поиску", callback_data="back_to_passenger_search")]
-                    ])
-                    await query.message.reply_text(
-                        "Чтобы вернуться к результатам поиска, нажмите кнопку ниже:",
-                        reply_markup=keyboard
-                    )
-                elif role == 'driver':
-                    await query.message.reply_text(
-                        f"📞 Контакты водителя для поездка #{ride_id}:\n\n"
-                        f"👤 Username: @{username if username else 'не указан'}\n"
-                        f"📱 Телефон: {phone}\n\n"
-                        "Пожалуйста, будьте вежливы и осторожны при общении.",
-                        reply_markup=get_driver_keyboard(chat_type)
-                    )
-                else:
-                    await query.message.reply_text(
-                        f"📞 Контакты водителя для поездки #{ride_id}:\n\n"
-                        f"👤 Username: @{username if username else 'не указан'}\n"
-                        f"📱 Телефон: {phone}",
-                        reply_markup=get_role_selection_keyboard(chat_type)
-                    )
+        username, phone = contact_info
+
+        # Определяем тип чата для правильного возврата
+        chat_type = query.message.chat.type
+        if chat_type == "private":
+            # Определяем роль пользователя для возврата в нужное меню
+            role = context.user_data.get('role')
+            if role == 'passenger':
+                # Контакты и кнопка возврата — одним сообщением
+                keyboard = InlineKeyboardMarkup([
+                    [InlineKeyboardButton("🔙 Вернуться к поиску", callback_data=CALLBACKS.encode('back_to_passenger_search'))]
+                ])
+                await query.message.reply_text(
+                    f"📞 Контакты водителя для поездки #{ride_id}:\n\n"
+                    f"👤 Username: @{username if username else 'не указан'}\n"
+                    f"📱 Телефон: {phone}\n\n"
+                    "Пожалуйста, будьте вежливы и осторожны при общении.",
+                    reply_markup=keyboard
+                )
+            elif role == 'driver':
+                await query.message.reply_text(
+                    f"📞 Контакты водителя для поездка #{ride_id}:\n\n"
+                    f"👤 Username: @{username if username else 'не указан'}\n"
+                    f"📱 Телефон: {phone}\n\n"
+                    "Пожалуйста, будьте вежливы и осторожны при общении.",
+                    reply_markup=get_driver_keyboard(chat_type)
+                )
             else:
-                # В групповом чате просто показываем контакты
                 await query.message.reply_text(
                     f"📞 Контакты водителя для поездки #{ride_id}:\n\n"
                     f"👤 Username: @{username if username else 'не указан'}\n"
-                    f"📱 Телефон: {phone}"
+                    f"📱 Телефон: {phone}",
+                    reply_markup=get_role_selection_keyboard(chat_type)
                 )
-
-        except (ValueError, IndexError):
-            await query.answer("❌ Ошибка при получении контактов", show_alert=True)
-
-    elif query.data == "register_for_contacts":
-        chat_type = query.message.chat.type
-        if chat_type == "private":
+        else:
+            # В групповом чате просто показываем контакты
             await query.message.reply_text(
-                "📝 Для получения контактов водителей необходимо зарегистрироваться.\n\n"
-                "Пожалуйста, зарегистрируйтесь, чтобы получить доступ к контактам водителей:",
-                reply_markup=get_registration_keyboard(chat_type)
+                f"📞 Контакты водителя для поездки #{ride_id}:\n\n"
+                f"👤 Username: @{username if username else 'не указан'}\n"
+                f"📱 Телефон: {phone}"
             )
-        else:
-            await query.answer("Эта функция доступна только в личных сообщениях", show_alert=True)
 
+    except (ValueError, IndexError):
+        await answer_callback(query, "❌ Ошибка при получении контактов", show_alert=True)
 
-async def handle_callback_actions(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    """Обработка дополнительных callback-действий."""
+
+async def prompt_contact_registration(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Предложение зарегистрироваться для получения контактов."""
     query = update.callback_query
-    await query.answer()
 
-    data = query.data
     chat_type = query.message.chat.type
+    if chat_type == "private":
+        await query.message.reply_text(
+            "📝 Для получения контактов водителей необходимо зарегистрироваться.\n\n"
+            "Пожалуйста, зарегистрируйтесь, чтобы получить доступ к контактам водителей:",
+            reply_markup=get_registration_keyboard(chat_type)
+        )
+    else:
+        await answer_callback(query, "Эта функция доступна только в личных сообщениях", show_alert=True)
 
-    if data.startswith("end_ride_"):
-        try:
-            ride_id = int(data.split("_")[2])
-            update_ride_status(ride_id, False)
 
-            await query.edit_message_text(
-                f"✅ Поездка #{ride_id} успешно завершена!\n"
-                "Она больше не будет отображаться в поиске."
-            )
+async def end_ride(update: Update, context: ContextTypes.DEFAULT_TYPE, ride_id: int) -> None:
+    """Завершение поездки водителем."""
+    query = update.callback_query
 
-            # Возвращаем в меню водителя только если это личный чат
-            if chat_type == "private":
-                await context.bot.send_message(
-                    chat_id=query.message.chat_id,
-                    text="Выберите действие:",
-                    reply_markup=get_driver_keyboard(chat_type)
-                )
+    try:
+        # Завершить поездку может только ее водитель
+        ride = get_ride_by_id(ride_id)
+        if not ride or ride[1] != query.from_user.id:
+            logger.warning(f"Пользователь {query.from_user.id} пытался завершить чужую поездку {ride_id}")
+            await answer_callback(query, "❌ Поездка не найдена", show_alert=True)
+            return
 
-        except Exception as e:
-            logger.error(f"Ошибка при завершении поездки: {e}")
-            await query.answer("❌ Ошибка при завершении поездки", show_alert=True)
+        update_ride_status(ride_id, False)
+        RIDES_VIEW.invalidate(ride_id)
+        LINK_LOOKUPS.pop(('ride', ride_id))
 
-    elif data.startswith("repeat_search_"):
-        try:
-            search_id = int(data.split("_")[2])
-            # Получаем детали поиска из БД
-            conn = get_db()
-            cursor = conn.cursor()
-            cursor.execute('''
-                SELECT from_location, to_location, search_date
-                FROM passenger_searches
-                WHERE id = ? AND passenger_id = ?
-            ''', (search_id, query.from_user.id))
-            search_details = cursor.fetchone()
-            conn.close()
-
-            if search_details:
-                from_location, to_location, date = search_details
-
-                # Форматируем дату для отображения
-                display_date = format_date_for_display(date)
-
-                # Ищем поездки снова
-                rides = search_rides(from_location, to_location, date)
-
-                if not rides:
-                    await query.edit_message_text(
-                        f"🔍 По вашему запросу ничего не найдено.\n"
-                        f"📍 Маршрут: {from_location} → {to_location}\n"
-                        f"📅 Дата: {display_date}"
-                    )
-                    return
+        # Меню водителя уже на экране (список открыт кнопкой «📋 Мои поездки»),
+        # поэтому отдельное сообщение с клавиатурой не отправляем
+        await query.edit_message_text(
+            f"✅ Поездка #{ride_id} успешно завершена!\n"
+            "Она больше не будет отображаться в поиске."
+        )
 
-                # Формируем ответ
-                response = f"🎯 Найдено поездок: {len(rides)}\n\n"
-                response += f"📍 Маршрут: {from_location} → {to_location}\n"
-                response += f"📅 Дата: {display_date}\n\n"
-
-                keyboard = []
-                for ride in rides:
-                    ride_id, driver_id, driver_username, from_loc, to_loc, ride_date, ride_time, seats = ride
-
-                    # Форматируем дату поездки для отображения
-                    ride_date_display = format_date_for_display(ride_date)
-
-                    response += (
-                        f"🚗 Поездка #{ride_id}\n"
-                        f"  📍 {from_loc} → {to_loc}\n"
-                        f"  📅 {ride_date_display} в {ride_time}\n"
-                        f"  👥 Свободных мест: {seats}\n"
-                        f"  👤 Водитель: {driver_username}\n\n"
-                    )
-
-                    # Проверяем, зарегистрирован ли пользователь для получения контактов
-                    user_data = get_user(query.from_user.id)
-                    if user_data and user_data[2]:  # Если есть телефон
-                        keyboard.append([
-                            InlineKeyboardButton(f"📞 Контакты водителя #{ride_id}", callback_data=f"contact_{ride_id}")
-                        ])
-                    else:
-                        keyboard.append([
-                            InlineKeyboardButton(f"📞 Зарегистрируйтесь для контактов #{ride_id}", callback_data="register_for_contacts")
-                        ])
-
-                reply_markup = InlineKeyboardMarkup(keyboard)
-                await query.edit_message_text(response, reply_markup=reply_markup)
+    except Exception as e:
+        logger.error(f"Ошибка при завершении поездки: {e}")
+        await answer_callback(query, "❌ Ошибка при завершении поездки", show_alert=True)
 
-        except Exception as e:
-            logger.error(f"Ошибка при повторном поиске: {e}")
-            await query.answer("❌ Ошибка при выполнении поиска", show_alert=True)
 
-    elif data == "refresh_relevant_rides":
-        # Получаем обновленные данные
-        relevant_rides_list = get_relevant_rides_for_passenger(query.from_user.id)
+async def repeat_search(update: Update, context: ContextTypes.DEFAULT_TYPE, search_id: int) -> None:
+    """Повтор сохраненного поиска."""
+    query = update.callback_query
 
-        if not relevant_rides_list:
-            await query.edit_message_text(
-                "🚗 Актуальные поездки\n\n"
-                "Пока нет поездок по вашим поискам.\n"
-                "Сначала найдите поездки с помощью кнопки '🔍 Найти поездку'!"
-            )
-            return
+    try:
+        # Получаем детали поиска из БД
+        conn = get_db()
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT from_location, to_location, search_date
+            FROM passenger_searches
+            WHERE id = ? AND passenger_id = ?
+        ''', (search_id, query.from_user.id))
+        search_details = cursor.fetchone()
+        conn.close()
 
-        # Формируем ответ
-        response = "🚗 Актуальные поездки по вашим поискам:\n\n"
+        if search_details:
+            from_location, to_location, date = search_details
 
-        rides_by_route = {}
-        for item in relevant_rides_list:
-            search_from, search_to, search_date = item['search']
-            ride = item['ride']
+            # Ищем поездки снова (первая страница)
+            rides, has_next = search_rides_page(from_location, to_location, date, limit=SEARCH_PAGE_SIZE)
 
-            ride_id = ride[0]
-            driver_username = ride[2]
-            from_loc = ride[3]
-            to_loc = ride[4]
-            date = ride[5]
-            time = ride[6]
-            seats = ride[7]
-
-            search_date_display = format_date_for_display(search_date)
-            ride_date_display = format_date_for_display(date)
-
-            route_key = f"{search_from}→{search_to}"
-            if route_key not in rides_by_route:
-                rides_by_route[route_key] = []
-
-            rides_by_route[route_key].append({
-                'ride_id': ride_id,
-                'driver_username': driver_username,
-                'from_loc': from_loc,
-                'to_loc': to_loc,
-                'date': ride_date_display,
-                'time': time,
-                'seats': seats,
-                'search_date': search_date_display
-            })
-
-        for route, rides in rides_by_route.items():
-            search_from, search_to = route.split('→')
-            first_search_date = rides[0]['search_date']
-
-            response += f"📍 Маршрут: {search_from} → {search_to}\n"
-            response += f"📅 Искали на дату: {first_search_date}\n\n"
-
-            for ride_info in rides:
-                response += (
-                    f"  🚗 Поездка #{ride_info['ride_id']}\n"
-                    f"    📅 {ride_info['date']} в {ride_info['time']}\n"
-                    f"    👥 Свободных мест: {ride_info['seats']}\n"
-                    f"    👤 Водитель: {ride_info['driver_username']}\n"
-                    "    ──────────────────\n"
+            if not rides:
+                user_data = get_user(query.from_user.id)
+                text, reply_markup = empty_search_view(
+                    from_location, to_location, date, bool(user_data and user_data[2]),
+                    "🔍 По вашему запросу ничего не найдено."
                 )
-            response += "\n"
+                await query.edit_message_text(text, reply_markup=reply_markup)
+                return
 
-        # Создаем клавиатуру
-        keyboard = []
-        for item in relevant_rides_list[:5]:  # Ограничиваем 5 кнопками
-            ride = item['ride']
-            ride_id = ride[0]
-            from_loc = ride[3]
-            to_loc = ride[4]
-
-            # Проверяем, зарегистрирован ли пользователь для получения контактов
-            user_data = get_user(query.from_user.id)
-            if user_data and user_data[2]:  # Если есть телефон
-                button_text = f"📞 #{ride_id}: {from_loc[:5]}→{to_loc[:5]}"
-                keyboard.append([InlineKeyboardButton(button_text, callback_data=f"contact_{ride_id}")])
-            else:
-                keyboard.append([InlineKeyboardButton(f"📞 Зарегистрируйтесь для контактов #{ride_id}", callback_data="register_for_contacts")])
+            response, reply_markup = search_page_view(
+                rides, from_location, to_location, date, query.from_user.id, has_next=has_next
+            )
+            await query.edit_message_text(response, reply_markup=reply_markup)
 
-        keyboard.append([
-            InlineKeyboardButton("🔄 Обновить", callback_data="refresh_relevant_rides"),
-        ])
+    except Exception as e:
+        logger.error(f"Ошибка при повторном поиске: {e}")
+        await answer_callback(query, "❌ Ошибка при выполнении поиска", show_alert=True)
 
-        if chat_type == "private":
-            keyboard.append([InlineKeyboardButton("🔙 Назад", callback_data="back_to_passenger_search")])
 
+async def refresh_relevant_rides(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Обновление списка актуальных поездок (с первой страницы)."""
+    query = update.callback_query
+
+    # Получаем обновленные данные
+    relevant_rides_list, has_next = get_relevant_rides_page(query.from_user.id, limit=SEARCH_PAGE_SIZE)
+
+    if not relevant_rides_list:
         await query.edit_message_text(
-            response,
-            reply_markup=InlineKeyboardMarkup(keyboard)
+            "🚗 Актуальные поездки\n\n"
+            "Пока нет поездок по вашим поискам.\n"
+            "Сначала найдите поездки с помощью кнопки '🔍 Найти поездку'!"
         )
+        return
 
-    elif data == "back_to_driver":
-        if chat_type == "private":
-            # Удаляем старое сообщение с inline-кнопками
-            try:
-                await query.delete_message()
-            except:
-                pass
-            # Отправляем новое сообщение с меню водителя
-            await context.bot.send_message(
-                chat_id=query.message.chat_id,
-                text="Главное меню водителя:",
-                reply_markup=get_driver_keyboard(chat_type)
-            )
-        else:
-            await query.answer("Эта функция доступна только в личных сообщениях", show_alert=True)
+    response, reply_markup = relevant_page_view(relevant_rides_list, query.from_user.id, has_next=has_next)
+    await query.edit_message_text(response, reply_markup=reply_markup)
 
-    elif data == "back_to_passenger":
-        if chat_type == "private":
-            # Удаляем старое сообщение с inline-кнопками
-            try:
-                await query.delete_message()
-            except:
-                pass
-            # Отправляем новое сообщение с меню пассажира
-            await context.bot.send_message(
-                chat_id=query.message.chat_id,
-                text="Главное меню пассажира:",
-                reply_markup=get_passenger_keyboard(chat_type)
-            )
-        else:
-            await query.answer("Эта функция доступна только в личных сообщениях", show_alert=True)
 
-    elif data == "back_to_passenger_search":
-        if chat_type == "private":
-            # Удаляем старое сообщение
-            try:
-                await query.delete_message()
-            except:
-                pass
-            # Отправляем сообщение с меню пассажира
-            await context.bot.send_message(
-                chat_id=query.message.chat_id,
-                text="Выберите действие:",
-                reply_markup=get_passenger_keyboard(chat_type)
-            )
-        else:
-            await query.answer("Эта функция доступна только в личных сообщениях", show_alert=True)
+def page_navigation(prev_action: str, next_action: str, rides, page: int, has_prev: bool, has_next: bool) -> list:
+    """Кнопки листания: курсор — id крайней поездки текущей страницы"""
+    row = []
+    if has_prev:
+        row.append(InlineKeyboardButton("⬅️ Назад", callback_data=CALLBACKS.encode(prev_action, page - 1, rides[0][0])))
+    if has_next:
+        row.append(InlineKeyboardButton("Далее ➡️", callback_data=CALLBACKS.encode(next_action, page + 1, rides[-1][0])))
+    return [row] if row else []
+
+
+def search_page_view(rides, from_location, to_location, date, user_id, page=1, has_prev=False, has_next=False,
+                     user_data=None):
+    """Текст и клавиатура одной страницы результатов поиска"""
+    if user_data is None:
+        user_data = get_user(user_id)
+    response, keyboard = RIDES_VIEW.search_results(
+        rides, from_location, to_location, date,
+        registered=bool(user_data and user_data[2]),
+        page=page if has_prev or has_next else None
+    )
+    keyboard.extend(page_navigation('search_page_prev', 'search_page_next', rides, page, has_prev, has_next))
+    return response, InlineKeyboardMarkup(keyboard)
+
+
+def ride_card_view(ride, registered: bool):
+    """Одна поездка по ссылке: карточка, контакты и похожие поездки"""
+    keyboard = [
+        [RIDES_VIEW.contact_button(ride, registered)],
+        [InlineKeyboardButton("🔍 Все поездки по маршруту", callback_data=CALLBACKS.encode('ride_route', ride[0]))]
+    ]
+    return "🔗 Поездка по ссылке:\n\n" + RIDES_VIEW.card(SEARCH_CARD, ride), InlineKeyboardMarkup(keyboard)
+
+
+def relevant_page_view(items, user_id, page=1, has_prev=False, has_next=False):
+    """Текст и клавиатура одной страницы актуальных поездок"""
+    user_data = get_user(user_id)
+    response, keyboard = RIDES_VIEW.relevant_rides(
+        items, registered=bool(user_data and user_data[2]),
+        page=page if has_prev or has_next else None
+    )
+    keyboard.extend(page_navigation(
+        'relevant_page_prev', 'relevant_page_next', [item['ride'] for item in items], page, has_prev, has_next
+    ))
+    # Добавляем кнопки управления
+    keyboard.append([
+        InlineKeyboardButton("🔄 Обновить", callback_data=CALLBACKS.encode('refresh_relevant_rides')),
+        InlineKeyboardButton("🔙 Назад", callback_data=CALLBACKS.encode('back_to_passenger'))
+    ])
+    return response, InlineKeyboardMarkup(keyboard)
+
+
+async def show_search_page(update: Update, context: ContextTypes.DEFAULT_TYPE, page: int, anchor_id: int,
+                           backward: bool = False) -> None:
+    """Соседняя страница результатов поиска.
+
+    Маршрут и дата берутся из поездки-курсора, поэтому кнопке не нужно
+    хранить параметры поиска.
+    """
+    query = update.callback_query
+
+    anchor = get_ride_by_id(anchor_id)
+    if not anchor:
+        await answer_callback(query, "❌ Список устарел, повторите поиск", show_alert=True)
+        return
+
+    from_location, to_location, date, time_value = anchor[3], anchor[4], anchor[5], anchor[6]
+    rides, has_more = search_rides_page(
+        from_location, to_location, date,
+        cursor=(time_value, anchor_id), backward=backward, limit=SEARCH_PAGE_SIZE
+    )
+    if not rides:
+        await answer_callback(query, "Больше поездок нет")
+        return
+
+    has_prev, has_next = (has_more, True) if backward else (True, has_more)
+    response, reply_markup = search_page_view(
+        rides, from_location, to_location, date, query.from_user.id, max(page, 1), has_prev, has_next
+    )
+    await query.edit_message_text(response, reply_markup=reply_markup)
+
+
+async def show_ride_route(update: Update, context: ContextTypes.DEFAULT_TYPE, ride_id: int) -> None:
+    """Все поездки того же маршрута и даты, что и поездка по ссылке или кнопке ближайшей даты"""
+    query = update.callback_query
+
+    ride = LINK_LOOKUPS.get(('ride', ride_id), lambda: get_ride_card(ride_id))
+    if ride is None:
+        await answer_callback(query, "❌ Поездка не найдена", show_alert=True)
+        return
+
+    search = (ride[3], ride[4], ride[5])
+    rides, has_next = LINK_LOOKUPS.get(
+        ('page',) + search,
+        lambda: search_rides_page(*search, limit=SEARCH_PAGE_SIZE)
+    )
+    if not rides:
+        await answer_callback(query, "Активных поездок по маршруту нет", show_alert=True)
+        return
+
+    response, reply_markup = search_page_view(rides, *search, query.from_user.id, has_next=has_next)
+    await query.edit_message_text(response, reply_markup=reply_markup)
+
+
+async def show_relevant_page(update: Update, context: ContextTypes.DEFAULT_TYPE, page: int, anchor_id: int,
+                             backward: bool = False) -> None:
+    """Соседняя страница актуальных поездок"""
+    query = update.callback_query
+
+    anchor = get_ride_by_id(anchor_id)
+    if not anchor:
+        await answer_callback(query, "❌ Список устарел, нажмите «🔄 Обновить»", show_alert=True)
+        return
+
+    items, has_more = get_relevant_rides_page(
+        query.from_user.id, cursor=(anchor[5], anchor[6], anchor_id), backward=backward, limit=SEARCH_PAGE_SIZE
+    )
+    if not items:
+        await answer_callback(query, "Больше поездок нет")
+        return
+
+    has_prev, has_next = (has_more, True) if backward else (True, has_more)
+    response, reply_markup = relevant_page_view(items, query.from_user.id, max(page, 1), has_prev, has_next)
+    await query.edit_message_text(response, reply_markup=reply_markup)
+
+
+async def back_to_driver_menu(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Возврат в меню водителя."""
+    query = update.callback_query
+
+    chat_type = query.message.chat.type
+
+    if chat_type == "private":
+        # Кнопка стоит под списком, открытым из меню водителя: эта клавиатура
+        # уже на экране, поэтому достаточно убрать inline-кнопки одним редактированием
+        await query.edit_message_text("Главное меню водителя:")
+    else:
+        await answer_callback(query, "Эта функция доступна только в личных сообщениях", show_alert=True)
+
+
+async def back_to_passenger_menu(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Возврат в меню пассажира."""
+    query = update.callback_query
+
+    chat_type = query.message.chat.type
+
+    if chat_type == "private":
+        # Кнопка стоит под списком, открытым из меню пассажира: эта клавиатура
+        # уже на экране, поэтому достаточно убрать inline-кнопки одним редактированием
+        await query.edit_message_text("Главное меню пассажира:")
+    else:
+        await answer_callback(query, "Эта функция доступна только в личных сообщениях", show_alert=True)
+
+
+async def back_to_passenger_search(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Возврат к меню пассажира из результатов поиска."""
+    query = update.callback_query
+
+    chat_type = query.message.chat.type
+
+    if chat_type == "private":
+        # Результаты поиска открыты из меню пассажира: его клавиатура уже
+        # на экране, достаточно убрать inline-кнопки одним редактированием
+        await query.edit_message_text("Выберите действие:")
+    else:
+        await answer_callback(query, "Эта функция доступна только в личных сообщениях", show_alert=True)
 
 
 async def register_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -2240,21 +2622,308 @@ async def role_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
     )
 
 
+def format_cleanup_report(stats) -> str:
+    """Текст с метриками очистки для админ-панели"""
+    if not stats:
+        return "Нет данных об очистке."
+    return (
+        f"• Просроченных поездок отмечено: {stats['expired']}\n"
+        f"• Старых поездок перенесено в архив: {stats['archived']}\n"
+        f"• Устаревших поисков перенесено в архив: {stats['searches_archived']}\n"
+        f"• Поисков сверх лимита удалено: {stats['searches_over_cap']}\n"
+        f"• Пакетов обработано: {stats['batches']}\n"
+        f"• Длительность: {stats['duration']:.1f} с\n"
+        f"• Начало: {stats['started_at']}"
+    )
+
+
+async def run_cleanup(context: ContextTypes.DEFAULT_TYPE, on_progress=None) -> dict:
+    """Пакетная очистка базы данных.
+
+    Общий путь для планировщика и админ-панели: каждый этап выполняется
+    пакетами по CLEANUP_BATCH_SIZE строк, между пакетами управление
+    возвращается циклу событий, чтобы не задерживать поиск и создание поездок.
+    """
+    stats = {
+        'expired': 0,
+        'archived': 0,
+        'searches_archived': 0,
+        'searches_over_cap': 0,
+        'batches': 0,
+        'duration': 0.0,
+        'started_at': datetime.now().strftime('%d.%m.%Y %H:%M:%S'),
+    }
+    context.bot_data['cleanup_running'] = True
+    context.bot_data['cleanup_progress'] = stats
+    started = time.monotonic()
+
+    # Дописываем буфер, чтобы лимиты истории считались по актуальным данным
+    flush_passenger_searches()
+
+    stages = [
+        ('expired', iter_expire_rides_batches(CLEANUP_BATCH_SIZE)),
+        ('archived', iter_archive_rides_batches(CLEANUP_BATCH_SIZE, ARCHIVE_RIDES_AFTER_DAYS)),
+        ('searches_archived', iter_archive_searches_batches(SEARCH_HISTORY_RETENTION_DAYS, CLEANUP_BATCH_SIZE)),
+        ('searches_over_cap', iter_prune_searches_over_cap_batches(SEARCH_HISTORY_MAX_PER_USER, CLEANUP_BATCH_SIZE)),
+    ]
+    try:
+        for key, batches in stages:
+            for count in batches:
+                stats[key] += count
+                stats['batches'] += 1
+                stats['duration'] = time.monotonic() - started
+                if on_progress:
+                    await on_progress(stats)
+                await asyncio.sleep(CLEANUP_BATCH_PAUSE)
+    finally:
+        stats['duration'] = time.monotonic() - started
+        context.bot_data['cleanup_running'] = False
+        context.bot_data['last_cleanup'] = stats
+
+    return stats
+
+
 async def scheduled_cleanup(context: ContextTypes.DEFAULT_TYPE):
     """Регулярная очистка базы данных от просроченных поездок"""
     try:
-        # Очищаем просроченные поездки
-        expired_count = cleanup_expired_rides()
+        if context.bot_data.get('cleanup_running'):
+            logger.info("Планировщик: очистка уже выполняется, пропускаем запуск")
+            return
 
-        # Удаляем старые неактивные поездки
-        deleted_count = delete_old_inactive_rides()
+        stats = await run_cleanup(context)
 
-        if expired_count > 0 or deleted_count > 0:
-            logger.info(f"Планировщик: удалено {expired_count} просроченных и {deleted_count} старых поездок")
+        if stats['expired'] > 0 or stats['archived'] > 0:
+            logger.info(f"Планировщик: {stats['expired']} просроченных поездок, "
+                        f"{stats['archived']} перенесено в архив")
+        if stats['searches_archived'] > 0 or stats['searches_over_cap'] > 0:
+            logger.info(f"Планировщик: {stats['searches_archived']} поисков перенесено в архив, "
+                        f"{stats['searches_over_cap']} лишних удалено")
     except Exception as e:
         logger.error(f"Ошибка при плановой очистке БД: {e}")
 
 
+def format_maintenance_report(db_stats, last_run) -> str:
+    """Текст с параметрами файла БД для админ-панели"""
+    if not db_stats:
+        return "❌ Не удалось получить параметры базы данных."
+
+    auto_vacuum_modes = {0: "выключен", 1: "FULL", 2: "INCREMENTAL"}
+    text = (
+        "🛠 ОБСЛУЖИВАНИЕ БД\n\n"
+        f"• Размер файла: {db_stats['file_size'] / 1024:.1f} КБ\n"
+        f"• Размер WAL: {db_stats['wal_size'] / 1024:.1f} КБ\n"
+        f"• Размер страницы: {db_stats['page_size']} байт\n"
+        f"• Всего страниц: {db_stats['page_count']}\n"
+        f"• Свободных страниц: {db_stats['freelist_count']}\n"
+        f"• auto_vacuum: {auto_vacuum_modes.get(db_stats['auto_vacuum'], db_stats['auto_vacuum'])}\n"
+    )
+    if last_run:
+        text += (
+            f"\nПоследнее обслуживание: {last_run['finished_at']}\n"
+            f"• Освобождено страниц: {last_run['pages_freed']}\n"
+            f"• Статистика планировщика: {last_run['planner']}\n"
+        )
+        if last_run['skipped']:
+            text += f"• Пропущено: {last_run['skipped']}\n"
+    return text
+
+
+async def run_maintenance(context: ContextTypes.DEFAULT_TYPE, force=False) -> dict:
+    """Обслуживание БД: освобождение страниц и обновление статистики планировщика.
+
+    Страницы освобождаются небольшими шагами и только в тихий период
+    (нет обновлений дольше MAINTENANCE_IDLE_SECONDS); при появлении
+    активности цикл прерывается до следующего запуска.
+    """
+    report = {'pages_freed': 0, 'planner': 'не обновлялась', 'skipped': None, 'finished_at': None}
+
+    def is_quiet():
+        last_update_at = context.bot_data.get('last_update_at', 0)
+        return time.monotonic() - last_update_at >= MAINTENANCE_IDLE_SECONDS
+
+    if context.bot_data.get('cleanup_running'):
+        report['skipped'] = "идет очистка"
+    elif not force and not is_quiet():
+        report['skipped'] = "бот занят"
+    else:
+        for _ in range(MAINTENANCE_VACUUM_STEPS):
+            freed = incremental_vacuum(MAINTENANCE_VACUUM_PAGES)
+            report['pages_freed'] += freed
+            if freed < MAINTENANCE_VACUUM_PAGES or not (force or is_quiet()):
+                break
+            await asyncio.sleep(CLEANUP_BATCH_PAUSE)
+
+        # Полный ANALYZE раз в сутки, в остальное время дешевый PRAGMA optimize
+        last_analyze = context.bot_data.get('last_analyze_at')
+        full = last_analyze is None or time.monotonic() - last_analyze >= MAINTENANCE_ANALYZE_INTERVAL
+        if refresh_planner_stats(full=full):
+            report['planner'] = "ANALYZE" if full else "PRAGMA optimize"
+            if full:
+                context.bot_data['last_analyze_at'] = time.monotonic()
+
+    report['finished_at'] = datetime.now().strftime('%d.%m.%Y %H:%M:%S')
+    context.bot_data['last_maintenance'] = report
+    if report['pages_freed'] > 0:
+        logger.info(f"Обслуживание БД: освобождено {report['pages_freed']} страниц, {report['planner']}")
+    return report
+
+
+async def scheduled_maintenance(context: ContextTypes.DEFAULT_TYPE):
+    """Регулярное обслуживание базы данных"""
+    try:
+        await run_maintenance(context)
+    except Exception as e:
+        logger.error(f"Ошибка при обслуживании БД: {e}")
+
+
+def format_backup_report(backups, last_run) -> str:
+    """Текст со списком резервных копий для админ-панели"""
+    text = "💾 РЕЗЕРВНЫЕ КОПИИ\n\n"
+    if backups:
+        for path in backups[:5]:
+            text += f"• {os.path.basename(path)} ({os.path.getsize(path) / 1024:.1f} КБ)\n"
+        if len(backups) > 5:
+            text += f"... и ещё {len(backups) - 5}\n"
+    else:
+        text += "Резервных копий пока нет.\n"
+
+    if last_run:
+        if 'error' in last_run:
+            text += f"\n❌ Последняя попытка {last_run['finished_at']}: {last_run['error']}\n"
+        else:
+            text += (
+                f"\nПоследняя копия: {last_run['finished_at']}\n"
+                f"• Объем: {last_run['db_bytes'] / 1024:.1f} КБ → {last_run['compressed_bytes'] / 1024:.1f} КБ\n"
+                f"• Скорость: {last_run['throughput'] / 1024 / 1024:.1f} МБ/с\n"
+                f"• Шагов: {last_run['steps']}, перезапусков: {last_run['restarts']}\n"
+                f"• Пауза для записи: макс. {last_run['max_step_ms']:.1f} мс, "
+                f"средн. {last_run['avg_step_ms']:.1f} мс\n"
+            )
+    text += "\nВосстановление (при остановленном боте):\npython backup.py restore <файл>"
+    return text
+
+
+async def run_backup(context: ContextTypes.DEFAULT_TYPE) -> dict:
+    """Создание резервной копии в отдельном потоке, чтобы не блокировать бота"""
+    if context.bot_data.get('backup_running'):
+        return context.bot_data.get('last_backup')
+
+    context.bot_data['backup_running'] = True
+    try:
+        report = await asyncio.to_thread(
+            create_backup,
+            pages_per_step=BACKUP_PAGES_PER_STEP,
+            step_pause=BACKUP_STEP_PAUSE,
+            keep=BACKUP_KEEP
+        )
+    except Exception as e:
+        logger.error(f"Ошибка при создании резервной копии: {e}")
+        report = {'error': str(e), 'finished_at': datetime.now().strftime('%d.%m.%Y %H:%M:%S')}
+    finally:
+        context.bot_data['backup_running'] = False
+
+    context.bot_data['last_backup'] = report
+    return report
+
+
+async def scheduled_backup(context: ContextTypes.DEFAULT_TYPE):
+    """Регулярное резервное копирование базы данных"""
+    await run_backup(context)
+
+
+async def track_activity(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Запоминает время последнего обновления, чтобы находить тихие периоды"""
+    context.bot_data['last_update_at'] = time.monotonic()
+
+
+# Классы действий для ограничения частоты (остальное — 'default')
+THROTTLE_CALLBACK_CLASSES = {
+    'repeat_search': 'search',
+    'refresh_relevant_rides': 'refresh',
+    'contact': 'contact',
+    'search_page_next': 'page',
+    'search_page_prev': 'page',
+    'relevant_page_next': 'page',
+    'relevant_page_prev': 'page',
+    'ride_route': 'page',
+}
+THROTTLE_TEXT_CLASSES = {
+    "🔍 Найти поездку": 'search',
+    "🚗 Актуальные поездки": 'refresh',
+    "📋 Мои поиски": 'refresh',
+}
+# Что отбрасывается при перегрузке БД или API
+SHEDDABLE_CLASSES = frozenset(['refresh'])
+
+
+def classify_update(update: Update, context: ContextTypes.DEFAULT_TYPE) -> str:
+    """Класс действия для ограничения частоты"""
+    if update.callback_query:
+        return THROTTLE_CALLBACK_CLASSES.get(CALLBACKS.peek_name(update.callback_query.data), 'default')
+    if update.inline_query:
+        return 'inline'
+    if update.message and update.message.text:
+        action_class = THROTTLE_TEXT_CLASSES.get(update.message.text)
+        if action_class:
+            return action_class
+        if context.user_data is not None and 'search_ride_step' in context.user_data:
+            return 'search'
+        if parse_ride_text(update.message.text) is not None:
+            return 'search'
+    return 'default'
+
+
+async def throttle_update(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Ограничение частоты и сброс нагрузки до запуска обработчиков"""
+    if update.effective_user is None or is_admin(update.effective_user.id):
+        return
+
+    action_class = classify_update(update, context)
+    if action_class in SHEDDABLE_CLASSES and LATENCY.overloaded():
+        FLOOD_CONTROL.record_shed(action_class)
+        await _reject_update(update, "⏳ Бот сейчас перегружен, попробуйте чуть позже.")
+        raise ApplicationHandlerStop
+
+    allowed, notify = FLOOD_CONTROL.allow(update.effective_user.id, action_class)
+    if not allowed:
+        # Сообщение об ограничении отправляем один раз, а не на каждое нажатие
+        if notify or update.callback_query:
+            await _reject_update(update, "⏳ Слишком часто. Подождите немного и попробуйте снова.")
+        raise ApplicationHandlerStop
+
+
+async def _reject_update(update: Update, text: str) -> None:
+    if update.callback_query:
+        await answer_callback(update.callback_query, text)
+    elif update.message:
+        await update.message.reply_text(text)
+
+
+async def load_conversation_state(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Подгружает сохраненный сценарий пользователя при первом обновлении от него"""
+    if update.effective_user is None or context.user_data is None:
+        return
+    context.user_data.touch()
+    stored = load_user_state(update.effective_user.id)
+    if stored:
+        # Поля, убранные из ConversationState после сохранения, пропускаем:
+        # иначе каждое обновление такого пользователя падало бы с KeyError
+        known = {key: value for key, value in stored.items() if key in ConversationState.FIELDS}
+        if len(known) != len(stored):
+            logger.warning(
+                f"Пропущены устаревшие поля сценария пользователя {update.effective_user.id}: "
+                f"{sorted(set(stored) - set(known))}"
+            )
+        context.user_data.update(known)
+
+
+async def save_conversation_state(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Ставит измененный сценарий в очередь записи (после всех обработчиков)"""
+    if update.effective_user is None or context.user_data is None:
+        return
+    track_user_state(update.effective_user.id, context.user_data)
+
+
 async def stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Показать статистику бота (только для админов)."""
     # Проверяем, что сообщение в личном чате
@@ -2282,7 +2951,7 @@ async def stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
         cursor.execute("SELECT COUNT(*) FROM rides WHERE is_active = 1")
         active_rides_count = cursor.fetchone()[0]
 
-        cursor.execute("SELECT COUNT(*) FROM passenger_searches")
+        cursor.execute("SELECT COALESCE(SUM(hit_count), 0) FROM passenger_searches")
         searches_count = cursor.fetchone()[0]
 
         cursor.execute("SELECT COUNT(DISTINCT driver_id) FROM rides WHERE is_active = 1")
@@ -2303,25 +2972,281 @@ async def stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
         conn.close()
 
 
-def setup_jobs(application):
-    """Настройка планировщика задач"""
-    # Очистка каждые 6 часов
+async def flush_search_history(context: ContextTypes.DEFAULT_TYPE):
+    """Сброс буфера истории поисков в базу данных"""
+    flush_passenger_searches()
+
+
+async def refresh_location_index(context: ContextTypes.DEFAULT_TYPE):
+    """Пополнение подсказок пунктов поездками и поисками, добавленными с прошлого раза"""
+    counts, ride_id, search_id = get_location_counts(LOCATIONS.ride_id, LOCATIONS.search_id)
+    LOCATIONS.update(counts, ride_id, search_id)
+
+
+async def refresh_journey_index(context: ContextTypes.DEFAULT_TYPE):
+    """Перестройка графа поездок для поиска с пересадками (в фоновом потоке)"""
+    rides = await asyncio.to_thread(get_active_rides_snapshot, datetime.now().strftime('%Y-%m-%d'))
+    await asyncio.to_thread(JOURNEYS.build, rides)
+
+
+async def flush_conversation_states(context: ContextTypes.DEFAULT_TYPE):
+    """Пакетная запись измененных сценариев пользователей"""
+    flush_user_states()
+
+
+async def evict_idle_conversations(context: ContextTypes.DEFAULT_TYPE):
+    """Выгрузка из памяти состояний пользователей, бездействующих дольше CONVERSATION_IDLE_TTL.
+
+    Состояние сначала записывается в базу, поэтому при следующем
+    обновлении пользователь продолжит сценарий с того же шага.
+    """
+    application = context.application
+    deadline = time.monotonic() - CONVERSATION_IDLE_TTL
+    idle = [
+        (user_id, state) for user_id, state in application.user_data.items()
+        if state.touched_at < deadline
+    ]
+    if not idle:
+        return
+
+    for user_id, state in idle:
+        track_user_state(user_id, state)
+    flush_user_states()
+
+    evicted = 0
+    for user_id, _ in idle:
+        # Если запись не удалась, состояние остается в памяти до следующего раза
+        if forget_user_state(user_id):
+            application.drop_user_data(user_id)
+            evicted += 1
+    logger.info(f"Выгружено из памяти {evicted} неактивных пользователей")
+
+
+async def renew_leadership(context: ContextTypes.DEFAULT_TYPE):
+    """Захват или продление аренды ведущего экземпляра"""
+    was_leader = context.bot_data.get('is_leader', False)
+    is_leader = try_acquire_lease(LEADER_LEASE_TTL)
+    context.bot_data['is_leader'] = is_leader
+    if is_leader and not was_leader:
+        logger.info("Этот экземпляр стал ведущим: выполняет периодические задачи")
+    elif was_leader and not is_leader:
+        logger.warning("Аренда ведущего потеряна: периодические задачи приостановлены")
+
+
+def leader_only(callback):
+    """Задача планировщика, которая выполняется только на ведущем экземпляре"""
+    @functools.wraps(callback)
+    async def wrapper(context: ContextTypes.DEFAULT_TYPE):
+        if not context.bot_data.get('is_leader'):
+            return
+        await callback(context)
+    return wrapper
+
+
+async def on_shutdown(application: Application) -> None:
+    """Действия при остановке бота"""
+    # Дописываем историю поисков, накопленную в буфере
+    flushed = flush_passenger_searches()
+    logger.info(f"При остановке записано {flushed} поисков из буфера")
+    saved = flush_user_states()
+    logger.info(f"При остановке сохранено {saved} сценариев пользователей")
+    # Отдаем аренду сразу, чтобы другой экземпляр не ждал истечения срока
+    if application.bot_data.get('is_leader') and release_lease():
+        logger.info("Аренда ведущего освобождена")
+
+
+def setup_jobs(application, periodic_jobs=True):
+    """Настройка планировщика задач.
+
+    periodic_jobs=False — без аренды ведущего, очистки, копирования и обслуживания БД
+    (для процессов-обработчиков, в которых их выполняет другой процесс); буферы
+    и индексы обслуживаются в каждом процессе. Без JobQueue бот не запускается.
+    """
     job_queue = application.job_queue
-    if job_queue:
-        job_queue.run_repeating(scheduled_cleanup, interval=21600, first=10)
+    if job_queue is None:
+        # Без планировщика молча не работали бы аренда ведущего, очистка,
+        # запись буферов и индексы подсказок и пересадок
+        raise RuntimeError(
+            "JobQueue недоступен: установите python-telegram-bot[job-queue]"
+        )
 
+    if periodic_jobs:
+        # Периодические задачи выполняет только ведущий экземпляр;
+        # при истечении аренды ее перехватывает другой
+        job_queue.run_repeating(renew_leadership, interval=LEADER_RENEW_INTERVAL, first=0)
+        # Очистка каждые 6 часов (первый запуск заменяет очистку при старте)
+        job_queue.run_repeating(leader_only(scheduled_cleanup), interval=21600, first=10)
+        # Резервное копирование
+        job_queue.run_repeating(leader_only(scheduled_backup), interval=BACKUP_INTERVAL, first=BACKUP_INTERVAL)
+        # Обслуживание БД в тихие периоды
+        job_queue.run_repeating(
+            leader_only(scheduled_maintenance),
+            interval=MAINTENANCE_INTERVAL,
+            first=MAINTENANCE_INTERVAL
+        )
+    # Пакетная запись истории поисков
+    job_queue.run_repeating(
+        flush_search_history,
+        interval=SEARCH_HISTORY_FLUSH_INTERVAL_MS / 1000,
+        first=SEARCH_HISTORY_FLUSH_INTERVAL_MS / 1000
+    )
+    # Подсказки пунктов: в каждом процессе свой индекс, первая загрузка сразу
+    job_queue.run_repeating(refresh_location_index, interval=LOCATION_INDEX_REFRESH, first=0)
+    # Граф поездок для поиска с пересадками, тоже в каждом процессе
+    job_queue.run_repeating(refresh_journey_index, interval=JOURNEY_INDEX_REFRESH, first=0)
+    # Пакетная запись пошаговых сценариев пользователей
+    job_queue.run_repeating(
+        flush_conversation_states,
+        interval=CONVERSATION_FLUSH_INTERVAL,
+        first=CONVERSATION_FLUSH_INTERVAL
+    )
+    # Выгрузка неактивных пользователей из памяти
+    job_queue.run_repeating(
+        evict_idle_conversations,
+        interval=CONVERSATION_EVICT_INTERVAL,
+        first=CONVERSATION_EVICT_INTERVAL
+    )
 
-def main() -> None:
-    """Запуск бота."""
-    # Инициализация БД
-    init_db()
 
-    # Инициализация периодической очистки
-    cleanup_expired_rides()
-    delete_old_inactive_rides()
+async def run_webhook(application: Application) -> None:
+    """Запуск в режиме webhook со встроенным HTTP-сервером.
 
-    # Создание приложения
-    application = Application.builder().token(TOKEN).build()
+    Сервер отвечает Telegram сразу после постановки обновления в очередь
+    приложения, обработка идет в фоне тем же Application, что и при polling.
+    """
+    def enqueue(data):
+        application.update_queue.put_nowait(Update.de_json(data, application.bot))
+
+    server = WebhookServer(
+        enqueue,
+        listen=WEBHOOK_LISTEN,
+        port=WEBHOOK_PORT,
+        path=WEBHOOK_PATH,
+        secret_token=WEBHOOK_SECRET
+    )
+
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop_event.set)
+
+    async with application:
+        await application.start()
+        await server.start()
+        await application.bot.set_webhook(
+            url=WEBHOOK_URL,
+            secret_token=WEBHOOK_SECRET,
+            allowed_updates=Update.ALL_TYPES
+        )
+        try:
+            await stop_event.wait()
+        finally:
+            await server.stop()
+            await application.stop()
+
+    # post_shutdown вызывается только из run_polling/run_webhook, поэтому вручную
+    await on_shutdown(application)
+
+
+def register_callbacks() -> None:
+    """Таблица inline-кнопок: имя, короткий код, обработчик и типы параметров"""
+    register = CALLBACKS.register
+    register('check_subscription', 'cs', check_subscription_callback)
+    register('accept_terms', 'at', accept_terms_callback)
+
+    # Поездки и контакты (кнопки с id подписываются)
+    register('contact', 'c', show_driver_contact, (int,))
+    register('register_for_contacts', 'rc', prompt_contact_registration)
+    register('end_ride', 'e', end_ride, (int,))
+    register('ride_route', 'rt', show_ride_route, (int,))
+    register('confirm_ride', 'cr', confirm_ride)
+    register('edit_ride_draft', 'ce', edit_ride_draft)
+    register('repeat_search', 'rs', repeat_search, (int,))
+    register('refresh_relevant_rides', 'rr', refresh_relevant_rides)
+    register('search_page_next', 'sn', show_search_page, (int, int))
+    register('search_page_prev', 'sv', functools.partial(show_search_page, backward=True), (int, int))
+    register('relevant_page_next', 'rn', show_relevant_page, (int, int))
+    register('relevant_page_prev', 'rv', functools.partial(show_relevant_page, backward=True), (int, int))
+    register('back_to_driver', 'bd', back_to_driver_menu)
+    register('back_to_passenger', 'bp', back_to_passenger_menu)
+    register('back_to_passenger_search', 'bs', back_to_passenger_search)
+
+    # Админ-панель
+    register('admin_stats', 'as', show_admin_stats, admin_only=True)
+    register('admin_users', 'au', show_all_users, admin_only=True)
+    register('admin_active_rides', 'ar', show_active_rides, admin_only=True)
+    register('admin_delete_ride', 'ad', delete_ride_admin, (int,), admin_only=True)
+    register('admin_broadcast', 'ab', start_broadcast, admin_only=True)
+    register('admin_confirm_broadcast', 'abc', confirm_broadcast, admin_only=True)
+    register('admin_cleanup', 'ac', perform_cleanup, admin_only=True)
+    register('admin_maintenance', 'am', show_db_maintenance, admin_only=True)
+    register('admin_maintenance_run', 'amr', functools.partial(show_db_maintenance, run=True), admin_only=True)
+    register('admin_backup', 'ak', show_backups, admin_only=True)
+    register('admin_backup_run', 'akr', functools.partial(show_backups, run=True), admin_only=True)
+    register('admin_back', 'a0', admin_back, admin_only=True)
+    register('admin_exit', 'ax', admin_exit, admin_only=True)
+
+
+async def dispatch_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Единая точка входа для всех inline-кнопок"""
+    query = update.callback_query
+    decoded = CALLBACKS.decode(query.data)
+    if decoded is None:
+        await answer_callback(query, "❌ Кнопка устарела, откройте меню заново")
+        return
+
+    action, args = decoded
+    if action.admin_only and not is_admin(query.from_user.id):
+        await answer_callback(query, "❌ Доступ запрещен")
+        return
+
+    try:
+        await action.handler(update, context, *args)
+    finally:
+        # Обработчики отвечают сами только уведомлениями; обычный ответ — здесь, один раз
+        await answer_callback(query)
+
+
+register_callbacks()
+MESSAGE_ROUTER = build_message_router()
+
+
+def build_application(updater=True, periodic_jobs=True, processes=1) -> Application:
+    """Создание приложения с обработчиками и планировщиком задач.
+
+    processes — сколько процессов-обработчиков отправляют сообщения от имени
+    бота. У каждого свой планировщик, поэтому общий лимит и лимит групп
+    (в группу могут писать все процессы) делятся между ними. Личный чат
+    обслуживает один процесс (раздача по user_id), его лимит не делится.
+    """
+    # Обновления разных пользователей обрабатываются параллельно, одного — по порядку
+    builder = (
+        Application.builder()
+        .token(TOKEN)
+        .context_types(ContextTypes(user_data=ConversationState))
+        # Все запросы к Telegram проходят через общий планировщик с приоритетами
+        .rate_limiter(OutboundScheduler(
+            overall_rate=OUTBOUND_RATE / processes,
+            overall_burst=max(1, OUTBOUND_BURST / processes),
+            private_rate=OUTBOUND_PRIVATE_RATE,
+            group_rate=OUTBOUND_GROUP_RATE / processes,
+            chat_burst=OUTBOUND_CHAT_BURST
+        ))
+        .concurrent_updates(PerUserUpdateProcessor(UPDATE_CONCURRENCY))
+        .post_shutdown(on_shutdown)
+    )
+    if not updater:
+        # Обновления приходят от процесса-приемника, а не из getUpdates
+        builder = builder.updater(None)
+    application = builder.build()
+
+    # Учет активности для поиска тихих периодов (отдельная группа, не мешает остальным обработчикам)
+    application.add_handler(TypeHandler(Update, track_activity), group=-1)
+    # Сценарии пользователей переживают перезапуск: загрузка до обработчиков, сохранение после
+    application.add_handler(TypeHandler(Update, load_conversation_state), group=-3)
+    # Ограничение частоты: после загрузки сценария (нужен для классификации), до обработчиков
+    application.add_handler(TypeHandler(Update, throttle_update), group=-2)
+    application.add_handler(TypeHandler(Update, save_conversation_state), group=100)
 
     # Регистрация обработчиков команд
     application.add_handler(CommandHandler("start", start))
@@ -2330,17 +3255,13 @@ def main() -> None:
     application.add_handler(CommandHandler("register", register_command))
     application.add_handler(CommandHandler("terms", terms_command))
     application.add_handler(CommandHandler("admin", admin_panel))
-    application.add_handler(CommandHandler("cleanup", lambda u, c: scheduled_cleanup(c)))  # Команда для ручной очистки
     application.add_handler(CommandHandler("stats", stats_command))
 
-    # Регистрация обработчиков callback-кнопок
-    application.add_handler(CallbackQueryHandler(handle_contact_callback, pattern="^contact_"))
-    application.add_handler(CallbackQueryHandler(handle_contact_callback, pattern="^register_for_contacts$"))
-    application.add_handler(CallbackQueryHandler(handle_callback_actions, pattern="^(end_ride_|repeat_search_|refresh_relevant_rides|back_to_)"))
-    application.add_handler(CallbackQueryHandler(button_callback, pattern="^(check_subscription|accept_terms)$"))
+    # Все inline-кнопки разбираются одним обработчиком по таблице register_callbacks()
+    application.add_handler(CallbackQueryHandler(dispatch_callback))
 
-    # Обработчики для админ-панели
-    application.add_handler(CallbackQueryHandler(handle_admin_callbacks, pattern="^admin_"))
+    # Inline-поиск поездок из любого чата
+    application.add_handler(InlineQueryHandler(inline_search))
 
     # Регистрация обработчика контактов
     application.add_handler(MessageHandler(filters.CONTACT, handle_contact))
@@ -2349,7 +3270,22 @@ def main() -> None:
     application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message))
 
     # Настройка планировщика задач
-    setup_jobs(application)
+    setup_jobs(application, periodic_jobs)
+    return application
+
+
+def build_worker_application(index: int) -> Application:
+    """Приложение процесса-обработчика; периодические задачи выполняет только первый процесс"""
+    return build_application(updater=False, periodic_jobs=(index == 0), processes=WORKER_PROCESSES)
+
+
+def main() -> None:
+    """Запуск бота."""
+    # Инициализация БД
+    init_db()
+    init_archive_db()
+    init_leader_table()
+    init_conversation_store()
 
     # Запуск бота
     print("🤖 Бот запущен...")
@@ -2366,7 +3302,32 @@ def main() -> None:
     print("✅ Inline-кнопки 'Завершить' и 'Повторить' теперь работают!")
     print("🚗 Добавлена кнопка 'Актуальные поездки' для пассажиров")
     print("👑 Админ-панель доступна по команде /admin")
-    application.run_polling(allowed_updates=Update.ALL_TYPES)
+    if RUN_MODE == 'webhook':
+        print(f"🌐 Режим webhook: {WEBHOOK_URL} -> {WEBHOOK_LISTEN}:{WEBHOOK_PORT}{WEBHOOK_PATH}")
+
+    if WORKER_PROCESSES > 1:
+        # Один процесс принимает обновления и раздает их обработчикам по user_id
+        print(f"🧩 Процессов-обработчиков: {WORKER_PROCESSES}")
+        run_sharded(
+            build_worker_application,
+            WORKER_PROCESSES,
+            TOKEN,
+            mode=RUN_MODE,
+            webhook_options={
+                'url': WEBHOOK_URL,
+                'listen': WEBHOOK_LISTEN,
+                'port': WEBHOOK_PORT,
+                'path': WEBHOOK_PATH,
+                'secret': WEBHOOK_SECRET,
+            }
+        )
+        return
+
+    application = build_application()
+    if RUN_MODE == 'webhook':
+        asyncio.run(run_webhook(application))
+    else:
+        application.run_polling(allowed_updates=Update.ALL_TYPES)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,160 @@
+import asyncio
+import logging
+import time
+
+from telegram.error import RetryAfter
+from telegram.ext import BaseRateLimiter
+
+logger = logging.getLogger(__name__)
+
+INTERACTIVE = 'interactive'
+BULK = 'bulk'
+
+# Методы API, на которые распространяются лимиты Telegram на отправку
+_LIMITED_PREFIXES = ('send', 'copyMessage', 'forwardMessage', 'editMessage')
+# Как часто удалять из памяти полные корзины чатов, секунды
+PRUNE_INTERVAL = 60
+
+
+class LaneStats:
+    __slots__ = ('waiting', 'sent', 'avg_wait', 'max_wait')
+
+    def __init__(self):
+        self.waiting = 0
+        self.sent = 0
+        self.avg_wait = 0.0
+        self.max_wait = 0.0
+
+    def record_wait(self, seconds):
+        self.sent += 1
+        self.avg_wait += 0.1 * (seconds - self.avg_wait)
+        self.max_wait = max(self.max_wait, seconds)
+
+
+class OutboundScheduler(BaseRateLimiter):
+    """Единый планировщик исходящих запросов к Telegram.
+
+    Через него проходят все вызовы бота (Application.rate_limiter).
+    Запросы на отправку и редактирование сообщений проходят два шага:
+    корзина чата (личный чат или группа) и общая корзина бота. Очередь
+    interactive (ответы пользователям) всегда обслуживается раньше bulk
+    (рассылки): bulk ждет, пока в общей очереди есть interactive-запросы.
+
+    Полоса задается через rate_limit_args={'lane': 'bulk'}; по умолчанию —
+    interactive. RetryAfter от Telegram приостанавливает все отправки на
+    указанное время, после чего запрос повторяется (до max_retries раз).
+    """
+
+    def __init__(self, overall_rate=25, overall_burst=5, private_rate=1.0, group_rate=20 / 60, chat_burst=3, max_retries=3):
+        self.overall_rate = overall_rate
+        self.overall_burst = overall_burst
+        self.private_rate = private_rate
+        self.group_rate = group_rate
+        self.chat_burst = chat_burst
+        self.max_retries = max_retries
+        self.lanes = {INTERACTIVE: LaneStats(), BULK: LaneStats()}
+        self.retry_after_count = 0
+        self._tokens = float(overall_burst)
+        self._updated = time.monotonic()
+        self._chats = {}
+        self._paused_until = 0.0
+        self._last_prune = time.monotonic()
+        # Сколько interactive-запросов ждут общую корзину
+        self._interactive_waiting = 0
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    def _chat_rate(self, chat_id):
+        if isinstance(chat_id, int) and chat_id > 0:
+            return self.private_rate
+        return self.group_rate
+
+    async def _wait_chat(self, chat_id):
+        """Корзина чата: короткие всплески до chat_burst, дальше по лимиту чата"""
+        rate = self._chat_rate(chat_id)
+        while True:
+            now = time.monotonic()
+            tokens, updated = self._chats.get(chat_id, (self.chat_burst, now))
+            tokens = min(self.chat_burst, tokens + (now - updated) * rate)
+            if tokens >= 1:
+                self._chats[chat_id] = (tokens - 1, now)
+                return
+            self._chats[chat_id] = (tokens, now)
+            await asyncio.sleep((1 - tokens) / rate)
+
+    async def _wait_global(self, lane):
+        """Общая корзина бота с приоритетом interactive над bulk"""
+        interactive = lane == INTERACTIVE
+        if interactive:
+            self._interactive_waiting += 1
+        try:
+            while True:
+                now = time.monotonic()
+                delay = self._paused_until - now
+                if delay <= 0 and not interactive and self._interactive_waiting:
+                    delay = 1 / self.overall_rate
+                if delay <= 0:
+                    self._tokens = min(self.overall_burst, self._tokens + (now - self._updated) * self.overall_rate)
+                    self._updated = now
+                    if self._tokens >= 1:
+                        self._tokens -= 1
+                        return
+                    delay = (1 - self._tokens) / self.overall_rate
+                await asyncio.sleep(delay)
+        finally:
+            if interactive:
+                self._interactive_waiting -= 1
+
+    def _prune(self, now):
+        self._last_prune = now
+        full = [
+            chat_id for chat_id, (tokens, updated) in self._chats.items()
+            if tokens + (now - updated) * self._chat_rate(chat_id) >= self.chat_burst
+        ]
+        for chat_id in full:
+            del self._chats[chat_id]
+
+    async def process_request(self, callback, args, kwargs, endpoint, data, rate_limit_args):
+        if not endpoint.startswith(_LIMITED_PREFIXES):
+            return await callback(*args, **kwargs)
+
+        lane = BULK if rate_limit_args and rate_limit_args.get('lane') == BULK else INTERACTIVE
+        stats = self.lanes[lane]
+        chat_id = data.get('chat_id')
+
+        for attempt in range(self.max_retries + 1):
+            started = time.monotonic()
+            stats.waiting += 1
+            try:
+                if chat_id is not None:
+                    await self._wait_chat(chat_id)
+                await self._wait_global(lane)
+            finally:
+                stats.waiting -= 1
+            stats.record_wait(time.monotonic() - started)
+
+            if started - self._last_prune > PRUNE_INTERVAL:
+                self._prune(started)
+
+            try:
+                return await callback(*args, **kwargs)
+            except RetryAfter as e:
+                retry_after = e.retry_after
+                if hasattr(retry_after, 'total_seconds'):
+                    retry_after = retry_after.total_seconds()
+                self.retry_after_count += 1
+                self._paused_until = max(self._paused_until, time.monotonic() + retry_after)
+                logger.warning(f"Telegram просит подождать {retry_after} с ({endpoint}, попытка {attempt + 1})")
+                if attempt == self.max_retries:
+                    raise
+
+    def report(self):
+        """Метрики для админ-панели: {полоса: (в очереди, отправлено, средн. ожидание, макс. ожидание)}"""
+        return {
+            lane: (stats.waiting, stats.sent, stats.avg_wait, stats.max_wait)
+            for lane, stats in self.lanes.items()
+        }
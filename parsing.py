@@ -0,0 +1,121 @@
+import re
+from datetime import date as date_type, datetime, timedelta
+
+# Поездка одной строкой: «Москва - Казань 31.12 14:30 3», «Москва Казань завтра».
+# Маршрут, затем дата (ДД.ММ, ДД.ММ.ГГГГ или слово), необязательные время и места
+_RIDE_TEXT = re.compile(r'''
+    ^\s*
+    (?P<route>.+?)
+    \s+
+    (?P<date>\d{1,2}\.\d{1,2}(?:\.\d{4})?|сегодня|завтра|послезавтра)
+    (?:\s+(?P<time>\d{1,2}:\d{2}))?
+    (?:\s+(?P<seats>\d{1,2}))?
+    \s*$
+''', re.VERBOSE | re.IGNORECASE)
+
+# Разделитель «откуда - куда». Дефис только с пробелами, чтобы не резать
+# названия вроде «Ростов-на-Дону»
+_ROUTE_SEPARATOR = re.compile(r'\s*(?:→|->|–|—)\s*|\s+-\s+')
+
+_RELATIVE_DAYS = {'сегодня': 0, 'завтра': 1, 'послезавтра': 2}
+
+MAX_SEATS = 10
+
+
+class RideText:
+    """Разобранная строка: маршрут, дата (YYYY-MM-DD), время и места, если указаны"""
+
+    __slots__ = ('from_location', 'to_location', 'date', 'time', 'seats')
+
+    def __init__(self, from_location, to_location, date, time=None, seats=None):
+        self.from_location = from_location
+        self.to_location = to_location
+        self.date = date
+        self.time = time
+        self.seats = seats
+
+    @property
+    def complete(self):
+        """Достаточно данных для создания поездки"""
+        return self.time is not None and self.seats is not None
+
+
+def _split_route(route):
+    parts = _ROUTE_SEPARATOR.split(route, maxsplit=1)
+    if len(parts) != 2:
+        # Без разделителя маршрут однозначен только из двух слов
+        parts = route.split()
+        if len(parts) != 2:
+            return None
+    from_location, to_location = (part.strip() for part in parts)
+    if not from_location or not to_location or from_location.lower() == to_location.lower():
+        return None
+    return from_location, to_location
+
+
+def _parse_date(text, today):
+    text = text.lower()
+    if text in _RELATIVE_DAYS:
+        return today + timedelta(days=_RELATIVE_DAYS[text])
+    parts = [int(part) for part in text.split('.')]
+    try:
+        if len(parts) == 3:
+            return date_type(parts[2], parts[1], parts[0])
+        parsed = date_type(today.year, parts[1], parts[0])
+    except ValueError:
+        return None
+    if parsed < today:
+        # Дата без года, которая уже прошла, — это следующий год
+        try:
+            parsed = date_type(today.year + 1, parts[1], parts[0])
+        except ValueError:
+            return None
+    return parsed
+
+
+def parse_ride_text(text, today=None):
+    """Разбор поездки, записанной одним сообщением.
+
+    Возвращает RideText или None, если строка не похожа на поездку
+    (тогда работает пошаговый сценарий).
+    """
+    match = _RIDE_TEXT.match(text or '')
+    if match is None:
+        return None
+
+    route = _split_route(match.group('route'))
+    if route is None:
+        return None
+
+    parsed_date = _parse_date(match.group('date'), today or datetime.now().date())
+    if parsed_date is None:
+        return None
+
+    time_text = match.group('time')
+    if time_text is not None:
+        hours, minutes = (int(part) for part in time_text.split(':'))
+        if hours > 23 or minutes > 59:
+            return None
+        time_text = f"{hours:02d}:{minutes:02d}"
+
+    seats = match.group('seats')
+    if seats is not None:
+        seats = int(seats)
+        if seats < 1 or seats > MAX_SEATS:
+            return None
+
+    return RideText(route[0], route[1], parsed_date.strftime('%Y-%m-%d'), time_text, seats)
+
+
+def parse_route_query(text, today=None):
+    """Маршрут с необязательной датой («Москва Казань», «Москва - Казань 31.12»).
+
+    Для inline-поиска: RideText с date=None, если дата не указана.
+    """
+    parsed = parse_ride_text(text, today)
+    if parsed is not None:
+        return parsed
+    route = _split_route((text or '').strip())
+    if route is None:
+        return None
+    return RideText(route[0], route[1], None)
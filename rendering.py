@@ -0,0 +1,221 @@
+import functools
+import logging
+from datetime import datetime
+
+from telegram import (
+    InlineKeyboardButton, InlineKeyboardMarkup, InlineQueryResultArticle, InputTextMessageContent
+)
+
+logger = logging.getLogger(__name__)
+
+# Виды карточек поездки
+SEARCH_CARD = 'search'
+RELEVANT_CARD = 'relevant'
+JOURNEY_LEG = 'journey'
+# Длина подписи кнопки контактов, после которой используется короткий вариант
+CONTACT_LABEL_LIMIT = 40
+
+
+@functools.lru_cache(maxsize=4096)
+def format_date_for_display(date_str: str) -> str:
+    """Преобразует дату из формата YYYY-MM-DD в DD.MM.YYYY для отображения"""
+    try:
+        # Пытаемся распарсить разные форматы
+        if '.' in date_str:
+            # Уже в формате DD.MM.YYYY
+            parts = date_str.split('.')
+            if len(parts) == 3:
+                day, month, year = parts
+                return f"{int(day):02d}.{int(month):02d}.{year}"
+
+        # Пробуем формат YYYY-MM-DD
+        try:
+            date_obj = datetime.strptime(date_str, '%Y-%m-%d')
+            return date_obj.strftime('%d.%m.%Y')
+        except ValueError:
+            pass
+
+        # Возвращаем как есть, если не удалось распарсить
+        return date_str
+    except Exception as e:
+        logger.error(f"Ошибка при форматировании даты {date_str}: {e}")
+        return date_str
+
+
+def _search_card(ride):
+    ride_id, _, driver_username, from_loc, to_loc, date, time, seats = ride[:8]
+    return (
+        f"🚗 Поездка #{ride_id}\n"
+        f"  📍 {from_loc} → {to_loc}\n"
+        f"  📅 {format_date_for_display(date)} в {time}\n"
+        f"  👥 Свободных мест: {seats}\n"
+        f"  👤 Водитель: {driver_username}\n\n"
+    )
+
+
+def _relevant_card(ride):
+    ride_id, _, driver_username, _, _, date, time, seats = ride[:8]
+    return (
+        f"  🚗 Поездка #{ride_id}\n"
+        f"    📅 {format_date_for_display(date)} в {time}\n"
+        f"    👥 Свободных мест: {seats}\n"
+        f"    👤 Водитель: {driver_username}\n"
+        "    ──────────────────\n"
+    )
+
+
+def _journey_leg(ride):
+    ride_id, _, driver_username, from_loc, to_loc, date, time, seats = ride[:8]
+    return (
+        f"  🚗 #{ride_id}: {from_loc} → {to_loc}\n"
+        f"    📅 {format_date_for_display(date)} в {time}, мест: {seats}, 👤 {driver_username}\n"
+    )
+
+
+_CARD_FORMATS = {
+    SEARCH_CARD: _search_card,
+    RELEVANT_CARD: _relevant_card,
+    JOURNEY_LEG: _journey_leg,
+}
+
+
+class RideRenderer:
+    """Списки поездок: готовые карточки и клавиатуры контактов.
+
+    Карточка поездки запоминается по (ride_id, version): version хранится
+    в таблице rides и увеличивается при каждом изменении поездки, поэтому
+    устаревшая карточка не показывается ни в одном процессе-обработчике.
+    Сообщение собирается через ''.join из готовых частей.
+
+    Ожидаемая строка поездки: (id, driver_id, driver_username, from_location,
+    to_location, date, time, seats, version).
+    """
+
+    def __init__(self, callbacks, max_size=5000):
+        self.callbacks = callbacks
+        self.max_size = max_size
+        # ride_id -> (version, {вид карточки или 'contact': текст})
+        self._cards = {}
+        self.hits = 0
+        self.misses = 0
+
+    def _entry(self, ride):
+        """Запись кэша для текущей версии поездки: {вид: готовый текст}"""
+        ride_id, version = ride[0], ride[8]
+        entry = self._cards.get(ride_id)
+        if entry is None or entry[0] != version:
+            if entry is None and len(self._cards) >= self.max_size:
+                # Вытесняем самую старую запись
+                del self._cards[next(iter(self._cards))]
+            entry = self._cards[ride_id] = (version, {})
+        return entry[1]
+
+    def card(self, style, ride):
+        entry = self._entry(ride)
+        text = entry.get(style)
+        if text is None:
+            self.misses += 1
+            text = entry[style] = _CARD_FORMATS[style](ride)
+        else:
+            self.hits += 1
+        return text
+
+    def invalidate(self, ride_id):
+        """Удаленная поездка больше не встретится в выборках: освобождаем память сразу"""
+        self._cards.pop(ride_id, None)
+
+    def contact_button(self, ride, registered, short=False):
+        ride_id = ride[0]
+        if not registered:
+            return InlineKeyboardButton(
+                f"📞 Зарегистрируйтесь для контактов #{ride_id}",
+                callback_data=self.callbacks.encode('register_for_contacts')
+            )
+        if short:
+            # Ограничиваем текст кнопки
+            label = f"📞 Контакты #{ride_id}: {ride[3][:5]}→{ride[4][:5]}"
+            if len(label) > CONTACT_LABEL_LIMIT:
+                label = f"📞 #{ride_id}: {ride[3][:3]}→{ride[4][:3]}"
+        else:
+            label = f"📞 Контакты водителя #{ride_id}"
+        # Подпись HMAC дороже самой карточки: храним готовые данные кнопки рядом с ней
+        entry = self._entry(ride)
+        callback_data = entry.get('contact')
+        if callback_data is None:
+            callback_data = entry['contact'] = self.callbacks.encode('contact', ride_id)
+        return InlineKeyboardButton(label, callback_data=callback_data)
+
+    def search_results(self, rides, from_location, to_location, date, registered, page=None):
+        """Текст и строки клавиатуры для результатов поиска по маршруту и дате.
+
+        page — номер страницы, если результатов больше одной страницы.
+        """
+        header = f"🎯 Найдено поездок: {len(rides)}" if page is None else f"🎯 Найденные поездки, страница {page}"
+        parts = [
+            f"{header}\n\n"
+            f"📍 Маршрут: {from_location} → {to_location}\n"
+            f"📅 Дата: {format_date_for_display(date)}\n\n"
+        ]
+        parts.extend(self.card(SEARCH_CARD, ride) for ride in rides)
+        keyboard = [[self.contact_button(ride, registered)] for ride in rides]
+        return ''.join(parts), keyboard
+
+    def relevant_rides(self, items, registered, page=None):
+        """Текст и строки клавиатуры для актуальных поездок, сгруппированных по поискам"""
+        routes = {}
+        for item in items:
+            search_from, search_to, _ = item['search']
+            routes.setdefault((search_from, search_to), []).append(item)
+
+        header = "🚗 Актуальные поездки по вашим поискам"
+        parts = [f"{header}:\n\n" if page is None else f"{header} (страница {page}):\n\n"]
+        for (search_from, search_to), group in routes.items():
+            # Используем дату из первого поиска для этого маршрута
+            parts.append(
+                f"📍 Маршрут: {search_from} → {search_to}\n"
+                f"📅 Искали на дату: {format_date_for_display(group[0]['search'][2])}\n\n"
+            )
+            parts.extend(self.card(RELEVANT_CARD, item['ride']) for item in group)
+            parts.append("\n")
+
+        keyboard = [
+            [self.contact_button(item['ride'], registered, short=True)]
+            for item in items
+        ]
+        return ''.join(parts), keyboard
+
+    def journeys(self, journeys, registered):
+        """Текст и строки клавиатуры для маршрутов с пересадками (списков поездок)"""
+        parts = []
+        keyboard = []
+        for number, legs in enumerate(journeys, 1):
+            parts.append(f"{number}) Пересадок: {len(legs) - 1}\n")
+            parts.extend(self.card(JOURNEY_LEG, ride) for ride in legs)
+            parts.append("\n")
+            keyboard.append([self.contact_button(ride, registered, short=True) for ride in legs])
+        return ''.join(parts), keyboard
+
+    def inline_result(self, ride, url):
+        """Готовый результат inline-режима; url — ссылка на поездку в боте.
+
+        Хранится рядом с карточками той же версии поездки.
+        """
+        entry = self._entry(ride)
+        result = entry.get('inline')
+        if result is None:
+            self.misses += 1
+            ride_id, _, driver_username, from_loc, to_loc, date, time, seats, version = ride[:9]
+            result = entry['inline'] = InlineQueryResultArticle(
+                id=f"{ride_id}_{version}",
+                title=f"{from_loc} → {to_loc}, {format_date_for_display(date)} в {time}",
+                description=f"👥 Свободных мест: {seats} · 👤 {driver_username}",
+                input_message_content=InputTextMessageContent(self.card(SEARCH_CARD, ride).rstrip()),
+                reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("🤖 Открыть в боте", url=url)]])
+            )
+        else:
+            self.hits += 1
+        return result
+
+    def report(self):
+        """(карточек в памяти, попаданий, промахов) для админ-панели"""
+        return len(self._cards), self.hits, self.misses
@@ -0,0 +1,112 @@
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class UpdateFacts:
+    """Ленивые факты об одном обновлении (пользователь из БД, подписка и т.п.).
+
+    Каждый факт и каждая проверка вычисляются не больше одного раза
+    за обновление, даже если нужны нескольким проверкам.
+    """
+
+    __slots__ = ('update', 'context', '_providers', '_values', '_checks')
+
+    def __init__(self, update, context, providers):
+        self.update = update
+        self.context = context
+        self._providers = providers
+        self._values = {}
+        self._checks = {}
+
+    async def get(self, name):
+        if name not in self._values:
+            self._values[name] = await self._providers[name](self.update, self.context)
+        return self._values[name]
+
+    async def check(self, guard):
+        if guard.name not in self._checks:
+            self._checks[guard.name] = await guard.predicate(self.update, self.context, self)
+        return self._checks[guard.name]
+
+
+class Guard:
+    """Условие доступа к маршруту.
+
+    predicate(update, context, facts) -> bool, on_fail(update, context, facts) —
+    ответ пользователю при отказе. Варианты одной проверки с разными
+    ответами (with_fail) имеют одно имя и вычисляются один раз.
+    """
+
+    __slots__ = ('name', 'predicate', 'on_fail')
+
+    def __init__(self, name, predicate, on_fail=None):
+        self.name = name
+        self.predicate = predicate
+        self.on_fail = on_fail
+
+    def with_fail(self, on_fail):
+        return Guard(self.name, self.predicate, on_fail)
+
+
+class Route:
+    __slots__ = ('handler', 'guards')
+
+    def __init__(self, handler, guards=()):
+        self.handler = handler
+        self.guards = tuple(guards)
+
+
+class MessageRouter:
+    """Таблица маршрутов для текстовых сообщений.
+
+    Сначала ищется точное совпадение текста с кнопкой (словарь, O(1)),
+    затем шаг пошагового сценария из context.user_data, затем шаблоны
+    свободного текста, затем маршрут по умолчанию. Общие проверки (pre_guards) выполняются для любого маршрута
+    перед его собственными.
+    """
+
+    def __init__(self, providers, pre_guards=()):
+        self.providers = providers
+        self.pre_guards = tuple(pre_guards)
+        self.labels = {}
+        self.states = []
+        self.patterns = []
+        self.default = None
+
+    def label(self, text, handler, *guards):
+        self.labels[text] = Route(handler, guards)
+
+    def state(self, key, handler, *guards):
+        self.states.append((key, Route(handler, guards)))
+
+    def pattern(self, match, handler, *guards):
+        """Маршрут для свободного текста: match(text, user_data) -> bool"""
+        self.patterns.append((match, Route(handler, guards)))
+
+    def fallback(self, handler, *guards):
+        self.default = Route(handler, guards)
+
+    def resolve(self, text, user_data):
+        route = self.labels.get(text)
+        if route is not None:
+            return route
+        for key, route in self.states:
+            if key in user_data:
+                return route
+        for match, route in self.patterns:
+            if match(text, user_data):
+                return route
+        return self.default
+
+    async def dispatch(self, update, context):
+        route = self.resolve(update.message.text, context.user_data)
+        if route is None:
+            return
+        facts = UpdateFacts(update, context, self.providers)
+        for guard in self.pre_guards + route.guards:
+            if not await facts.check(guard):
+                if guard.on_fail:
+                    await guard.on_fail(update, context, facts)
+                return
+        await route.handler(update, context)
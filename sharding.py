@@ -0,0 +1,251 @@
+import asyncio
+import logging
+import multiprocessing
+import signal
+import time
+from datetime import timedelta
+
+from telegram import Bot, Update
+from telegram.error import RetryAfter, TelegramError
+
+from webhook import WebhookServer
+
+logger = logging.getLogger(__name__)
+
+POLL_TIMEOUT = 25
+# Пауза перед повтором getUpdates после ошибки (сек)
+POLL_ERROR_PAUSE = 1
+# Как часто приемник проверяет, живы ли процессы-обработчики (сек)
+SUPERVISE_INTERVAL = 1
+# Больше перезапусков одного обработчика за окно (сек) — приемник останавливается
+WORKER_MAX_RESTARTS = 5
+WORKER_RESTART_WINDOW = 60
+
+# Поля обновления, в которых Telegram передает отправителя
+_SENDER_FIELDS = (
+    'message', 'edited_message', 'callback_query', 'inline_query',
+    'chosen_inline_result', 'shipping_query', 'pre_checkout_query',
+    'my_chat_member', 'chat_member', 'chat_join_request', 'poll_answer',
+)
+
+
+def get_shard_user_id(data):
+    """Id пользователя из «сырого» JSON обновления (без построения объекта Update)"""
+    for field in _SENDER_FIELDS:
+        payload = data.get(field)
+        if not payload:
+            continue
+        sender = payload.get('from') or payload.get('user')
+        if sender:
+            return sender['id']
+        chat = payload.get('chat')
+        if chat:
+            return chat['id']
+    return 0
+
+
+class ShardRouter:
+    """Распределяет обновления по процессам-обработчикам по user_id.
+
+    Все обновления одного пользователя всегда попадают в один и тот же
+    процесс, поэтому context.user_data остается локальным для этого процесса.
+    """
+
+    def __init__(self, queues):
+        self.queues = queues
+        self.routed = [0] * len(queues)
+
+    def route(self, data):
+        index = get_shard_user_id(data) % len(self.queues)
+        self.queues[index].put(data)
+        self.routed[index] += 1
+
+
+def _worker_process(index, queue, build_worker):
+    # Остановкой управляет процесс-приемник: обработчик завершается по None в очереди,
+    # разобрав все, что в ней осталось (SIGTERM менеджер служб шлет всей группе процессов)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    logging.basicConfig(
+        format=f'%(asctime)s - worker{index} - %(name)s - %(levelname)s - %(message)s',
+        level=logging.INFO
+    )
+    asyncio.run(_worker_loop(index, queue, build_worker))
+
+
+async def _worker_loop(index, queue, build_worker):
+    """Процесс-обработчик: обычное Application без собственного приема обновлений"""
+    application = build_worker(index)
+    loop = asyncio.get_running_loop()
+
+    async with application:
+        await application.start()
+        logger.info(f"Обработчик {index} запущен")
+        try:
+            while True:
+                data = await loop.run_in_executor(None, queue.get)
+                if data is None:
+                    break
+                try:
+                    update = Update.de_json(data, application.bot)
+                except Exception as e:
+                    logger.error(f"Не удалось разобрать обновление: {e}")
+                    continue
+                await application.update_queue.put(update)
+        finally:
+            await application.stop()
+
+    if application.post_shutdown:
+        await application.post_shutdown(application)
+    logger.info(f"Обработчик {index} остановлен")
+
+
+async def _poll_updates(token, router, stop_event):
+    """Прием обновлений через getUpdates в процессе-приемнике.
+
+    Ошибки Telegram и раздачи не останавливают прием: иначе процесс
+    продолжал бы жить, но обновления больше не получал бы.
+    """
+    bot = Bot(token)
+    async with bot:
+        await bot.delete_webhook()
+        offset = None
+        try:
+            while not stop_event.is_set():
+                try:
+                    updates = await bot.get_updates(
+                        offset=offset,
+                        timeout=POLL_TIMEOUT,
+                        read_timeout=POLL_TIMEOUT + 10,
+                        allowed_updates=Update.ALL_TYPES
+                    )
+                except RetryAfter as e:
+                    delay = e.retry_after
+                    if isinstance(delay, timedelta):
+                        delay = delay.total_seconds()
+                    logger.warning(f"getUpdates: превышен лимит, пауза {delay} сек")
+                    await asyncio.sleep(delay)
+                    continue
+                except TelegramError as e:
+                    # NetworkError, Conflict (второй экземпляр с тем же токеном) и прочее
+                    logger.warning(f"Ошибка getUpdates: {e}")
+                    await asyncio.sleep(POLL_ERROR_PAUSE)
+                    continue
+                except Exception as e:
+                    logger.exception(f"Непредвиденная ошибка getUpdates: {e}")
+                    await asyncio.sleep(POLL_ERROR_PAUSE)
+                    continue
+                for update in updates:
+                    try:
+                        router.route(update.to_dict())
+                    except Exception as e:
+                        logger.exception(f"Не удалось передать обновление {update.update_id} обработчику: {e}")
+                    offset = update.update_id + 1
+        finally:
+            if offset is not None:
+                # Подтверждаем последнюю пачку, иначе после перезапуска она придет снова
+                try:
+                    await bot.get_updates(offset=offset, timeout=0)
+                except Exception as e:
+                    logger.warning(f"Не удалось подтвердить последние обновления: {e}")
+
+
+async def _supervise(processes, respawn, stop_event):
+    """Перезапуск упавших обработчиков.
+
+    Без этого обновления пользователей шарда копились бы в очереди
+    мертвого процесса, а ответов не было бы. Если обработчик падает
+    слишком часто, приемник останавливается целиком.
+    """
+    restarts = [[] for _ in processes]
+    while not stop_event.is_set():
+        await asyncio.sleep(SUPERVISE_INTERVAL)
+        for index, process in enumerate(processes):
+            if stop_event.is_set() or process.is_alive():
+                continue
+            now = time.monotonic()
+            restarts[index] = [at for at in restarts[index] if now - at < WORKER_RESTART_WINDOW]
+            if len(restarts[index]) >= WORKER_MAX_RESTARTS:
+                logger.critical(
+                    f"Обработчик {index} падает слишком часто (код {process.exitcode}), остановка приемника"
+                )
+                stop_event.set()
+                return
+            restarts[index].append(now)
+            logger.error(f"Обработчик {index} завершился с кодом {process.exitcode}, перезапуск")
+            processes[index] = respawn(index)
+
+
+async def _receive(token, router, mode, webhook_options, processes, respawn):
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop_event.set)
+    supervisor = asyncio.create_task(_supervise(processes, respawn, stop_event))
+
+    if mode == 'webhook':
+        server = WebhookServer(
+            router.route,
+            listen=webhook_options['listen'],
+            port=webhook_options['port'],
+            path=webhook_options['path'],
+            secret_token=webhook_options['secret']
+        )
+        await server.start()
+        async with Bot(token) as bot:
+            await bot.set_webhook(
+                url=webhook_options['url'],
+                secret_token=webhook_options['secret'],
+                allowed_updates=Update.ALL_TYPES
+            )
+        await stop_event.wait()
+        await server.stop()
+    else:
+        poll_task = asyncio.create_task(_poll_updates(token, router, stop_event))
+        await stop_event.wait()
+        poll_task.cancel()
+        try:
+            await poll_task
+        except asyncio.CancelledError:
+            pass
+    supervisor.cancel()
+
+
+def run_sharded(build_worker, workers, token, mode='polling', webhook_options=None):
+    """Запуск одного приемника обновлений и workers процессов-обработчиков.
+
+    build_worker(index) должна быть функцией уровня модуля (передается в
+    дочерний процесс) и возвращать настроенное Application без Updater.
+    Общее состояние между процессами — только база данных SQLite в режиме WAL.
+    Упавший обработчик приемник перезапускает (см. _supervise).
+    """
+    context = multiprocessing.get_context('spawn')
+    queues = [context.Queue() for _ in range(workers)]
+
+    def start_worker(index):
+        process = context.Process(
+            target=_worker_process, args=(index, queues[index], build_worker), name=f'worker{index}'
+        )
+        process.start()
+        return process
+
+    def restart_worker(index):
+        # Процесс, убитый внутри queue.get, оставляет блокировку чтения очереди
+        # захваченной: новый обработчик получает новую очередь, а обновления,
+        # не разобранные упавшим, теряются. ShardRouter видит замену в том же списке
+        dead_queue = queues[index]
+        queues[index] = context.Queue()
+        dead_queue.cancel_join_thread()
+        dead_queue.close()
+        return start_worker(index)
+
+    processes = [start_worker(index) for index in range(workers)]
+    router = ShardRouter(queues)
+    try:
+        asyncio.run(_receive(token, router, mode, webhook_options, processes, restart_worker))
+    finally:
+        for queue in queues:
+            queue.put(None)
+        for process in processes:
+            process.join()
+        logger.info(f"Распределено обновлений по обработчикам: {router.routed}")
@@ -0,0 +1,6 @@
+import os
+import sys
+
+# Модули бота лежат в корне репозитория; config.py требует токен при импорте
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('BOT_TOKEN', '123456:TEST-TOKEN')
@@ -0,0 +1,153 @@
+import asyncio
+import json
+from collections import Counter
+
+import pytest
+from telegram import Update
+from telegram.request import BaseRequest
+
+import main
+from config import ADMIN_IDS
+from database import init_db, add_user_with_terms, add_ride
+from conversation_store import init_conversation_store
+
+BOT_USER = {'id': 1000, 'is_bot': True, 'first_name': 'Bot', 'username': 'test_bot'}
+ADMIN_ID = ADMIN_IDS[0]
+DRIVER_ID = 101
+PASSENGER_ID = 102
+STRANGER_ID = 103
+
+
+class FakeRequest(BaseRequest):
+    """Вместо HTTP к Telegram: запоминает вызванные методы API и отвечает правдоподобными данными"""
+
+    def __init__(self):
+        self.calls = Counter()
+
+    @property
+    def read_timeout(self):
+        return None
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    async def do_request(self, url, method, request_data=None, read_timeout=None, write_timeout=None,
+                         connect_timeout=None, pool_timeout=None):
+        endpoint = url.rsplit('/', 1)[-1]
+        self.calls[endpoint] += 1
+        params = request_data.parameters if request_data else {}
+        if endpoint == 'getMe':
+            result = BOT_USER
+        elif endpoint == 'getChatMember':
+            result = {'status': 'member', 'user': {'id': params.get('user_id', 1), 'is_bot': False, 'first_name': 'U'}}
+        elif endpoint in ('sendMessage', 'editMessageText', 'editMessageReplyMarkup'):
+            result = {
+                'message_id': 50, 'date': 0, 'text': params.get('text', ''), 'from': BOT_USER,
+                'chat': {'id': params.get('chat_id', 1), 'type': 'private'},
+            }
+        else:
+            result = True
+        return 200, json.dumps({'ok': True, 'result': result}).encode('utf-8')
+
+
+@pytest.fixture
+def bot(tmp_path, monkeypatch):
+    """Приложение бота с поддельными запросами к API и чистой базой во временном каталоге"""
+    monkeypatch.chdir(tmp_path)
+    init_db()
+    init_conversation_store()
+    add_user_with_terms(DRIVER_ID, 'driver', '+70000000001', True)
+    add_user_with_terms(PASSENGER_ID, 'passenger', '+70000000002', True)
+    add_user_with_terms(STRANGER_ID, 'stranger', '+70000000003', True)
+
+    fake = FakeRequest()
+    builder = main.Application.builder
+    monkeypatch.setattr(
+        main.Application, 'builder',
+        staticmethod(lambda: builder().request(fake).get_updates_request(FakeRequest()))
+    )
+    application = main.build_application(periodic_jobs=False)
+    asyncio.run(application.initialize())
+    fake.calls.clear()
+    yield application, fake
+    asyncio.run(application.shutdown())
+
+
+def press(application, fake, user_id, data, role=None):
+    """Нажатие inline-кнопки: возвращает методы API, вызванные при обработке"""
+    press.update_id += 1
+    if role is not None:
+        application.user_data[user_id]['role'] = role
+    update = Update.de_json({
+        'update_id': press.update_id,
+        'callback_query': {
+            'id': str(press.update_id),
+            'from': {'id': user_id, 'is_bot': False, 'first_name': 'U'},
+            'chat_instance': '1',
+            'data': data,
+            'message': {
+                'message_id': 10, 'date': 0, 'text': 'меню', 'from': BOT_USER,
+                'chat': {'id': user_id, 'type': 'private'},
+            },
+        },
+    }, application.bot)
+    fake.calls.clear()
+    asyncio.run(application.process_update(update))
+    return dict(fake.calls)
+
+
+press.update_id = 0
+
+
+ANSWER_AND_EDIT = {'answerCallbackQuery': 1, 'editMessageText': 1}
+ANSWER_AND_SEND = {'answerCallbackQuery': 1, 'sendMessage': 1}
+ANSWER_ONLY = {'answerCallbackQuery': 1}
+
+
+def test_navigation_edits_in_place(bot):
+    application, fake = bot
+    assert press(application, fake, DRIVER_ID, main.CALLBACKS.encode('back_to_driver'), 'driver') == ANSWER_AND_EDIT
+    assert press(application, fake, PASSENGER_ID, main.CALLBACKS.encode('back_to_passenger'), 'passenger') == ANSWER_AND_EDIT
+    assert press(application, fake, PASSENGER_ID, main.CALLBACKS.encode('back_to_passenger_search'), 'passenger') == ANSWER_AND_EDIT
+
+
+def test_contact_card_is_one_message(bot):
+    application, fake = bot
+    ride_id = add_ride(DRIVER_ID, 'Москва', 'Казань', '2099-12-31', '10:00', 3)
+    calls = press(application, fake, PASSENGER_ID, main.CALLBACKS.encode('contact', ride_id), 'passenger')
+    assert calls == ANSWER_AND_SEND
+
+
+def test_end_ride_budget_and_ownership(bot):
+    application, fake = bot
+    ride_id = add_ride(DRIVER_ID, 'Москва', 'Казань', '2099-12-31', '10:00', 3)
+
+    # Чужой водитель получает только уведомление, поездка остается активной
+    assert press(application, fake, STRANGER_ID, main.CALLBACKS.encode('end_ride', ride_id), 'driver') == ANSWER_ONLY
+    assert main.get_ride_by_id(ride_id)[8] == 1
+
+    assert press(application, fake, DRIVER_ID, main.CALLBACKS.encode('end_ride', ride_id), 'driver') == ANSWER_AND_EDIT
+
+
+def test_admin_actions_answer_once(bot):
+    application, fake = bot
+    ride_id = add_ride(DRIVER_ID, 'Москва', 'Казань', '2099-12-31', '10:00', 3)
+    assert press(application, fake, ADMIN_ID, main.CALLBACKS.encode('admin_stats')) == ANSWER_AND_EDIT
+    assert press(application, fake, ADMIN_ID, main.CALLBACKS.encode('admin_delete_ride', ride_id)) == ANSWER_AND_EDIT
+    assert press(application, fake, ADMIN_ID, main.CALLBACKS.encode('admin_exit')) == ANSWER_AND_EDIT
+
+
+def test_rejected_buttons_answer_once(bot):
+    application, fake = bot
+    ride_id = add_ride(DRIVER_ID, 'Москва', 'Казань', '2099-12-31', '10:00', 3)
+    # Админская кнопка у обычного пользователя, поддельная подпись и старый формат с id
+    assert press(application, fake, STRANGER_ID, main.CALLBACKS.encode('admin_stats')) == ANSWER_ONLY
+    signed = main.CALLBACKS.encode('end_ride', ride_id)
+    # Меняем последний символ подписи при любом токене
+    forged = signed[:-1] + ('A' if signed[-1] != 'A' else 'B')
+    assert press(application, fake, STRANGER_ID, forged) == ANSWER_ONLY
+    assert press(application, fake, STRANGER_ID, f"end_ride_{ride_id}") == ANSWER_ONLY
+    assert main.get_ride_by_id(ride_id)[8] == 1
@@ -0,0 +1,66 @@
+import asyncio
+import random
+from types import SimpleNamespace
+
+from concurrency import PerUserUpdateProcessor
+
+USERS = 10
+UPDATES_PER_USER = 25
+
+
+def _update(user_id):
+    return SimpleNamespace(effective_user=SimpleNamespace(id=user_id), effective_chat=None)
+
+
+async def _stress(seed):
+    rng = random.Random(seed)
+    processor = PerUserUpdateProcessor(64)
+    handled = {user_id: [] for user_id in range(USERS)}
+    running = set()
+    overlaps = []
+
+    async def handler(user_id, seq):
+        if user_id in running:
+            overlaps.append((user_id, seq))
+        running.add(user_id)
+        try:
+            await asyncio.sleep(rng.random() * 0.002)
+            handled[user_id].append(seq)
+        finally:
+            running.discard(user_id)
+
+    loop = asyncio.get_running_loop()
+    tasks = []
+    coroutines = []
+    for seq in range(UPDATES_PER_USER):
+        for user_id in range(USERS):
+            coroutine = handler(user_id, seq)
+            coroutines.append(coroutine)
+            task = loop.create_task(processor.process_update(_update(user_id), coroutine))
+            tasks.append((user_id, seq, task))
+            # Часть обновлений отменяется: до начала, во время ожидания очереди или посреди обработки
+            if rng.random() < 0.15:
+                loop.call_later(rng.random() * 0.02, task.cancel)
+
+    await asyncio.gather(*(task for _, _, task in tasks), return_exceptions=True)
+    # Задача, отмененная до первого шага, не успевает ни запустить, ни закрыть обработчик
+    for coroutine in coroutines:
+        coroutine.close()
+    # Колбэки завершения цепочек выполняются на следующих итерациях цикла
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+    return processor, handled, overlaps, tasks
+
+
+def test_per_user_order_survives_delays_and_cancellations():
+    for seed in range(5):
+        processor, handled, overlaps, tasks = asyncio.run(_stress(seed))
+
+        assert overlaps == [], "обновления одного пользователя выполнялись одновременно"
+        for user_id in range(USERS):
+            completed = [seq for uid, seq, task in tasks if uid == user_id and not task.cancelled()]
+            assert handled[user_id] == completed
+        assert any(task.cancelled() for _, _, task in tasks)
+        assert processor._tails == {}
+        assert processor.active_users == 0
@@ -0,0 +1,98 @@
+import asyncio
+
+import pytest
+
+from webhook import MAX_BODY_SIZE, WebhookServer, replay_updates
+
+PATH = '/telegram'
+SECRET = 'test-secret'
+RECORDED = [
+    {
+        'update_id': 1,
+        'message': {
+            'message_id': 1, 'date': 0, 'text': '/start',
+            'from': {'id': 101, 'is_bot': False, 'first_name': 'U'},
+            'chat': {'id': 101, 'type': 'private'},
+        },
+    },
+    {
+        'update_id': 2,
+        'callback_query': {
+            'id': '2', 'chat_instance': '1', 'data': 'as',
+            'from': {'id': 102, 'is_bot': False, 'first_name': 'U'},
+        },
+    },
+    {
+        'update_id': 3,
+        'inline_query': {
+            'id': '3', 'query': 'Москва Казань', 'offset': '',
+            'from': {'id': 103, 'is_bot': False, 'first_name': 'U'},
+        },
+    },
+]
+
+
+async def serve(scenario):
+    """Сервер на свободном порту: scenario(server, delivered) выполняется, пока он работает"""
+    delivered = []
+    server = WebhookServer(delivered.append, port=0, path=PATH, secret_token=SECRET)
+    await server.start()
+    try:
+        return await scenario(server, delivered)
+    finally:
+        await server.stop()
+
+
+async def raw_request(port, head, body=b''):
+    """Один HTTP-запрос как есть: строка статуса ответа"""
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    try:
+        writer.write(head.encode('latin-1') + b'\r\n' + body)
+        await writer.drain()
+        return (await reader.readline()).decode('latin-1').split(' ')[1]
+    finally:
+        writer.close()
+
+
+def post(path=PATH, secret=SECRET, length=2, method='POST'):
+    head = f"{method} {path} HTTP/1.1\r\nHost: localhost\r\nContent-Length: {length}\r\n"
+    if secret is not None:
+        head += f"X-Telegram-Bot-Api-Secret-Token: {secret}\r\n"
+    return head
+
+
+def test_replayed_updates_are_delivered():
+    async def scenario(server, delivered):
+        latencies = await replay_updates(f"http://127.0.0.1:{server.port}{PATH}", RECORDED, SECRET)
+        return latencies, delivered
+
+    latencies, delivered = asyncio.run(serve(scenario))
+    assert len(latencies) == len(RECORDED)
+    assert delivered == RECORDED
+
+
+@pytest.mark.parametrize('head, body, status', [
+    (post(secret='wrong'), b'{}', '403'),
+    (post(secret=None), b'{}', '403'),
+    (post(path='/other'), b'{}', '404'),
+    (post(method='GET', length=0), b'', '405'),
+    (post(length=MAX_BODY_SIZE + 1), b'', '413'),
+    (post(length=-5), b'', '400'),
+    (post(length=8), b'not json', '400'),
+])
+def test_rejected_requests(head, body, status):
+    async def scenario(server, delivered):
+        return await raw_request(server.port, head, body), delivered, server.rejected
+
+    answer, delivered, rejected = asyncio.run(serve(scenario))
+    assert answer == status
+    assert delivered == []
+    assert rejected == 1
+
+
+def test_wrong_secret_with_large_body_is_not_read():
+    # Ответ приходит, хотя заявленное тело так и не отправлено
+    async def scenario(server, delivered):
+        return await asyncio.wait_for(raw_request(server.port, post(secret='wrong', length=MAX_BODY_SIZE)), 5)
+
+    assert asyncio.run(serve(scenario)) == '403'
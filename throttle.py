@@ -0,0 +1,114 @@
+import logging
+import time
+from collections import defaultdict
+
+logger = logging.getLogger(__name__)
+
+# Как часто удалять из памяти полные (неиспользуемые) корзины, секунды
+PRUNE_INTERVAL = 60
+# Замеры старше этого срока не влияют на решение о сбросе нагрузки
+LATENCY_STALE_AFTER = 30
+
+
+class TokenBucket:
+    __slots__ = ('tokens', 'updated', 'notified')
+
+    def __init__(self, burst, now):
+        self.tokens = float(burst)
+        self.updated = now
+        # Пользователь уже получил сообщение об ограничении
+        self.notified = False
+
+
+class FloodControl:
+    """Ограничение частоты действий по схеме token bucket.
+
+    Отдельная корзина на каждую пару (пользователь, класс действия):
+    limits = {класс: (токенов в секунду, максимум токенов)}.
+    Класс 'default' применяется ко всему, что не классифицировано.
+    """
+
+    def __init__(self, limits):
+        self.limits = limits
+        self.buckets = {}
+        self.stats = defaultdict(int)
+        self._last_prune = time.monotonic()
+
+    def allow(self, user_id, action_class):
+        """Списывает токен. Возвращает (разрешено, нужно ли уведомить пользователя)"""
+        rate, burst = self.limits.get(action_class) or self.limits['default']
+        now = time.monotonic()
+        key = (user_id, action_class)
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            bucket = self.buckets[key] = TokenBucket(burst, now)
+        else:
+            bucket.tokens = min(burst, bucket.tokens + (now - bucket.updated) * rate)
+            bucket.updated = now
+
+        if now - self._last_prune > PRUNE_INTERVAL:
+            self._prune(now)
+
+        if bucket.tokens >= 1:
+            bucket.tokens -= 1
+            bucket.notified = False
+            self.stats[('allowed', action_class)] += 1
+            return True, False
+
+        self.stats[('throttled', action_class)] += 1
+        notify = not bucket.notified
+        bucket.notified = True
+        return False, notify
+
+    def record_shed(self, action_class):
+        self.stats[('shed', action_class)] += 1
+
+    def _prune(self, now):
+        """Корзины, которые успели наполниться, ничем не отличаются от новых"""
+        self._last_prune = now
+        full = [
+            key for key, bucket in self.buckets.items()
+            if bucket.tokens + (now - bucket.updated) * self.limits.get(key[1], self.limits['default'])[0]
+            >= self.limits.get(key[1], self.limits['default'])[1]
+        ]
+        for key in full:
+            del self.buckets[key]
+
+    def report(self):
+        """{класс: (разрешено, ограничено, сброшено)} для админ-панели"""
+        classes = sorted({action_class for _, action_class in self.stats})
+        return {
+            action_class: (
+                self.stats[('allowed', action_class)],
+                self.stats[('throttled', action_class)],
+                self.stats[('shed', action_class)],
+            )
+            for action_class in classes
+        }
+
+
+class LatencyMonitor:
+    """Скользящее среднее задержек БД и Telegram API.
+
+    thresholds = {вид: порог в секундах}. Если свежее среднее хотя бы
+    одного вида выше порога, второстепенная работа отбрасывается.
+    """
+
+    def __init__(self, thresholds, alpha=0.2):
+        self.thresholds = thresholds
+        self.alpha = alpha
+        self.averages = {}
+        self.updated = {}
+
+    def observe(self, kind, seconds):
+        previous = self.averages.get(kind)
+        self.averages[kind] = seconds if previous is None else previous + self.alpha * (seconds - previous)
+        self.updated[kind] = time.monotonic()
+
+    def overloaded(self):
+        now = time.monotonic()
+        for kind, threshold in self.thresholds.items():
+            average = self.averages.get(kind)
+            if average is not None and average > threshold and now - self.updated[kind] < LATENCY_STALE_AFTER:
+                return True
+        return False
@@ -0,0 +1,169 @@
+import asyncio
+import hmac
+import json
+import logging
+import sys
+import time
+from urllib.parse import urlsplit
+
+logger = logging.getLogger(__name__)
+
+SECRET_HEADER = 'x-telegram-bot-api-secret-token'
+MAX_BODY_SIZE = 1024 * 1024
+
+RESPONSES = {
+    200: b'HTTP/1.1 200 OK\r\nContent-Length: 0\r\n\r\n',
+    400: b'HTTP/1.1 400 Bad Request\r\nContent-Length: 0\r\nConnection: close\r\n\r\n',
+    403: b'HTTP/1.1 403 Forbidden\r\nContent-Length: 0\r\nConnection: close\r\n\r\n',
+    404: b'HTTP/1.1 404 Not Found\r\nContent-Length: 0\r\nConnection: close\r\n\r\n',
+    405: b'HTTP/1.1 405 Method Not Allowed\r\nContent-Length: 0\r\nConnection: close\r\n\r\n',
+    413: b'HTTP/1.1 413 Payload Too Large\r\nContent-Length: 0\r\nConnection: close\r\n\r\n',
+}
+
+
+class WebhookServer:
+    """Минимальный HTTP-сервер на asyncio для приема обновлений Telegram.
+
+    Проверяет путь и секретный токен из заголовка, передает разобранный JSON
+    в on_update (синхронная функция, которая только ставит обновление
+    в очередь) и сразу отвечает 200, не дожидаясь обработки.
+    Соединения поддерживают keep-alive.
+    """
+
+    def __init__(self, on_update, listen='127.0.0.1', port=8443, path='/telegram', secret_token=None):
+        self.on_update = on_update
+        self.listen = listen
+        self.port = port
+        self.path = path
+        self.secret_token = secret_token.encode() if secret_token else None
+        self.received = 0
+        self.rejected = 0
+        self._server = None
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle_connection, self.listen, self.port)
+        # port=0 — свободный порт от системы (тесты и замеры)
+        self.port = self._server.sockets[0].getsockname()[1]
+        logger.info(f"Webhook-сервер слушает {self.listen}:{self.port}{self.path}")
+
+    async def stop(self):
+        if self._server:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def _handle_connection(self, reader, writer):
+        try:
+            while True:
+                status = await self._handle_request(reader)
+                if status is None:
+                    break
+                writer.write(RESPONSES[status])
+                await writer.drain()
+                if status != 200:
+                    self.rejected += 1
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.LimitOverrunError):
+            pass
+        except Exception as e:
+            logger.error(f"Ошибка webhook-соединения: {e}")
+        finally:
+            writer.close()
+
+    async def _handle_request(self, reader):
+        """Читает один запрос и возвращает HTTP-статус ответа (None — соединение закрыто)"""
+        request_line = await reader.readline()
+        if not request_line:
+            return None
+        try:
+            method, target, _ = request_line.decode('latin-1').split(' ', 2)
+        except ValueError:
+            return 400
+
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+
+        # Тело читается только после проверки пути, метода и секрета:
+        # посторонний клиент не заставит сервер буферизовать мегабайт
+        if urlsplit(target).path != self.path:
+            return 404
+        if method != 'POST':
+            return 405
+        if self.secret_token and not hmac.compare_digest(
+            headers.get(SECRET_HEADER, '').encode('latin-1'), self.secret_token
+        ):
+            return 403
+
+        try:
+            length = int(headers.get('content-length', 0))
+        except ValueError:
+            return 400
+        if length < 0:
+            return 400
+        if length > MAX_BODY_SIZE:
+            return 413
+        body = await reader.readexactly(length) if length else b''
+
+        try:
+            data = json.loads(body)
+        except ValueError:
+            return 400
+
+        self.received += 1
+        try:
+            self.on_update(data)
+        except Exception as e:
+            # Битое обновление не должно приводить к повторной доставке от Telegram
+            logger.error(f"Ошибка при постановке обновления в очередь: {e}")
+        return 200
+
+
+async def replay_updates(url, updates, secret_token=None):
+    """Отправляет записанные обновления на локальный webhook (для проверки и замеров).
+
+    Возвращает список задержек ответа в секундах.
+    """
+    parts = urlsplit(url)
+    reader, writer = await asyncio.open_connection(parts.hostname, parts.port or 80)
+    latencies = []
+    try:
+        for update in updates:
+            body = json.dumps(update).encode('utf-8')
+            request = (
+                f"POST {parts.path or '/'} HTTP/1.1\r\n"
+                f"Host: {parts.hostname}\r\n"
+                "Content-Type: application/json\r\n"
+                f"Content-Length: {len(body)}\r\n"
+            )
+            if secret_token:
+                request += f"X-Telegram-Bot-Api-Secret-Token: {secret_token}\r\n"
+            started = time.perf_counter()
+            writer.write(request.encode('latin-1') + b'\r\n' + body)
+            await writer.drain()
+            status_line = await reader.readline()
+            while (await reader.readline()) not in (b'\r\n', b''):
+                pass
+            latencies.append(time.perf_counter() - started)
+            if b' 200 ' not in status_line:
+                raise RuntimeError(f"Webhook ответил: {status_line.decode().strip()}")
+    finally:
+        writer.close()
+    return latencies
+
+
+if __name__ == '__main__':
+    # python webhook.py http://127.0.0.1:8443/telegram updates.jsonl [секрет]
+    with open(sys.argv[2], encoding='utf-8') as f:
+        recorded = [json.loads(line) for line in f if line.strip()]
+    results = asyncio.run(replay_updates(sys.argv[1], recorded, sys.argv[3] if len(sys.argv) > 3 else None))
+    if not results:
+        sys.exit("Нет записанных обновлений")
+    results.sort()
+    print(f"Отправлено {len(results)} обновлений, "
+          f"медиана {results[len(results) // 2] * 1000:.2f} мс, "
+          f"p99 {results[int(len(results) * 0.99)] * 1000:.2f} мс")